@@ -8,6 +8,22 @@ WEATHER = "WTH"
 CURRENCY = "CUR"
 SUBSCRIBE = "SUB"
 UNSUBSCRIBE = "USB"
+DIRECT = "DMS"
+BATCH = "BAT"
+PING = "PNG"
+PONG = "PON"
+RESUME = "RES"
+STREAM = "STR"
+CONVERT = "CNV"
+ALERT = "ALR"
+SEARCH = "SRC"
+ANNOUNCEMENT = "ANN"
+DISCOVER = "DSC"
+PEER = "PER"
+FEDERATED = "FED"
+DOCUMENT = "DOC"
+DOCUMENT_LIST = "DLS"
+ENTRIES = "ENT"
 
 WEATHER_GET = f"{WEATHER}{DELIMITER}"
 CURRENCY_GET = f"{CURRENCY}{DELIMITER}"
@@ -15,7 +31,31 @@ SUBSCRIBE_REQUEST = f"{SUBSCRIBE}{DELIMITER}"
 UNSUBSCRIBE_REQUEST = f"{UNSUBSCRIBE}{DELIMITER}"
 
 CHAT_MESSAGE = f"MSG{DELIMITER}"
+DIRECT_MESSAGE = f"{DIRECT}{DELIMITER}"
+BATCH_REQUEST = f"{BATCH}{DELIMITER}"
+BATCH_SEPARATOR = "@@|<<&&>>|@@"
+PING_REQUEST = f"{PING}{DELIMITER}"
+PONG_RESPONSE = f"{PONG}{DELIMITER}"
+RESUME_REQUEST = f"{RESUME}{DELIMITER}"
+STREAM_FRAME = f"{STREAM}{DELIMITER}"
+STREAM_FRAME_PREFIX = STREAM_FRAME.encode()
+STREAM_CLOSE_REQUEST = f"END{DELIMITER}"
 REGISTER_USER = f"REG{DELIMITER}"
+CONVERT_REQUEST = f"{CONVERT}{DELIMITER}"
+ALERT_REQUEST = f"{ALERT}{DELIMITER}"
+ALERT_REMOVE_REQUEST = f"ALD{DELIMITER}"
+ALERT_NOTIFICATION = f"ALN{DELIMITER}"
+SEARCH_REQUEST = f"{SEARCH}{DELIMITER}"
+ANNOUNCEMENT_MESSAGE = f"{ANNOUNCEMENT}{DELIMITER}"
+DISCOVERY_REQUEST = f"{DISCOVER}{DELIMITER}"
+PEER_HELLO = f"{PEER}{DELIMITER}"
+FEDERATED_MESSAGE = f"{FEDERATED}{DELIMITER}"
+DOCUMENT_REQUEST = f"{DOCUMENT}{DELIMITER}"
+DOCUMENT_CHUNK_PREFIX = DOCUMENT_REQUEST.encode()
+DOCUMENT_LIST_REQUEST = f"{DOCUMENT_LIST}{DELIMITER}"
+ENTRY_REPORT_REQUEST = f"{ENTRIES}{DELIMITER}"
+FEDERATION_STREAM_ID = 0  # Gateways number their streams from 1, a server peer sends its batches on stream 0
+CONNECTION_STREAM_ID = 0  # The requests and the responses of a plain connection are framed on stream 0
 
 OK = f"OK.{DELIMITER}"
 ERROR = f"ERR.{DELIMITER}"
@@ -25,13 +65,55 @@ WELCOME_TO_THE_SERVER = f"Welcome to the server!{DELIMITER}"
 DEFAULT_WEATHER_DICT = WeatherDataFetcher.EMPTY_WEATHER_DATA
 DEFAULT_CURRENCY_DICT = CurrencyDataFetcher.EMPTY_CURRENCY_DATA
 DEFAULT_UPDATE_RATE = 60
+DEFAULT_PING_INTERVAL = 30  # An idle connection is pinged after X seconds
+DEFAULT_IDLE_TIMEOUT = 90  # An idle connection that did not answer the ping is closed after X seconds
+
+DEFAULT_CHANNEL = "general"
 
 DEFAULT_HOST = "0.0.0.0"
 DEFAULT_PORT = 8080
+DEFAULT_DISCOVERY_PORT = 8089  # UDP port the servers answer the discovery broadcasts of the clients on
+
+
+def construct_chat_message(message, channel=DEFAULT_CHANNEL, sequence_no=None):
+    """The channel (and the sequence number given by the server) are sent after the message so that strip_delimiter
+    still returns the message"""
+    if sequence_no is None:
+        return f"{CHAT_MESSAGE}{message}{DELIMITER}{channel}"
+    return f"{CHAT_MESSAGE}{message}{DELIMITER}{channel}{DELIMITER}{sequence_no}"
+
+
+def parse_chat_message(data):
+    """Parse a chat message, messages without a channel belong to the default channel"""
+    parts = data.split(DELIMITER)
+    channel = parts[2] if len(parts) > 2 and parts[2] else DEFAULT_CHANNEL
+    sequence_no = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else None
+    return {'message': parts[1], 'channel': channel, 'sequence_no': sequence_no}
+
+
+def construct_subscribe_request(channel=DEFAULT_CHANNEL):
+    return f"{SUBSCRIBE_REQUEST}{channel}"
+
+
+def construct_unsubscribe_request(channel=DEFAULT_CHANNEL):
+    return f"{UNSUBSCRIBE_REQUEST}{channel}"
+
+
+def parse_channel_request(data):
+    """Parse the channel name of a SUB/USB request, an empty channel name means the default channel"""
+    channel = data.split(DELIMITER, 1)[1]
+    return channel if channel else DEFAULT_CHANNEL
+
+
+def construct_direct_message(apartment_no, message):
+    """Construct a message that is delivered only to the connections of the given apartment"""
+    return f"{DIRECT_MESSAGE}{apartment_no}{DELIMITER}{message}"
 
 
-def construct_chat_message(message):
-    return f"{CHAT_MESSAGE}{message}"
+def parse_direct_message(data):
+    """Parse a direct message request, returns the target apartment number and the message"""
+    _, apartment_no, message = data.split(DELIMITER, 2)
+    return {'apartment_no': apartment_no, 'message': message}
 
 
 def construct_weather_response(data):
@@ -42,6 +124,210 @@ def construct_currency_response(data):
     return f"{CURRENCY}{DELIMITER}{data}"
 
 
+def construct_announcement(message):
+    """An announcement of the management, it is delivered to every connection before their queued chat messages"""
+    return f"{ANNOUNCEMENT_MESSAGE}{message}"
+
+
+def parse_announcement(data):
+    return strip_delimiter(data)
+
+
+def construct_discovery_response(server_id, port, load):
+    """The advertisement of a server, the client reads the host from the address the datagram came from"""
+    return f"{DISCOVERY_REQUEST}{server_id}{DELIMITER}{port}{DELIMITER}{load}"
+
+
+def parse_discovery_response(data):
+    _, server_id, port, load = data.split(DELIMITER)
+    return {'server_id': server_id, 'port': int(port), 'load': int(load)}
+
+
+def construct_peer_hello(node_id, sent_at, proof):
+    """Sent by a server that connects to another server to relay messages, instead of registering a card, and sent
+    back by the server that accepts the link. proof signs the block name and the time with the federation secret."""
+    return f"{PEER_HELLO}{node_id}{DELIMITER}{sent_at}{DELIMITER}{proof}"
+
+
+def parse_peer_hello(data):
+    _, node_id, sent_at, proof = data.split(DELIMITER)
+    return {'node_id': node_id, 'sent_at': sent_at, 'proof': proof}
+
+
+def construct_federated_message(origin, message_id, path, message):
+    """Wraps a message relayed between servers. path lists the servers it went through, starting with its origin, so
+    that it is never relayed back to one of them. The message is a chat message, an announcement or a weather or
+    currency response of this protocol."""
+    return f"{FEDERATED_MESSAGE}{origin}{DELIMITER}{message_id}{DELIMITER}{','.join(path)}{DELIMITER}{message}"
+
+
+def parse_federated_message(data):
+    _, origin, message_id, path, message = data.split(DELIMITER, 4)
+    return {'origin': origin, 'message_id': message_id, 'path': path.split(','), 'message': message}
+
+
+def construct_document_list_response(documents):
+    """documents is a list of (name, size in bytes)"""
+    return DOCUMENT_LIST_REQUEST + DELIMITER.join(f"{name}{DELIMITER}{size}" for name, size in documents)
+
+
+def parse_document_list_response(data):
+    parts = data.split(DELIMITER)[1:]
+    return [(parts[i], int(parts[i + 1])) for i in range(0, len(parts) - 1, 2)]
+
+
+def construct_download_request(name, offset=0):
+    """Asks for the document from the given byte on, a partly downloaded document is resumed from its size"""
+    return f"{DOCUMENT_REQUEST}{name}{DELIMITER}{offset}"
+
+
+def parse_download_request(data):
+    _, name, offset = data.split(DELIMITER)
+    return {'name': name, 'offset': int(offset)}
+
+
+def construct_document_chunk_header(name, offset, length, size):
+    """The header of a chunk of a document, it is followed by length raw bytes of the document"""
+    return f"{DOCUMENT_REQUEST}{name}{DELIMITER}{offset}{DELIMITER}{length}{DELIMITER}{size}{DELIMITER}"
+
+
+def split_document_chunk(buffer: bytes):
+    """Splits the document chunk at the start of the received bytes out of them.
+    Returns {'name', 'offset', 'size', 'data'} and the rest of the bytes, or None and the bytes if the chunk is not
+    complete yet."""
+    delimiter = DELIMITER.encode()
+    header_end = len(DOCUMENT_CHUNK_PREFIX)
+    for _ in range(4):  # name, offset, length, size
+        header_end = buffer.find(delimiter, header_end)
+        if header_end == -1:
+            return None, buffer
+        header_end += len(delimiter)
+    name, offset, length, size = buffer[len(DOCUMENT_CHUNK_PREFIX):header_end - len(delimiter)].split(delimiter)
+    data_end = header_end + int(length)
+    if len(buffer) < data_end:
+        return None, buffer
+    chunk = {'name': name.decode(), 'offset': int(offset), 'size': int(size), 'data': buffer[header_end:data_end]}
+    return chunk, buffer[data_end:]
+
+
+def construct_entry_report_request(report, start, end):
+    """Asks for a report of the card entries between two unix timestamps, the report is one of hours, apartments and
+    anomalies"""
+    return f"{ENTRY_REPORT_REQUEST}{report}{DELIMITER}{int(start)}{DELIMITER}{int(end)}"
+
+
+def parse_entry_report_request(data):
+    """Raises ValueError if the time range is not two numbers"""
+    _, report, start, end = data.split(DELIMITER)
+    return {'report': report, 'start': int(start), 'end': int(end)}
+
+
+def construct_entry_report_response(report, rows):
+    """rows are the 24 entry counts of the hours of the day, (apartment_no, count) pairs for the apartments report or
+    (kind, subject, count) triples for the anomalies report"""
+    if report == "hours":
+        fields = [str(count) for count in rows]
+    else:
+        fields = [str(field) for row in rows for field in row]
+    return DELIMITER.join([f"{ENTRY_REPORT_REQUEST}{report}", *fields])
+
+
+def parse_entry_report_response(data):
+    report, *parts = data.split(DELIMITER)[1:]
+    if report == "hours":
+        rows = [int(count) for count in parts]
+    elif report == "apartments":
+        rows = [(int(parts[i]), int(parts[i + 1])) for i in range(0, len(parts) - 1, 2)]
+    else:
+        rows = [(parts[i], parts[i + 1], int(parts[i + 2])) for i in range(0, len(parts) - 2, 3)]
+    return {'report': report, 'rows': rows}
+
+
+def construct_convert_request(conversions):
+    """Converts one or more amounts in one request, conversions is a list of (amount, from_currency, to_currency)"""
+    return CONVERT_REQUEST + DELIMITER.join(f"{amount}{DELIMITER}{from_currency}{DELIMITER}{to_currency}"
+                                            for amount, from_currency, to_currency in conversions)
+
+
+def parse_convert_request(data):
+    """Returns the list of (amount, from_currency, to_currency), raises ValueError if the request is malformed"""
+    parts = data.split(DELIMITER)[1:]
+    if not parts or len(parts) % 3 != 0:
+        raise ValueError("Conversions should be sent as amount, from currency and to currency")
+    return [(float(parts[i]), parts[i + 1].upper(), parts[i + 2].upper()) for i in range(0, len(parts), 3)]
+
+
+def construct_convert_response(results):
+    return CONVERT_REQUEST + DELIMITER.join(str(result) for result in results)
+
+
+def parse_convert_response(data):
+    return [float(result) for result in data.split(DELIMITER)[1:]]
+
+
+def construct_alert_request(metric, direction, threshold):
+    """Asks to be notified every time the metric (e.g. USD, temperature_celcius) crosses the threshold in the
+    direction, > for upwards and < for downwards. The server answers with the id of the alert."""
+    return f"{ALERT_REQUEST}{metric}{DELIMITER}{direction}{DELIMITER}{threshold}"
+
+
+def parse_alert_request(data):
+    """Raises ValueError if the threshold is not a number"""
+    _, metric, direction, threshold = data.split(DELIMITER)
+    return {'metric': metric, 'direction': direction, 'threshold': float(threshold)}
+
+
+def construct_alert_response(alert_id):
+    return f"{ALERT_REQUEST}{alert_id}"
+
+
+def parse_alert_response(data):
+    return int(strip_delimiter(data))
+
+
+def construct_alert_remove_request(alert_id):
+    return f"{ALERT_REMOVE_REQUEST}{alert_id}"
+
+
+def parse_alert_remove_request(data):
+    return int(strip_delimiter(data))
+
+
+def construct_alert_notification(alert_id, metric, direction, threshold, value):
+    return DELIMITER.join([f"{ALERT_NOTIFICATION}{alert_id}", metric, direction, str(threshold), str(value)])
+
+
+def parse_alert_notification(data):
+    _, alert_id, metric, direction, threshold, value = data.split(DELIMITER)
+    return {'alert_id': int(alert_id), 'metric': metric, 'direction': direction, 'threshold': float(threshold),
+            'value': float(value)}
+
+
+def construct_search_request(query, page=1, channel=""):
+    """Searches the chat history for the messages that contain every word of the query, an empty channel searches
+    every channel the resident can read"""
+    return DELIMITER.join([f"{SEARCH_REQUEST}{query}", str(page), channel])
+
+
+def parse_search_request(data):
+    """Raises ValueError if the page is not a number"""
+    _, query, page, channel = data.split(DELIMITER)
+    return {'query': query, 'page': int(page), 'channel': channel or None}
+
+
+def construct_search_response(total, page, results):
+    """results is a list of (sequence_no, channel, message), newest first"""
+    return DELIMITER.join([f"{SEARCH_REQUEST}{total}", str(page),
+                           *(f"{sequence_no}{DELIMITER}{channel}{DELIMITER}{message}"
+                             for sequence_no, channel, message in results)])
+
+
+def parse_search_response(data):
+    parts = data.split(DELIMITER)[1:]
+    results = [(int(parts[i]), parts[i + 1], parts[i + 2]) for i in range(2, len(parts), 3)]
+    return {'total': int(parts[0]), 'page': int(parts[1]), 'results': results}
+
+
 def register_client_to_server(card: ClientCard):
     """Register a client to the server
     card_data: dict with keys 'name' and 'apartment_no'"""
@@ -53,5 +339,84 @@ def parse_register_response(data):
     return {'name': data.split(DELIMITER)[1], 'apartment_no': data.split(DELIMITER)[2]}
 
 
+def construct_session_response(command, card_id, session_token):
+    """The answer to REG and RES: the card id and the token that can be used to resume the session later"""
+    return f"{command}{card_id}{DELIMITER}{session_token}"
+
+
+def parse_session_response(data):
+    parts = data.split(DELIMITER)
+    return {'card_id': parts[1], 'session_token': parts[2]}
+
+
+def construct_resume_request(session_token, last_sequence_no):
+    """Resume a session after reconnecting, the messages after last_sequence_no will be replayed"""
+    return f"{RESUME_REQUEST}{session_token}{DELIMITER}{last_sequence_no}"
+
+
+def parse_resume_request(data):
+    parts = data.split(DELIMITER)
+    return {'session_token': parts[1], 'last_sequence_no': int(parts[2])}
+
+
+def construct_batch(messages):
+    """Packs several requests (or responses) into a single frame, they are handled in the given order"""
+    return f"{BATCH_REQUEST}{BATCH_SEPARATOR.join(messages)}"
+
+
+def parse_batch(data):
+    """Unpacks the requests (or responses) of a batch frame"""
+    body = data[len(BATCH_REQUEST):]
+    return body.split(BATCH_SEPARATOR) if body else []
+
+
+def construct_stream_frame(stream_id, payload):
+    """Wraps a request (or a response) of one of the sessions multiplexed over a single connection.
+    The payload length is in bytes, so that frames can be split out of the byte stream of the socket."""
+    return f"{STREAM_FRAME}{stream_id}{DELIMITER}{len(payload.encode())}{DELIMITER}{payload}"
+
+
+def construct_connection_frame(payload):
+    """Wraps a request (or a response) of a plain connection, which has a single resident"""
+    return construct_stream_frame(CONNECTION_STREAM_ID, payload)
+
+
+def split_stream_frames(buffer: bytes, connection_messages=(), raw_prefixes=()):
+    """Splits the complete stream frames out of the received bytes.
+    Returns a list of (stream_id, payload) and the bytes of the incomplete frame at the end of the buffer.
+    The messages of the connection itself (welcome, heartbeats) are not framed, the ones given in connection_messages
+    are returned in order with a stream_id of None. Splitting stops at a message that starts with one of the
+    raw_prefixes, e.g. a document chunk, it is left at the start of the returned bytes for the caller.
+    Raises ValueError if the buffer does not contain stream frames."""
+    delimiter = DELIMITER.encode()
+    frames = []
+    while buffer:
+        connection_message = next((m for m in connection_messages if buffer.startswith(m.encode())), None)
+        if connection_message is not None:
+            frames.append((None, connection_message))
+            buffer = buffer[len(connection_message.encode()):]
+            continue
+        if not buffer.startswith(STREAM_FRAME_PREFIX):
+            if any(buffer.startswith(prefix) for prefix in raw_prefixes):
+                break
+            if (STREAM_FRAME_PREFIX.startswith(buffer) or any(m.encode().startswith(buffer) for m in connection_messages)
+                    or any(prefix.startswith(buffer) for prefix in raw_prefixes)):
+                break  # The prefix of the next message is not complete yet
+            raise ValueError("expected a stream frame")
+        id_start = len(STREAM_FRAME_PREFIX)
+        id_end = buffer.find(delimiter, id_start)
+        length_end = buffer.find(delimiter, id_end + len(delimiter)) if id_end != -1 else -1
+        if length_end == -1:
+            break  # The header of the frame is not complete yet
+        stream_id = int(buffer[id_start:id_end])
+        length = int(buffer[id_end + len(delimiter):length_end])
+        payload_start = length_end + len(delimiter)
+        if len(buffer) < payload_start + length:
+            break  # The payload of the frame is not complete yet
+        frames.append((stream_id, buffer[payload_start:payload_start + length].decode()))
+        buffer = buffer[payload_start + length:]
+    return frames, buffer
+
+
 def strip_delimiter(data):
     return data.split(DELIMITER)[1]
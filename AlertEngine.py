@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import TYPE_CHECKING
+
+import custom_exceptions as ce
+
+if TYPE_CHECKING:
+    from Server import ResidentConnection
+
+ABOVE = ">"
+BELOW = "<"
+MAX_ALERTS_PER_CONNECTION = 32
+
+
+class Alert:
+    __slots__ = ('alert_id', 'connection', 'metric', 'direction', 'threshold')
+
+    def __init__(self, alert_id: int, connection: ResidentConnection, metric: str, direction: str, threshold: float):
+        self.alert_id = alert_id
+        self.connection = connection
+        self.metric = metric
+        self.direction = direction
+        self.threshold = threshold
+
+
+class AlertEngine:
+    """Price and weather alerts, e.g. "USD > 20" or "temperature_celcius < 0".
+    An alert fires every time its metric crosses the threshold in its direction. The alerts of every metric and
+    direction are kept sorted by threshold, so an update only bisects the range between the previous and the new value
+    instead of checking every alert of the building."""
+
+    def __init__(self, metrics):
+        self.metrics = frozenset(metrics)
+        self.entries: dict[tuple[str, str], list[tuple[float, int]]] = {}  # Sorted (threshold, alert_id) lists
+        self.alerts: dict[int, Alert] = {}
+        self.alert_ids_by_connection: dict[ResidentConnection, set[int]] = {}
+        self.last_values: dict[str, float] = {}
+        self.next_alert_id = 1
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.alerts)
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def add(self, connection: ResidentConnection, metric: str, direction: str, threshold: float,
+            alert_id: int | None = None) -> Alert:
+        """Registers an alert for the connection.
+        Exceptions:
+            InvalidAlertError: If the metric or the direction is unknown, or the connection has too many alerts.
+        """
+        if metric not in self.metrics:
+            raise ce.InvalidAlertError(f"Unknown metric {metric}, supported: {', '.join(sorted(self.metrics))}")
+        if direction not in (ABOVE, BELOW):
+            raise ce.InvalidAlertError(f"Alert direction should be {ABOVE} or {BELOW}")
+        if not math.isfinite(threshold):
+            raise ce.InvalidAlertError("Alert threshold should be a finite number")
+        with self.lock:
+            alert_ids = self.alert_ids_by_connection.setdefault(connection, set())
+            if len(alert_ids) >= MAX_ALERTS_PER_CONNECTION:
+                raise ce.InvalidAlertError(f"A connection can have at most {MAX_ALERTS_PER_CONNECTION} alerts")
+            if alert_id is None:
+                alert_id = self.next_alert_id
+            self.next_alert_id = max(self.next_alert_id, alert_id + 1)  # Ids restored after a hot restart are kept
+            alert = Alert(alert_id, connection, metric, direction, threshold)
+            self.alerts[alert.alert_id] = alert
+            alert_ids.add(alert.alert_id)
+            bisect.insort(self.entries.setdefault((metric, direction), []), (threshold, alert.alert_id))
+        return alert
+
+    def remove(self, connection: ResidentConnection, alert_id: int) -> bool:
+        """Removes one of the connection's alerts, returns False if it has no such alert"""
+        with self.lock:
+            if alert_id not in self.alert_ids_by_connection.get(connection, ()):
+                return False
+            self.__remove(alert_id)
+            return True
+
+    def remove_connection(self, connection: ResidentConnection) -> None:
+        with self.lock:
+            for alert_id in list(self.alert_ids_by_connection.get(connection, ())):
+                self.__remove(alert_id)
+
+    def get_alerts(self, connection: ResidentConnection) -> list[Alert]:
+        with self.lock:
+            return [self.alerts[alert_id] for alert_id in sorted(self.alert_ids_by_connection.get(connection, ()))]
+
+    def update(self, values: dict) -> list[tuple[Alert, float]]:
+        """Records the new values of the metrics and returns the alerts whose threshold was crossed, with the value.
+        The first value of a metric only sets the baseline."""
+        triggered = []
+        with self.lock:
+            for metric, value in values.items():
+                if metric not in self.metrics or value is None:
+                    continue
+                value = float(value)
+                previous_value = self.last_values.get(metric)
+                self.last_values[metric] = value
+                if previous_value is None or previous_value == value:
+                    continue
+                if value > previous_value:  # Crossed upwards: previous_value <= threshold < value
+                    entries = self.entries.get((metric, ABOVE), [])
+                    start = bisect.bisect_left(entries, (previous_value,))
+                    end = bisect.bisect_left(entries, (value,))
+                else:  # Crossed downwards: value < threshold <= previous_value
+                    entries = self.entries.get((metric, BELOW), [])
+                    start = bisect.bisect_right(entries, (value, math.inf))
+                    end = bisect.bisect_right(entries, (previous_value, math.inf))
+                triggered.extend((self.alerts[alert_id], value) for _, alert_id in entries[start:end])
+        return triggered
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __remove(self, alert_id: int) -> None:
+        alert = self.alerts.pop(alert_id)
+        alert_ids = self.alert_ids_by_connection[alert.connection]
+        alert_ids.discard(alert_id)
+        if not alert_ids:
+            del self.alert_ids_by_connection[alert.connection]
+        entries = self.entries[(alert.metric, alert.direction)]
+        del entries[bisect.bisect_left(entries, (alert.threshold, alert_id))]
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import threading
+import time
+
+DEFAULT_REPORT_TIMEOUT = 5.0  # seconds the management console waits for the last delivery
+
+
+class Announcement:
+    """Counts the deliveries of one management announcement. A delivery is counted when the announcement is written to
+    the socket of a connection, a failure when the connection is closed before that."""
+    __slots__ = ('message', 'total', 'delivered', 'failed', 'started_at', 'last_delivered_at', 'lock', 'done')
+
+    def __init__(self, message: str, total: int):
+        self.message = message
+        self.total = total
+        self.delivered = 0
+        self.failed = 0
+        self.started_at = time.perf_counter()
+        self.last_delivered_at: float | None = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        if total == 0:
+            self.done.set()
+
+    def record_delivery(self) -> None:
+        with self.lock:
+            self.delivered += 1
+            self.last_delivered_at = time.perf_counter()
+            self.__check_done()
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failed += 1
+            self.__check_done()
+
+    def wait(self, timeout: float = DEFAULT_REPORT_TIMEOUT) -> bool:
+        """Returns False if some connections have not been written to before the timeout"""
+        return self.done.wait(timeout)
+
+    def get_report(self) -> dict:
+        with self.lock:
+            time_to_last_delivery = (None if self.last_delivered_at is None
+                                     else round((self.last_delivered_at - self.started_at) * 1e3, 3))
+            return {'total': self.total,
+                    'delivered': self.delivered,
+                    'failed': self.failed,
+                    'pending': self.total - self.delivered - self.failed,
+                    'time_to_last_delivery_ms': time_to_last_delivery}
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __check_done(self) -> None:
+        if self.delivered + self.failed >= self.total:
+            self.done.set()
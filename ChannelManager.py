@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+import AkinProtocol
+import custom_exceptions as ce
+
+if TYPE_CHECKING:
+    from Server import ClientThread
+
+MAX_CHANNEL_NAME_LENGTH = 32
+
+
+class ChannelManager:
+    """Index of the named chat channels (general, per block, per floor, board...).
+    Keeps channel -> subscribers and connection -> channels so that publishing to a channel only touches that channel's
+    subscribers, and a closed connection can be removed from all of its channels at once."""
+
+    def __init__(self):
+        self.subscribers_by_channel: dict[str, set[ClientThread]] = {}
+        self.channels_by_connection: dict[ClientThread, set[str]] = {}
+        self.allowed_apartments_by_channel: dict[str, frozenset[int]] = {}
+        self.lock = threading.Lock()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def restrict_channel(self, channel: str, apartment_nos) -> None:
+        """Only the residents of the given apartments will be able to subscribe to this channel, e.g. the board."""
+        self.validate_channel_name(channel)
+        with self.lock:
+            self.allowed_apartments_by_channel[channel] = frozenset(int(no) for no in apartment_nos)
+
+    def subscribe(self, connection: ClientThread, channel: str) -> None:
+        """Subscribes the connection to the channel.
+        Exceptions:
+            InvalidChannelNameError: If the channel name is empty, too long or contains the protocol delimiter.
+            ChannelAccessDeniedError: If the channel is restricted and the resident is not allowed in it.
+        """
+        self.validate_channel_name(channel)
+        if not self.can_join(connection.card.apartment_no, channel):
+            raise ce.ChannelAccessDeniedError(f"Apartment {connection.card.apartment_no} can not join #{channel}")
+        with self.lock:
+            self.subscribers_by_channel.setdefault(channel, set()).add(connection)
+            self.channels_by_connection.setdefault(connection, set()).add(channel)
+
+    def can_join(self, apartment_no: int, channel: str) -> bool:
+        allowed_apartments = self.allowed_apartments_by_channel.get(channel)
+        return allowed_apartments is None or apartment_no in allowed_apartments
+
+    def is_restricted(self, channel: str) -> bool:
+        return channel in self.allowed_apartments_by_channel
+
+    def unsubscribe(self, connection: ClientThread, channel: str) -> None:
+        with self.lock:
+            self.__discard(self.subscribers_by_channel, channel, connection)
+            self.__discard(self.channels_by_connection, connection, channel)
+
+    def unsubscribe_from_all(self, connection: ClientThread) -> None:
+        """Removes a connection from every channel it is subscribed to."""
+        with self.lock:
+            for channel in self.channels_by_connection.pop(connection, ()):
+                self.__discard(self.subscribers_by_channel, channel, connection)
+
+    def is_subscribed(self, connection: ClientThread, channel: str) -> bool:
+        return channel in self.channels_by_connection.get(connection, ())
+
+    def get_subscribers(self, channel: str) -> list[ClientThread]:
+        with self.lock:
+            return list(self.subscribers_by_channel.get(channel, ()))
+
+    def get_channels(self, connection: ClientThread) -> list[str]:
+        with self.lock:
+            return sorted(self.channels_by_connection.get(connection, ()))
+
+    def get_channel_sizes(self) -> dict[str, int]:
+        with self.lock:
+            return {channel: len(subscribers) for channel, subscribers in self.subscribers_by_channel.items()}
+
+    def get_restricted_channels(self) -> dict[str, list[int]]:
+        with self.lock:
+            return {channel: sorted(apartment_nos)
+                    for channel, apartment_nos in self.allowed_apartments_by_channel.items()}
+
+    @staticmethod
+    def validate_channel_name(channel: str) -> None:
+        if not channel or len(channel) > MAX_CHANNEL_NAME_LENGTH or AkinProtocol.DELIMITER in channel:
+            raise ce.InvalidChannelNameError(f"Invalid channel name: {channel!r}")
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    @staticmethod
+    def __discard(index: dict, key, value) -> None:
+        values = index.get(key)
+        if values is None:
+            return
+        values.discard(value)
+        if not values:
+            del index[key]
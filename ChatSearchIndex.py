@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import bisect
+import collections
+import re
+import threading
+
+DEFAULT_MAX_MESSAGES = 50_000  # The oldest messages leave the index first
+DEFAULT_PAGE_SIZE = 10
+MIN_PREFIX_LENGTH = 3  # Shorter words only match whole words, a prefix of 1-2 letters would match most of the index
+
+# Python lower-cases I to i and İ to i + a combining dot, Turkish lower-cases them to ı and i.
+TURKISH_LOWER = str.maketrans({"I": "ı", "İ": "i"})
+# Residents often type without the Turkish letters, "sicak" for "sıcak" or "cay" for "çay", so both the messages and
+# the queries are folded to ASCII after lower-casing.
+ASCII_FOLD = str.maketrans("çğıöşüâîû", "cgiosuaiu")
+TOKEN_PATTERN = re.compile(r"\w+")
+# Chat messages start with the time they were sent at and their sender, "[12:30:00] [No:5] Ayşe: ", only the text
+# after it is indexed, otherwise every message of a resident would match their name and apartment number
+MESSAGE_HEADER = re.compile(r"^\[\d{2}:\d{2}:\d{2}\] \[No:[^\]]*\] .*?: ")
+
+
+def fold(text: str) -> str:
+    return text.translate(TURKISH_LOWER).lower().translate(ASCII_FOLD)
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(fold(text))
+
+
+def get_message_words(message: str) -> set[str]:
+    return set(tokenize(MESSAGE_HEADER.sub("", message, count=1)))
+
+
+class ChatSearchIndex:
+    """An inverted index over the channel messages: every word points to the sequence numbers of the messages it is in.
+
+    Messages are added in the order of their sequence numbers, so every posting list is sorted and the oldest message
+    is at its front, which makes evicting the oldest message a popleft per word. A query word also matches the words
+    that start with it, Turkish words take suffixes: "kesinti" finds "kesintisi" and "kesintiler"."""
+
+    def __init__(self, max_messages: int = DEFAULT_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self.messages: dict[int, tuple[str, str]] = {}  # sequence_no: (channel, message), oldest first
+        self.postings: dict[str, collections.deque[int]] = {}
+        self.vocabulary: list[str] = []  # Sorted, the words that start with a prefix are a contiguous slice
+        self.lock = threading.Lock()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def add(self, sequence_no: int, channel: str, message: str) -> None:
+        words = get_message_words(message)
+        with self.lock:
+            if self.messages and sequence_no <= next(reversed(self.messages)):
+                return  # Already indexed, e.g. the messages a previous server process handed over
+            self.messages[sequence_no] = (channel, message)
+            for word in words:
+                posting = self.postings.get(word)
+                if posting is None:
+                    posting = self.postings[word] = collections.deque()
+                    bisect.insort(self.vocabulary, word)
+                posting.append(sequence_no)
+            while len(self.messages) > self.max_messages:
+                self.__evict_oldest()
+
+    def search(self, query: str, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE, channel: str | None = None,
+               is_visible=None) -> tuple[int, list[tuple[int, str, str]]]:
+        """Returns the number of matching messages and one page of them, newest first. A message matches if every word
+        of the query is in it. is_visible(channel) hides the messages of the channels the searcher can not read.
+
+        Exceptions:
+            ValueError: If the query has no words or the page is not positive
+        """
+        words = set(tokenize(query))
+        if not words:
+            raise ValueError("Search for at least one word")
+        if page < 1:
+            raise ValueError("Pages start from 1")
+        with self.lock:
+            matches: set[int] | None = None
+            for word in sorted(words, key=len, reverse=True):  # Longer words match fewer messages
+                matches = self.__find(word) if matches is None else matches & self.__find(word)
+                if not matches:
+                    return 0, []
+            if channel is not None or is_visible is not None:
+                matches = [sequence_no for sequence_no in matches
+                           if (channel is None or self.messages[sequence_no][0] == channel)
+                           and (is_visible is None or is_visible(self.messages[sequence_no][0]))]
+            newest_first = sorted(matches, reverse=True)
+            start = (page - 1) * page_size
+            return len(newest_first), [(sequence_no, *self.messages[sequence_no])
+                                       for sequence_no in newest_first[start:start + page_size]]
+
+    def export_state(self) -> list:
+        with self.lock:
+            return [[sequence_no, channel, message] for sequence_no, (channel, message) in self.messages.items()]
+
+    def import_state(self, state: list) -> None:
+        for sequence_no, channel, message in state:
+            self.add(sequence_no, channel, message)
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __find(self, word: str) -> set[int]:
+        if len(word) < MIN_PREFIX_LENGTH:
+            return set(self.postings.get(word, ()))
+        matches = set()
+        for i in range(bisect.bisect_left(self.vocabulary, word), len(self.vocabulary)):
+            if not self.vocabulary[i].startswith(word):
+                break
+            matches.update(self.postings[self.vocabulary[i]])
+        return matches
+
+    def __evict_oldest(self) -> None:
+        sequence_no = next(iter(self.messages))
+        _, message = self.messages.pop(sequence_no)
+        for word in get_message_words(message):
+            posting = self.postings[word]
+            posting.popleft()
+            if not posting:
+                del self.postings[word]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
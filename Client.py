@@ -1,115 +1,385 @@
-import multiprocessing
+import abc
+import os
+import queue
 import socket
 import threading
 import time
 
 import AkinProtocol
 
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+CONNECT_TIMEOUT = 1.0  # seconds to connect, and then to receive the welcome message
+RECEIVE_BUFFER_SIZE = 64 * 1024  # Large enough for a document chunk in one read
+DEFAULT_DOWNLOAD_DIR = "downloads"
+PART_SUFFIX = ".part"  # A document is written next to its final name and renamed once it is complete
+# The messages of the connection itself are not framed, every other message arrives in a stream frame
+CONNECTION_MESSAGES = (AkinProtocol.WELCOME_TO_THE_SERVER, AkinProtocol.PING_REQUEST)
 
-class Client:
+
+class ResidentRequests(abc.ABC):
+    """The requests a resident can send to the server, over whatever send_message writes to"""
+
+    @abc.abstractmethod
+    def send_message(self, message):
+        ...
+
+    def subscribe_to_message_channel(self, channel=AkinProtocol.DEFAULT_CHANNEL):
+        self.channels.add(channel)
+        self.send_message(AkinProtocol.construct_subscribe_request(channel))
+
+    def unsubscribe_from_message_channel(self, channel=AkinProtocol.DEFAULT_CHANNEL):
+        self.channels.discard(channel)
+        self.send_message(AkinProtocol.construct_unsubscribe_request(channel))
+
+    def send_weather_request(self):
+        self.send_message(AkinProtocol.WEATHER_GET)
+
+    def send_currency_request(self):
+        self.send_message(AkinProtocol.CURRENCY_GET)
+
+    def send_refresh_request(self):
+        """Requests the weather and the currency in one round trip"""
+        self.send_message(AkinProtocol.construct_batch([AkinProtocol.WEATHER_GET, AkinProtocol.CURRENCY_GET]))
+
+    def send_convert_request(self, conversions):
+        """conversions is a list of (amount, from_currency, to_currency), the results arrive in conversion_results"""
+        self.send_message(AkinProtocol.construct_convert_request(conversions))
+
+    def send_alert_request(self, metric, direction, threshold):
+        """The id of the new alert is appended to alert_ids, its notifications arrive in the message queue"""
+        self.send_message(AkinProtocol.construct_alert_request(metric, direction, threshold))
+
+    def send_alert_remove_request(self, alert_id):
+        self.send_message(AkinProtocol.construct_alert_remove_request(alert_id))
+
+    def send_search_request(self, query, page=1, channel=""):
+        """The matching messages arrive in search_results, newest first"""
+        self.send_message(AkinProtocol.construct_search_request(query, page, channel))
+
+    def send_document_list_request(self):
+        """The name and the size of every published document arrive in documents"""
+        self.send_message(AkinProtocol.DOCUMENT_LIST_REQUEST)
+
+    def send_entry_report_request(self, report, start, end):
+        """The report arrives in entry_report, only the apartments allowed by the management can query it"""
+        self.send_message(AkinProtocol.construct_entry_report_request(report, start, end))
+
+    def send_chat_message(self, message, channel=AkinProtocol.DEFAULT_CHANNEL):
+        message_to_send = AkinProtocol.construct_chat_message(message, channel)
+        self.send_message(message_to_send)
+        return True
+
+    def send_direct_message(self, apartment_no, message):
+        message_to_send = AkinProtocol.construct_direct_message(apartment_no, message)
+        self.send_message(message_to_send)
+        return True
+
+    def register_client(self, card):
+        self.card = card
+        message_to_send = AkinProtocol.register_client_to_server(card)
+        self.send_message(message_to_send)
+
+    def register_again(self):
+        """Registers the card of a session the server could not resume, and subscribes to its channels again"""
+        self.send_message(AkinProtocol.construct_batch(self.construct_registration_requests()))
+
+    def construct_registration_requests(self) -> list:
+        return [AkinProtocol.register_client_to_server(self.card),
+                *(AkinProtocol.construct_subscribe_request(channel) for channel in sorted(self.channels))]
+
+
+class Client(ResidentRequests):
     def __init__(self, host, port):
         self.host = host
         self.port = port
-        self.message_queue = multiprocessing.Queue()
+        self.message_queue = queue.Queue()
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.send_lock = threading.Lock()  # The listener, the refresh loop and the GUI send, frames must not interleave
         self.message = ""
         self.subscribed_to_message_channel = False
         self.client_manager_thread = ClientListenerThread(self, self.message_queue)
         self.weather_data = AkinProtocol.DEFAULT_WEATHER_DICT
         self.currency_data = AkinProtocol.DEFAULT_CURRENCY_DICT
+        self.conversion_results = []
+        self.alert_ids = []
+        self.search_results = {'total': 0, 'page': 1, 'results': []}
+        self.documents = []
+        self.entry_report = {'report': None, 'rows': []}
+
+        ### Document Downloads ###
+        self.download_directory = DEFAULT_DOWNLOAD_DIR
+        self.downloads = {}  # name -> the open .part file of every download in progress
+
+        ### Resumable Session ###
+        self.card = None
+        self.channels = set()  # Subscribed again if the session can not be resumed
+        self.session_token = None
+        self.last_sequence_no = 0
+        self.resuming = False  # Until the server answers the resume request of a reconnect
 
     def start(self):
         try:
+            self.socket.settimeout(CONNECT_TIMEOUT)
             self.socket.connect((self.host, self.port))
-            welcome_message = self.socket.recv(1024).decode()  # Receive the welcome message from the server
-            self.message_queue.put(welcome_message)
+            welcome = AkinProtocol.WELCOME_TO_THE_SERVER.encode()
+            data = b""
+            while len(data) < len(welcome):  # The messages that follow the welcome can arrive in the same read
+                received = self.socket.recv(RECEIVE_BUFFER_SIZE)
+                if not received:
+                    raise ConnectionError("The server closed the connection")
+                data += received
+            self.socket.settimeout(None)
+            self.message_queue.put(data[:len(welcome)].decode())
+            self.client_manager_thread.buffer = data[len(welcome):]
             self.client_manager_thread.start()
         except Exception:
+            self.message_queue.put("")  # The controller reports the failure right away instead of timing out
             return
 
         # Connected to the server.
         while True:
-            self.send_weather_request()
-            time.sleep(1)
-            self.send_currency_request()
+            try:
+                self.send_refresh_request()
+            except OSError:
+                pass  # The listener thread is reconnecting
             time.sleep(5)
 
-    def get_message_queue(self) -> multiprocessing.Queue:
+    def get_message_queue(self) -> queue.Queue:
         return self.message_queue
 
-    def subscribe_to_message_channel(self):
-        self.send_message(AkinProtocol.SUBSCRIBE_REQUEST)
-
-    def unsubscribe_from_message_channel(self):
-        self.send_message(AkinProtocol.UNSUBSCRIBE_REQUEST)
-
-    def send_weather_request(self):
-        self.send_message(AkinProtocol.WEATHER_GET)
-
-    def send_currency_request(self):
-        self.send_message(AkinProtocol.CURRENCY_GET)
-
     def send_message(self, message):
-        self.socket.send(message.encode())
+        """Sends the request in a stream frame, the server splits the requests that arrive in one read by their
+        length"""
+        frame = AkinProtocol.construct_connection_frame(message)
+        with self.send_lock:
+            self.socket.sendall(frame.encode())
 
     def receive_message(self) -> str:
-        return self.socket.recv(1024).decode()
+        return self.receive_data().decode()
 
-    def send_chat_message(self, message):
-        message_to_send = AkinProtocol.construct_chat_message(message)
-        self.socket.send(message_to_send.encode())
-        return True
+    def receive_data(self) -> bytes:
+        try:
+            return self.socket.recv(RECEIVE_BUFFER_SIZE)
+        except OSError:
+            return b""
 
-    def register_client(self, card):
-        message_to_send = AkinProtocol.register_client_to_server(card)
-        self.socket.send(message_to_send.encode())
+    def download_document(self, name):
+        """Downloads the document into the download directory. A partly downloaded document is resumed from where it
+        stopped, the server sends only the rest of it."""
+        if not name or name != os.path.basename(name):
+            raise ValueError(f"{name!r} is not a valid document name")
+        if name in self.downloads:
+            return  # Already being downloaded
+        os.makedirs(self.download_directory, exist_ok=True)
+        part_file = open(os.path.join(self.download_directory, name + PART_SUFFIX), "ab")
+        self.downloads[name] = part_file
+        self.send_message(AkinProtocol.construct_download_request(name, part_file.tell()))
+
+    def reconnect(self) -> bool:
+        """Opens a new connection and resumes the session instead of registering and subscribing again.
+        The resume request is sent right after connecting, the server answers it after the welcome message."""
+        backoff = RECONNECT_BACKOFF
+        for _ in range(RECONNECT_ATTEMPTS):
+            new_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                new_socket.settimeout(CONNECT_TIMEOUT)
+                new_socket.connect((self.host, self.port))
+                new_socket.settimeout(None)
+                new_socket.sendall(AkinProtocol.construct_connection_frame(self.__construct_resume_requests()).encode())
+            except OSError:
+                new_socket.close()
+                time.sleep(backoff)
+                backoff *= 2
+                continue
+            self.socket.close()
+            self.socket = new_socket
+            self.resuming = True
+            return True
+        return False
+
+    def register_again(self):
+        """The downloads in progress are asked again too, the server refused them along with the resume request"""
+        self.send_message(AkinProtocol.construct_batch([*self.construct_registration_requests(),
+                                                        *self.__construct_download_requests()]))
 
     def close_connection(self):
         self.client_manager_thread.stop()
         self.socket.close()
+        for part_file in self.downloads.values():
+            part_file.close()  # The .part files are resumed by the next download of the same documents
+
+    def __construct_resume_requests(self) -> str:
+        """The downloads in progress are asked again on the new connection, from the bytes that arrived"""
+        resume_request = AkinProtocol.construct_resume_request(self.session_token, self.last_sequence_no)
+        if not self.downloads:
+            return resume_request
+        return AkinProtocol.construct_batch([resume_request, *self.__construct_download_requests()])
+
+    def __construct_download_requests(self) -> list:
+        return [AkinProtocol.construct_download_request(name, part_file.tell())
+                for name, part_file in list(self.downloads.items())]
 
 
 class ClientListenerThread(threading.Thread):
     def __init__(self, client, message_queue):
         super().__init__()
         self.client = client
-        self.message_queue = message_queue
+        self.message_handler = ServerMessageHandler(client, message_queue)
         self.running_flag = True
+        self.buffer = b""  # The bytes of a frame or a document chunk that is not complete yet
 
     def run(self):
+        self.__handle_received_data()  # What arrived with the welcome message
         while self.running_flag:
-            msg: str = self.client.receive_message()
-            if not msg:
+            data = self.client.receive_data()
+            if not data:
+                self.buffer = b""  # The rest of a frame never arrives, a download is resumed from its last chunk
+                if self.running_flag and self.client.session_token is not None and self.client.reconnect():
+                    print("Connection to server lost, resuming the session on a new connection")
+                    continue
                 print("Connection to server lost")
                 break
+            self.buffer += data
+            self.__handle_received_data()
 
-            if msg.startswith(AkinProtocol.WEATHER_GET):
-                data = AkinProtocol.strip_delimiter(msg)
-                # print("Weather data received from server:", data)
-                self.client.weather_data = eval(data)
+    def stop(self):
+        self.running_flag = False
 
-            elif msg.startswith(AkinProtocol.CURRENCY_GET):
-                data = AkinProtocol.strip_delimiter(msg)
-                # print("Currency data received from server:", data)
-                self.client.currency_data = eval(data)
+    def __handle_received_data(self) -> None:
+        """Splits the received bytes into messages, several of them can arrive in one read and one of them in several
+        reads. Messages are framed with their length, document chunks carry their length in their header and raw
+        bytes, only the messages are decoded."""
+        prefix = AkinProtocol.DOCUMENT_CHUNK_PREFIX
+        while self.buffer:
+            if self.buffer.startswith(prefix):
+                chunk, self.buffer = AkinProtocol.split_document_chunk(self.buffer)
+                if chunk is None:
+                    return  # The chunk is not complete yet
+                self.message_handler.handle_document_chunk(chunk)
+                continue
+            try:
+                frames, self.buffer = AkinProtocol.split_stream_frames(self.buffer, CONNECTION_MESSAGES, (prefix,))
+            except ValueError as e:
+                print("Invalid data received from server:", e)
+                self.buffer = b""
+                return
+            for _, msg in frames:
+                self.message_handler.handle_server_message(msg)
+            if not self.buffer.startswith(prefix):
+                return  # The next frame is not complete yet
 
-            elif msg.startswith(AkinProtocol.CHAT_MESSAGE):
-                data = AkinProtocol.strip_delimiter(msg)
-                self.message_queue.put(data)
-                print("Put message in queue:", data)
 
-            elif msg.startswith(AkinProtocol.OK):
-                print("OK message received from server")
+class ServerMessageHandler:
+    """Applies the messages of the server to the state of one resident: a Client, or a stream of a GatewayClient"""
 
-            elif msg.startswith(AkinProtocol.ERROR):
-                data = AkinProtocol.strip_delimiter(msg)
-                print(f"ERROR message received from server | Reason: {data}")
+    def __init__(self, client, message_queue):
+        self.client = client
+        self.message_queue = message_queue
 
-            else:
-                print("Unknown message received from server:", msg)
+    def handle_server_message(self, msg: str) -> None:
+        if msg.startswith(AkinProtocol.BATCH_REQUEST):
+            for response in AkinProtocol.parse_batch(msg):
+                self.handle_server_message(response)
 
-    def stop(self):
-        self.running_flag = False
+        elif msg == AkinProtocol.WELCOME_TO_THE_SERVER:
+            pass  # The new connection of a reconnect is welcomed too
+
+        elif msg.startswith(AkinProtocol.REGISTER_USER):
+            self.client.session_token = AkinProtocol.parse_session_response(msg)['session_token']
+            self.client.last_sequence_no = 0  # A new session, nothing is replayed from the sequence of the old one
+
+        elif msg.startswith(AkinProtocol.RESUME_REQUEST):
+            self.client.resuming = False
+            self.client.session_token = AkinProtocol.parse_session_response(msg)['session_token']
+
+        elif msg.startswith(AkinProtocol.PING_REQUEST):
+            self.client.send_message(AkinProtocol.PONG_RESPONSE)
+
+        elif msg.startswith(AkinProtocol.WEATHER_GET):
+            data = AkinProtocol.strip_delimiter(msg)
+            # print("Weather data received from server:", data)
+            self.client.weather_data = eval(data)
+
+        elif msg.startswith(AkinProtocol.CURRENCY_GET):
+            data = AkinProtocol.strip_delimiter(msg)
+            # print("Currency data received from server:", data)
+            self.client.currency_data = eval(data)
+
+        elif msg.startswith(AkinProtocol.CONVERT_REQUEST):
+            self.client.conversion_results = AkinProtocol.parse_convert_response(msg)
+
+        elif msg.startswith(AkinProtocol.ALERT_REQUEST):
+            self.client.alert_ids.append(AkinProtocol.parse_alert_response(msg))
+
+        elif msg.startswith(AkinProtocol.SEARCH_REQUEST):
+            self.client.search_results = AkinProtocol.parse_search_response(msg)
+
+        elif msg.startswith(AkinProtocol.DOCUMENT_LIST_REQUEST):
+            self.client.documents = AkinProtocol.parse_document_list_response(msg)
+
+        elif msg.startswith(AkinProtocol.ENTRY_REPORT_REQUEST):
+            self.client.entry_report = AkinProtocol.parse_entry_report_response(msg)
+
+        elif msg.startswith(AkinProtocol.ALERT_NOTIFICATION):
+            alert = AkinProtocol.parse_alert_notification(msg)
+            data = f"[Alert] {alert['metric']} {alert['direction']} {alert['threshold']}, now {alert['value']}"
+            self.message_queue.put(data)
+
+        elif msg.startswith(AkinProtocol.CHAT_MESSAGE):
+            chat_message = AkinProtocol.parse_chat_message(msg)
+            sequence_no = chat_message['sequence_no']
+            if sequence_no is not None:
+                if sequence_no <= self.client.last_sequence_no:
+                    return  # Already received before the connection was resumed
+                self.client.last_sequence_no = sequence_no
+            data = chat_message['message']
+            if chat_message['channel'] != AkinProtocol.DEFAULT_CHANNEL:
+                data = f"#{chat_message['channel']} {data}"
+            self.message_queue.put(data)
+            print("Put message in queue:", data)
+
+        elif msg.startswith(AkinProtocol.ANNOUNCEMENT_MESSAGE):
+            self.message_queue.put(f"[Announcement] {AkinProtocol.parse_announcement(msg)}")
+
+        elif msg.startswith(AkinProtocol.DIRECT_MESSAGE):
+            data = AkinProtocol.parse_direct_message(msg)['message']
+            self.message_queue.put(data)
+
+        elif msg.startswith(AkinProtocol.OK):
+            print("OK message received from server")
+
+        elif msg.startswith(AkinProtocol.ERROR):
+            data = AkinProtocol.strip_delimiter(msg)
+            print(f"ERROR message received from server | Reason: {data}")
+            if self.client.resuming:
+                self.__register_again()
+
+        else:
+            print("Unknown message received from server:", msg)
+
+    def __register_again(self) -> None:
+        """The first response on the new connection of a reconnect is the answer to the resume request, an error means
+        that the session expired (or the server restarted without it), so the client starts a new one"""
+        self.client.resuming = False
+        self.client.session_token = None
+        self.client.last_sequence_no = 0
+        if self.client.card is not None:
+            self.client.register_again()
+
+    def handle_document_chunk(self, chunk: dict) -> None:
+        """Appends the chunk to the .part file of the download, and renames the file once the document is complete"""
+        part_file = self.client.downloads.get(chunk['name'])
+        if part_file is None or chunk['offset'] != part_file.tell():
+            return  # The download was stopped, or the chunk was already received before a reconnect
+        part_file.write(chunk['data'])
+        if part_file.tell() < chunk['size']:
+            return
+        part_file.close()
+        del self.client.downloads[chunk['name']]
+        path = os.path.join(self.client.download_directory, chunk['name'])
+        os.replace(path + PART_SUFFIX, path)
+        self.message_queue.put(f"[Document] {chunk['name']} is downloaded to {path}")
 
 
 def main():
@@ -1,9 +1,11 @@
-import multiprocessing
+import queue
 import threading
+import time
 
 import AkinProtocol
 import custom_exceptions as ce
-from Client import Client
+import Discovery
+from Client import CONNECT_TIMEOUT, Client
 from ClientCard import ClientCard
 
 
@@ -34,7 +36,8 @@ class ClientController:
         client_thread = threading.Thread(target=self.client.start)
         client_thread.start()
         try:
-            msg = self.message_queue.get(block=True, timeout=5)
+            # The client puts the welcome message or an empty one if it could not connect, this is only a safety net
+            msg = self.message_queue.get(block=True, timeout=2 * CONNECT_TIMEOUT)
         except Exception as e:
             msg = ""
         if msg != AkinProtocol.WELCOME_TO_THE_SERVER:
@@ -42,6 +45,31 @@ class ClientController:
         self.client_running = True
         return True
 
+    def discover_servers(self, discovery_port: int = AkinProtocol.DEFAULT_DISCOVERY_PORT) -> list:
+        """Returns the servers on the LAN that answered the discovery broadcast, least loaded first."""
+        return Discovery.discover_servers(discovery_port)
+
+    def connect_to_least_loaded_server(self, discovery_port: int = AkinProtocol.DEFAULT_DISCOVERY_PORT) -> tuple:
+        """Discovers the servers on the LAN and starts the client on the least loaded one that accepts the connection.
+        Returns the host and the port of that server, otherwise raises an exception.
+        Exceptions:
+            ClientAlreadyRunningError: If the client is already running.
+            NoServersDiscoveredError: If no server answered or none of them accepted the connection.
+        """
+        if self.client_running:
+            raise ce.ClientAlreadyRunningError("Client is already running.")
+        advertisements = self.discover_servers(discovery_port)
+        if not advertisements:
+            raise ce.NoServersDiscoveredError("No servers answered on the local network!")
+        for advertisement in advertisements:
+            try:
+                self.start_client(advertisement.host, advertisement.port)
+            except ce.NoServersFoundOnThisHostAndPortError:
+                continue
+            return advertisement.host, advertisement.port
+        raise ce.NoServersDiscoveredError(f"None of the {len(advertisements)} servers on the local network accepted "
+                                          f"the connection!")
+
     def register_client(self, card: ClientCard) -> bool:
         """Registers the client. Returns True if the client is registered successfully, otherwise raises an exception.
         Exceptions:
@@ -53,7 +81,7 @@ class ClientController:
         self.client.register_client(card)
         return True
 
-    def get_message_queue(self) -> multiprocessing.Queue:
+    def get_message_queue(self) -> queue.Queue:
         """Returns the message queue."""
         if not self.client_running:
             raise ce.ClientNotRunningError("Client is not running.")
@@ -75,17 +103,30 @@ class ClientController:
         else:
             raise ce.ClientCouldNotBeClosedError("Client could not be closed.")
 
-    def send_message(self, message: str) -> bool:
+    def send_message(self, message: str, channel: str = AkinProtocol.DEFAULT_CHANNEL) -> bool:
         """Sends a message to the server. Returns True if the message was sent successfully, otherwise raises an exception.
         Exceptions:
             ClientNotRunningError: If the client is not running.
         """
         if not self.client_running:
             raise ce.ClientNotRunningError("Client is not running.")
-        self.client.send_chat_message(message)
+        self.client.send_chat_message(message, channel)
+        return True
+
+    def send_direct_message(self, apartment_no: int, message: str) -> bool:
+        """Sends a message only to the residents of the given apartment. Returns True if the message was sent successfully, otherwise raises an exception.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+            ApartmentNoShouldBeIntegerError: If the apartment number is not an integer.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        if not isinstance(apartment_no, int):
+            raise ce.ApartmentNoShouldBeIntegerError("Apartment number is not an integer.")
+        self.client.send_direct_message(apartment_no, message)
         return True
 
-    def subscribe_to_message_channel(self) -> bool:
+    def subscribe_to_message_channel(self, channel: str = AkinProtocol.DEFAULT_CHANNEL) -> bool:
         """Subscribes to the message channel. Returns True if the client is subscribed successfully, otherwise raises an exception.
         Exceptions:
             ClientNotRunningError: If the client is not running.
@@ -93,10 +134,10 @@ class ClientController:
         """
         if not self.client_running:
             raise ce.ClientNotRunningError("Client is not running.")
-        self.client.subscribe_to_message_channel()
+        self.client.subscribe_to_message_channel(channel)
         return True
 
-    def unsubscribe_from_message_channel(self) -> bool:
+    def unsubscribe_from_message_channel(self, channel: str = AkinProtocol.DEFAULT_CHANNEL) -> bool:
         """Unsubscribes from the message channel. Returns True if the client is unsubscribed successfully, otherwise raises an exception.
         Exceptions:
             ClientNotRunningError: If the client is not running.
@@ -104,7 +145,7 @@ class ClientController:
         """
         if not self.client_running:
             raise ce.ClientNotRunningError("Client is not running.")
-        self.client.unsubscribe_from_message_channel()
+        self.client.unsubscribe_from_message_channel(channel)
         return True
 
     def get_weather(self):
@@ -118,3 +159,134 @@ class ClientController:
         if not self.client_running:
             raise ce.ClientNotRunningError("Client is not running.")
         return self.client.currency_data
+
+    def convert_currency(self, amount: str, from_currency: str, to_currency: str) -> bool:
+        """Asks the server to convert the amount, the result can be read with get_conversion_results.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+            ValueError: If the amount is not a number.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        try:
+            amount = float(amount)
+        except ValueError as e:
+            raise ValueError("Amount should be a number.") from e
+        self.client.send_convert_request([(amount, from_currency.upper(), to_currency.upper())])
+        return True
+
+    def get_conversion_results(self) -> list:
+        """Returns the results of the last conversion request."""
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        return self.client.conversion_results
+
+    def add_alert(self, metric: str, direction: str, threshold: str) -> bool:
+        """Asks to be notified when the metric crosses the threshold, the notifications arrive in the message queue.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+            ValueError: If the direction is not > or <, or the threshold is not a number.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        if direction not in (">", "<"):
+            raise ValueError("Direction should be > or <.")
+        try:
+            threshold = float(threshold)
+        except ValueError as e:
+            raise ValueError("Threshold should be a number.") from e
+        self.client.send_alert_request(metric, direction, threshold)
+        return True
+
+    def remove_alert(self, alert_id: int) -> bool:
+        """Removes one of the alerts, their ids are in the order they were added.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        self.client.send_alert_remove_request(alert_id)
+        if alert_id in self.client.alert_ids:
+            self.client.alert_ids.remove(alert_id)
+        return True
+
+    def search_chat(self, query: str, page: str = "1", channel: str = "") -> bool:
+        """Asks the server for the messages that contain every word of the query, they can be read with
+        get_search_results.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+            ValueError: If the query is empty or the page is not a positive integer.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        if not query.strip():
+            raise ValueError("Search for at least one word.")
+        try:
+            page = int(page)
+        except ValueError as e:
+            raise ValueError("Page should be an integer.") from e
+        if page < 1:
+            raise ValueError("Pages start from 1.")
+        self.client.send_search_request(query, page, channel)
+        return True
+
+    def get_search_results(self) -> dict:
+        """Returns the total number of matches and the page of results of the last search request."""
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        return self.client.search_results
+
+    def list_documents(self) -> bool:
+        """Asks the server for the published documents, they can be read with get_documents.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        self.client.send_document_list_request()
+        return True
+
+    def get_documents(self) -> list:
+        """Returns the (name, size in bytes) of the documents of the last list request."""
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        return self.client.documents
+
+    def request_entry_report(self, report: str, days: str = "7") -> bool:
+        """Asks the server for a report of the card entries of the last days, it can be read with get_entry_report.
+        The report is "hours", "apartments" or "anomalies".
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+            ValueError: If the report is unknown or the days are not a positive number.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        if report not in ("hours", "apartments", "anomalies"):
+            raise ValueError(f"Unknown entry report: {report}")
+        try:
+            days = float(days)
+        except ValueError as e:
+            raise ValueError("Days should be a number.") from e
+        if days <= 0:
+            raise ValueError("Days should be positive.")
+        end = time.time()
+        self.client.send_entry_report_request(report, end - days * 24 * 60 * 60, end + 1)
+        return True
+
+    def get_entry_report(self) -> dict:
+        """Returns the name and the rows of the last entry report."""
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        return self.client.entry_report
+
+    def download_document(self, name: str) -> bool:
+        """Downloads the document into the downloads directory, a message is put in the message queue once it is
+        complete. A download that was interrupted is resumed.
+        Exceptions:
+            ClientNotRunningError: If the client is not running.
+            ValueError: If the name is not a document name.
+        """
+        if not self.client_running:
+            raise ce.ClientNotRunningError("Client is not running.")
+        self.client.download_document(name)
+        return True
@@ -1,4 +1,4 @@
-import multiprocessing
+import queue
 import threading
 import time
 
@@ -33,7 +33,7 @@ class ClientGUI:
         ### Server Logic ###
         self.host = AkinProtocol.DEFAULT_HOST
         self.port = AkinProtocol.DEFAULT_PORT
-        self.group_chat_message_queue: multiprocessing.Queue = None  # type: ignore
+        self.group_chat_message_queue: queue.Queue = None  # type: ignore
         self.running_flag = True
         self.client_registered = False
 
@@ -52,6 +52,9 @@ class ClientGUI:
         self.start_button = ft.ElevatedButton(text="Connect to Server",
                                               on_click=self.__on_click_start_button,
                                               style=Utility.START_BUTTON_STYLE)
+        self.discover_button = ft.ElevatedButton(text="Find a Server",
+                                                 on_click=self.__on_click_discover_button,
+                                                 style=Utility.START_BUTTON_STYLE)
 
         self.client_card_image = ft.Image(src='CinsApartmentCard_Transparent.png')
         self.client_card_name = ft.TextField(label="Name",
@@ -177,6 +180,7 @@ class ClientGUI:
             self.controller.start_client(self.host, self.port)
             self.start_button.text = "Connected!"
             self.start_button.disabled = True
+            self.discover_button.disabled = True
             self.host_textbox.disabled = True
             self.port_textbox.disabled = True
             self.page.update()
@@ -188,6 +192,29 @@ class ClientGUI:
         finally:
             self.page.update()
 
+    def __on_click_discover_button(self, _) -> None:
+        """Connects to the least loaded server on the local network."""
+        logger.debug("On Click: Discover Button")
+        self.discover_button.text = "Searching..."
+        self.discover_button.disabled = True
+        self.start_button.disabled = True
+        self.page.update()
+        try:
+            self.host, self.port = self.controller.connect_to_least_loaded_server()
+            self.host_textbox.value = str(self.host)
+            self.port_textbox.value = str(self.port)
+            self.start_button.text = "Connected!"
+            self.discover_button.text = "Found!"
+            self.host_textbox.disabled = True
+            self.port_textbox.disabled = True
+        except ce.NoServersDiscoveredError as e:
+            self.discover_button.text = "Find a Server"
+            self.discover_button.disabled = False
+            self.start_button.disabled = False
+            Utility.create_snackbar(self.page, f"An error occurred: {e}")
+        finally:
+            self.page.update()
+
     def __on_click_exit_button(self, _) -> None:
         """Closes the application window."""
         logger.debug("On Click: Exit Button")
@@ -224,17 +251,20 @@ class ClientGUI:
             time.sleep(1)
 
     def __update_group_chat(self) -> None:
-        """Run this function every second on a separate thread to update the group chat."""
+        """Run this function on a separate thread to update the group chat as soon as a message arrives."""
         while self.running_flag:
-            if self.controller.client_running:
-                # logger.debug("Updating group chat...")
-                if self.group_chat_message_queue is None:
-                    self.group_chat_message_queue = self.controller.get_message_queue()
-                if not self.group_chat_message_queue.empty():
-                    message = self.group_chat_message_queue.get()
-                    logger.debug(f"New message in the group chat message queue. Message: {message}")
-                    self.__update_msg_list(message)
-            time.sleep(1)
+            if not self.controller.client_running:
+                time.sleep(1)
+                continue
+            # logger.debug("Updating group chat...")
+            if self.group_chat_message_queue is None:
+                self.group_chat_message_queue = self.controller.get_message_queue()
+            try:
+                message = self.group_chat_message_queue.get(timeout=1)  # Wakes up to check the running flag
+            except queue.Empty:
+                continue
+            logger.debug(f"New message in the group chat message queue. Message: {message}")
+            self.__update_msg_list(message)
 
     # ---------------------- #
     # --- Helper Methods --- #
@@ -370,7 +400,8 @@ class ClientGUI:
         self.__draw_app_bar()
         host_port_row = Row(controls=[self.host_textbox,
                                       self.port_textbox,
-                                      self.start_button],
+                                      self.start_button,
+                                      self.discover_button],
                             wrap=False)
         weather_and_currency = Row(controls=[self.__get_weather_container(),
                                              self.__get_currency_container()],
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+BASE_CURRENCY = "TRY"  # The fetched rates are prices in Turkish lira
+DECIMAL_PLACES = 4
+
+
+class CrossRates:
+    """An immutable snapshot of the cross-rate matrix: rates[i][j] is the price of one unit of currencies[i] in
+    currencies[j], None if either rate is not available yet."""
+    __slots__ = ('currencies', 'index', 'rates')
+
+    def __init__(self, prices: dict):
+        self.currencies = (BASE_CURRENCY, *prices)
+        self.index = {currency: i for i, currency in enumerate(self.currencies)}
+        # The whole matrix is built from one price vector: row i is the vector divided by its own entry, so every
+        # row is a single pass over the vector instead of a lookup and a division per request.
+        vector = [1.0, *(float(price) if price else None for price in prices.values())]
+        inverse = [1.0 / price if price else None for price in vector]
+        self.rates = tuple(tuple(None if price is None or inverse_price is None else price * inverse_price
+                                 for inverse_price in inverse)
+                           for price in vector)
+
+
+class CurrencyConverter:
+    """Converts between any two of the supported currencies from a cross-rate matrix that is computed once per
+    currency update, a conversion is a lookup and a multiplication.
+    The matrix is replaced as a whole, so requests read it without a lock while it is being updated."""
+
+    def __init__(self, prices: dict | None = None):
+        self.cross_rates = CrossRates(prices or {})
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def update(self, prices: dict) -> None:
+        self.cross_rates = CrossRates(prices)
+
+    def get_currencies(self) -> tuple[str, ...]:
+        return self.cross_rates.currencies
+
+    def convert(self, amount: float, from_currency: str, to_currency: str) -> float:
+        """Converts the amount, raises ValueError for an unknown currency or a rate that is not available yet"""
+        return self.convert_many([(amount, from_currency, to_currency)])[0]
+
+    def convert_many(self, conversions) -> list[float]:
+        """Converts every (amount, from, to) with the same snapshot of the matrix"""
+        cross_rates = self.cross_rates
+        results = []
+        for amount, from_currency, to_currency in conversions:
+            try:
+                rate = cross_rates.rates[cross_rates.index[from_currency]][cross_rates.index[to_currency]]
+            except KeyError as e:
+                raise ValueError(f"Unknown currency {e.args[0]}, supported: {', '.join(cross_rates.currencies)}")
+            if rate is None:
+                raise ValueError(f"The {from_currency}/{to_currency} rate is not available yet")
+            results.append(round(float(amount) * rate, DECIMAL_PLACES))
+        return results
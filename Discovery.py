@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import socket
+import threading
+import time
+import uuid
+
+import AkinProtocol
+import EventLogger as ev
+from EventLogger import EventLogger
+
+DEFAULT_DISCOVERY_TIMEOUT = 0.3  # seconds the client waits for the answers of the servers at most
+QUIET_PERIOD = 0.03  # The servers of a LAN answer within a few ms of each other, stop X seconds after the last answer
+# The LAN broadcast reaches the servers of the other machines, the loopback broadcast the ones on this machine even
+# when it has no network.
+DISCOVERY_ADDRESSES = ("<broadcast>", "127.255.255.255")
+MAX_DATAGRAM_SIZE = 512
+RESPONDER_TIMEOUT = 0.5  # The responder wakes up every X seconds to check the running flag
+
+
+class ServerAdvertisement:
+    """The answer of one server to a discovery broadcast. load is the number of residents it serves."""
+    __slots__ = ('server_id', 'host', 'port', 'load', 'response_time')
+
+    def __init__(self, server_id: str, host: str, port: int, load: int, response_time: float):
+        self.server_id = server_id
+        self.host = host
+        self.port = port
+        self.load = load
+        self.response_time = response_time
+
+    def __repr__(self):
+        return f"{self.host}:{self.port} ({self.load} residents, {self.response_time * 1e3:.1f} ms)"
+
+
+class DiscoveryResponder(threading.Thread):
+    """Answers the discovery broadcasts of the clients with the port and the load of the server.
+
+    The UDP port is bound with SO_REUSEPORT, so several servers on one machine, or a server and its successor during
+    a hot restart, all receive the broadcasts and all answer them."""
+
+    def __init__(self, server_port: int, get_load, discovery_port: int = AkinProtocol.DEFAULT_DISCOVERY_PORT,
+                 event_logger: EventLogger | None = None):
+        super().__init__(name="DiscoveryResponder", daemon=True)
+        self.server_port = server_port
+        self.get_load = get_load  # Called for every request, the load is never stale
+        self.discovery_port = discovery_port
+        self.event_logger = event_logger
+        self.server_id = uuid.uuid4().hex[:12]  # Tells apart the answers of the same server to both broadcasts
+        self.running_flag = True
+        self.udp_socket: socket.socket | None = None
+
+    def run(self):
+        try:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.udp_socket.bind(("", self.discovery_port))
+            self.udp_socket.settimeout(RESPONDER_TIMEOUT)
+        except OSError as e:
+            if self.event_logger is not None:
+                self.event_logger.warning(ev.SERVER, "Discovery is disabled, could not bind UDP port %s: %s",
+                                          self.discovery_port, e)
+            return
+        while self.running_flag:
+            try:
+                data, address = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # The socket is closed
+            if data != AkinProtocol.DISCOVERY_REQUEST.encode():
+                continue
+            response = AkinProtocol.construct_discovery_response(self.server_id, self.server_port, self.get_load())
+            try:
+                self.udp_socket.sendto(response.encode(), address)
+            except OSError:
+                continue
+        self.udp_socket.close()
+
+    def stop(self) -> None:
+        self.running_flag = False
+
+
+def discover_servers(discovery_port: int = AkinProtocol.DEFAULT_DISCOVERY_PORT,
+                     timeout: float = DEFAULT_DISCOVERY_TIMEOUT) -> list[ServerAdvertisement]:
+    """Broadcasts a discovery request and returns the servers that answered, least loaded first. Servers with the same
+    load are in the order they answered in. The answers are collected until none arrives for QUIET_PERIOD seconds, or
+    for timeout seconds if no server answers."""
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    request = AkinProtocol.DISCOVERY_REQUEST.encode()
+    advertisements: dict[str, ServerAdvertisement] = {}
+    started_at = time.perf_counter()
+    deadline = started_at + timeout
+    try:
+        for address in DISCOVERY_ADDRESSES:
+            try:
+                udp_socket.sendto(request, (address, discovery_port))
+            except OSError:
+                continue  # No route for this broadcast, e.g. a machine without a network
+        while (remaining := deadline - time.perf_counter()) > 0:
+            udp_socket.settimeout(remaining)
+            try:
+                data, (host, _) = udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                break
+            try:
+                advertisement = AkinProtocol.parse_discovery_response(data.decode())
+            except (UnicodeDecodeError, ValueError):
+                continue
+            if advertisement['server_id'] not in advertisements:
+                advertisements[advertisement['server_id']] = ServerAdvertisement(
+                    advertisement['server_id'], host, advertisement['port'], advertisement['load'],
+                    time.perf_counter() - started_at)
+            deadline = min(started_at + timeout, time.perf_counter() + QUIET_PERIOD)
+    finally:
+        udp_socket.close()
+    return sorted(advertisements.values(), key=lambda advertisement: advertisement.load)
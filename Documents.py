@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import os
+import shutil
+import threading
+
+import AkinProtocol
+
+DEFAULT_DOCUMENT_DIR = "cins_documents"
+DOCUMENT_CHUNK_SIZE = 64 * 1024  # bytes sent in one go, the queued chat messages are written between two chunks
+PUBLISH_SUFFIX = ".publishing"
+
+
+class DocumentDownload:
+    """A document being sent to one connection, from offset up to size"""
+    __slots__ = ('name', 'file', 'offset', 'size')
+
+    def __init__(self, name: str, file, offset: int, size: int):
+        self.name = name
+        self.file = file  # Opened in binary mode, the socket sends it straight from the page cache
+        self.offset = offset
+        self.size = size
+
+    def is_done(self) -> bool:
+        return self.offset >= self.size
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class DocumentStore:
+    """The documents management publishes for the residents (minutes, invoices, notices).
+
+    A published document is copied next to its final name and renamed into place, a download that is in progress
+    keeps reading the file it opened, and a resident never sees half a document. Documents are never read into
+    memory, they are sent with socket.sendfile."""
+
+    def __init__(self, directory: str = DEFAULT_DOCUMENT_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def publish(self, source_path: str, name: str | None = None) -> str:
+        """Copies the file into the store, replacing the document with the same name. Returns the name of the document.
+
+        Exceptions:
+            ValueError: If the name can not be used for a document
+            OSError: If the file can not be read
+        """
+        name = os.path.basename(source_path) if name is None else name
+        self.__validate_name(name)
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            shutil.copyfile(source_path, path + PUBLISH_SUFFIX)
+            os.replace(path + PUBLISH_SUFFIX, path)
+        return name
+
+    def list_documents(self) -> list[tuple[str, int]]:
+        """Returns the (name, size in bytes) of every document, sorted by name"""
+        if not os.path.isdir(self.directory):
+            return []
+        documents = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(PUBLISH_SUFFIX):
+                    documents.append((entry.name, entry.stat().st_size))
+        return sorted(documents)
+
+    def open_download(self, name: str, offset: int = 0) -> DocumentDownload:
+        """Opens the document for a download that starts at offset
+
+        Exceptions:
+            ValueError: If there is no such document or the offset is past its end
+        """
+        self.__validate_name(name)
+        try:
+            file = open(os.path.join(self.directory, name), "rb")
+        except FileNotFoundError:
+            raise ValueError(f"There is no document named {name}")
+        size = os.fstat(file.fileno()).st_size
+        if not 0 <= offset <= size:
+            file.close()
+            raise ValueError(f"The document {name} has {size} bytes, can not start at byte {offset}")
+        return DocumentDownload(name, file, offset, size)
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    @staticmethod
+    def __validate_name(name: str) -> None:
+        if (not name or name != os.path.basename(name) or name.startswith(".") or name.endswith(PUBLISH_SUFFIX)
+                or AkinProtocol.DELIMITER in name):
+            raise ValueError(f"{name!r} is not a valid document name")
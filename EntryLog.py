@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import array
+import bisect
+import collections
+import itertools
+import json
+import operator
+import os
+import statistics
+import threading
+import time
+
+DEFAULT_ENTRY_LOG_DIR = "cins_entries"
+DEFAULT_ANOMALY_THRESHOLD = 3.0  # An apartment is busy if it has X standard deviations more entries than the mean
+NIGHT_HOURS = range(0, 5)  # Entries in these hours of the day are reported
+BURST_LIMIT = 10  # A card that enters more than X times in one hour is reported
+CARD_DICTIONARY_FILE = "cards.jsonl"
+
+### Event Kinds ###
+REGISTER = 0  # The card was scanned
+RESUME = 1  # A resident came back on a resumed session
+EXIT = 2  # The connection of a registered resident was closed
+KIND_NAMES = ("register", "resume", "exit")
+
+# Column name and array typecode. Every month is a directory with one file per column, the hour of the day is stored
+# with every event, so that the queries never convert a timestamp.
+COLUMNS = (('timestamps', 'q'), ('apartments', 'i'), ('cards', 'I'), ('kinds', 'B'), ('hours', 'B'))
+
+# bytes.translate tables that turn the kinds and the hours columns into 0/1 masks for itertools.compress
+_ENTRY_MASK = bytes(1 if kind in (REGISTER, RESUME) else 0 for kind in range(256))
+_NIGHT_MASK = bytes(1 if hour in NIGHT_HOURS else 0 for hour in range(256))
+
+
+class Partition:
+    """The events of one month, one array per column, sorted by time"""
+    __slots__ = ('directory', 'columns', 'files')
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        self.files = None  # Opened for appending when an event of this month is recorded
+
+    def __len__(self) -> int:
+        return len(self.columns['timestamps'])
+
+    def slice(self, start: float, end: float) -> dict[str, array.array]:
+        """Returns the columns of the events in [start, end)"""
+        timestamps = self.columns['timestamps']
+        low = bisect.bisect_left(timestamps, start)
+        high = bisect.bisect_left(timestamps, end)
+        return {name: column[low:high] for name, column in self.columns.items()}
+
+
+class EntryLog:
+    """Records the registrations, entries and exits of the residents in an append-only columnar store and answers
+    aggregate queries over it.
+
+    An event is 18 bytes over five column files, the card ids are numbered in a dictionary file. A month is read
+    into typed arrays the first time it is queried, a time range is two binary searches on the sorted timestamps,
+    and the aggregates run over whole column slices with byte masks and counters, never with a loop per event. A
+    crash can leave the columns of the last event at different lengths, they are cut to the shortest one."""
+
+    def __init__(self, directory: str = DEFAULT_ENTRY_LOG_DIR):
+        self.directory = directory
+        self.partitions: dict[str, Partition] = {}  # month: Partition, only the months that were read or written
+        self.card_ids: list[str] = []
+        self.card_numbers: dict[str, int] = {}
+        self.card_file = None
+        self.report_apartments: frozenset[int] = frozenset()  # The apartments that may query the reports
+        self.lock = threading.Lock()
+        self.__load_card_dictionary()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def record(self, kind: int, card_id: str, apartment_no: int, timestamp: float | None = None) -> None:
+        """Appends an event, can be called from any thread. Every value is packed before the first column is
+        written, a failed event leaves no column longer than the others.
+
+        Exceptions:
+            ValueError: If the apartment number or the kind does not fit in its column
+            OSError: If the event could not be written
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        local_time = time.localtime(timestamp)
+        with self.lock:
+            partition = self.__get_partition(time.strftime("%Y-%m", local_time))
+            if len(partition) and timestamp < partition.columns['timestamps'][-1]:
+                timestamp = partition.columns['timestamps'][-1]  # The clock went back, the columns stay sorted
+            values = {'timestamps': int(timestamp), 'apartments': apartment_no, 'kinds': kind,
+                      'hours': local_time.tm_hour}
+            try:
+                packed = {name: array.array(typecode, [values[name]]) for name, typecode in COLUMNS
+                          if name != 'cards'}
+            except OverflowError as e:
+                raise ValueError(f"The event of apartment {apartment_no} can not be stored: {e}") from e
+            packed['cards'] = array.array('I', [self.__get_card_number(card_id)])
+            if partition.files is None:
+                os.makedirs(partition.directory, exist_ok=True)
+                partition.files = {name: open(os.path.join(partition.directory, f"{name}.{typecode}"), "ab")
+                                   for name, typecode in COLUMNS}
+            try:
+                for name, _ in COLUMNS:
+                    partition.files[name].write(packed[name].tobytes())
+                    partition.files[name].flush()
+            except OSError:
+                self.__truncate_files(partition)
+                raise
+            for name, column in partition.columns.items():
+                column.extend(packed[name])
+
+    def allow_reports(self, apartment_nos) -> None:
+        """Only the residents of these apartments, e.g. the security desk, can query the reports over the protocol"""
+        self.report_apartments = frozenset(apartment_nos)
+
+    def can_query(self, apartment_no: int) -> bool:
+        return apartment_no in self.report_apartments
+
+    def get_entries_per_hour(self, start: float, end: float, apartment_no: int | None = None) -> list[int]:
+        """Returns the number of entries in every hour of the day, from 00 to 23, between start and end"""
+        counts = collections.Counter()
+        for columns in self.__scan(start, end):
+            mask = columns['kinds'].tobytes().translate(_ENTRY_MASK)
+            if apartment_no is not None:
+                mask = bytes(map(operator.and_, mask, map(apartment_no.__eq__, columns['apartments'])))
+            counts.update(itertools.compress(columns['hours'], mask))
+        return [counts[hour] for hour in range(24)]
+
+    def get_entries_per_apartment(self, start: float, end: float) -> dict[int, int]:
+        """Returns the number of entries of every apartment between start and end, most entries first"""
+        counts = collections.Counter()
+        for columns in self.__scan(start, end):
+            counts.update(itertools.compress(columns['apartments'], columns['kinds'].tobytes().translate(_ENTRY_MASK)))
+        return dict(counts.most_common())
+
+    def get_anomalies(self, start: float, end: float,
+                      threshold: float = DEFAULT_ANOMALY_THRESHOLD) -> list[tuple[str, str, int]]:
+        """Returns (kind, subject, count) for every apartment with far more entries than the others ("busy"), every
+        apartment with entries at night ("night"), and every card that entered more than BURST_LIMIT times in one
+        hour ("burst", the subject is the card id and the hour)"""
+        per_apartment = collections.Counter()
+        at_night = collections.Counter()
+        per_card_hour = collections.Counter()
+        for columns in self.__scan(start, end):
+            entry_mask = columns['kinds'].tobytes().translate(_ENTRY_MASK)
+            night_mask = bytes(map(operator.and_, entry_mask, columns['hours'].tobytes().translate(_NIGHT_MASK)))
+            per_apartment.update(itertools.compress(columns['apartments'], entry_mask))
+            at_night.update(itertools.compress(columns['apartments'], night_mask))
+            hour_starts = map(operator.sub, columns['timestamps'],
+                              map(operator.mod, columns['timestamps'], itertools.repeat(3600)))
+            per_card_hour.update(itertools.compress(zip(columns['cards'], hour_starts), entry_mask))
+
+        anomalies = []
+        if len(per_apartment) > 1:
+            mean = statistics.fmean(per_apartment.values())
+            limit = mean + threshold * statistics.pstdev(per_apartment.values(), mean)
+            anomalies.extend(("busy", str(apartment_no), count) for apartment_no, count in per_apartment.most_common()
+                             if count > limit)
+        anomalies.extend(("night", str(apartment_no), count) for apartment_no, count in at_night.most_common())
+        anomalies.extend(("burst", f"{self.card_ids[card]} {time.strftime('%d.%m.%Y %H:00', time.localtime(hour))}",
+                          count) for (card, hour), count in per_card_hour.most_common() if count > BURST_LIMIT)
+        return anomalies
+
+    def get_size(self) -> int:
+        """Returns the number of events of the months that were read or written by this process"""
+        with self.lock:
+            return sum(len(partition) for partition in self.partitions.values())
+
+    def reload(self) -> None:
+        """Forgets what was read from disk and reads the card dictionary again, the log was written by another process
+        in the meantime (e.g. the server process this one took over from)"""
+        with self.lock:
+            self.__close_files()
+            self.partitions.clear()
+            self.card_ids = []
+            self.card_numbers = {}
+            self.__load_card_dictionary()
+
+    def close(self) -> None:
+        with self.lock:
+            self.__close_files()
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __close_files(self) -> None:
+        """Called with the lock held, the files are opened again by the next event"""
+        for partition in self.partitions.values():
+            for file in (partition.files or {}).values():
+                file.close()
+            partition.files = None
+        if self.card_file is not None:
+            self.card_file.close()
+            self.card_file = None
+
+    def __scan(self, start: float, end: float):
+        """Yields the column slices of the events in [start, end), month by month"""
+        if not os.path.isdir(self.directory):
+            return
+        first_month = time.strftime("%Y-%m", time.localtime(max(start, 0)))
+        last_month = time.strftime("%Y-%m", time.localtime(end))
+        for month in sorted(os.listdir(self.directory)):
+            if first_month <= month <= last_month and os.path.isdir(os.path.join(self.directory, month)):
+                with self.lock:
+                    columns = self.__get_partition(month).slice(start, end)
+                yield columns
+
+    def __get_partition(self, month: str) -> Partition:
+        """Called with the lock held, reads the month from disk the first time it is used"""
+        partition = self.partitions.get(month)
+        if partition is not None:
+            return partition
+        partition = Partition(os.path.join(self.directory, month))
+        if os.path.isdir(partition.directory):
+            for name, typecode in COLUMNS:
+                path = os.path.join(partition.directory, f"{name}.{typecode}")
+                if os.path.exists(path):
+                    with open(path, "rb") as column_file:
+                        partition.columns[name].frombytes(column_file.read())
+            length = min(len(column) for column in partition.columns.values())
+            for name, typecode in COLUMNS:
+                column = partition.columns[name]
+                if len(column) > length:  # The last event was cut by a crash
+                    del column[length:]
+                    os.truncate(os.path.join(partition.directory, f"{name}.{typecode}"), length * column.itemsize)
+        self.partitions[month] = partition
+        return partition
+
+    def __truncate_files(self, partition: Partition) -> None:
+        """Called with the lock held, cuts the columns of an event that was written only in part"""
+        for name, _ in COLUMNS:
+            column = partition.columns[name]
+            try:
+                partition.files[name].truncate(len(column) * column.itemsize)
+            except (OSError, ValueError):
+                pass  # Cut to the shortest column when the month is read again
+
+    def __load_card_dictionary(self) -> None:
+        path = os.path.join(self.directory, CARD_DICTIONARY_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as card_file:
+            lines = card_file.read().splitlines(keepends=True)
+        offset = 0
+        for line in lines:
+            try:
+                card_id = json.loads(line) if line.endswith(b"\n") else None
+            except ValueError:
+                card_id = None
+            if not isinstance(card_id, str):
+                os.truncate(path, offset)  # The last line was cut by a crash
+                break
+            self.card_numbers[card_id] = len(self.card_ids)
+            self.card_ids.append(card_id)
+            offset += len(line)
+
+    def __get_card_number(self, card_id: str) -> int:
+        """Called with the lock held, numbers the card the first time it is seen"""
+        card_number = self.card_numbers.get(card_id)
+        if card_number is not None:
+            return card_number
+        if self.card_file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.card_file = open(os.path.join(self.directory, CARD_DICTIONARY_FILE), "a", encoding="utf-8")
+        self.card_file.write(json.dumps(card_id) + "\n")
+        self.card_file.flush()
+        card_number = self.card_numbers[card_id] = len(self.card_ids)
+        self.card_ids.append(card_id)
+        return card_number
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+### Event Names ###
+SERVER = "SERVER"
+CONNECTION = "CONNECTION"
+REGISTER = "REGISTER"
+SUBSCRIPTION = "SUBSCRIPTION"
+CHAT = "CHAT"
+DIRECT = "DIRECT"
+ANNOUNCEMENT = "ANNOUNCEMENT"
+FEDERATION = "FEDERATION"
+DOCUMENT = "DOCUMENT"
+UPDATE = "UPDATE"
+
+DEFAULT_LOG_FILE = "cins_server_events.log"
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+EVENT_FIELDS = ("event", "card_id", "apartment_no", "client_address")
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a log record as a single JSON line, keeping the per-event fields as separate keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {'time': self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+               'level': record.levelname,
+               'message': record.getMessage()}
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                out[field] = value if isinstance(value, (int, str)) else str(value)
+        return json.dumps(out, ensure_ascii=False)
+
+
+class ReadableFormatter(logging.Formatter):
+    """Formats a log record the way the server console shows it: [LEVEL] EVENT | message"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, 'event', None) or SERVER
+        return f"[{record.levelname}] {event} | {record.getMessage()}"
+
+
+class SubscriberHandler(logging.Handler):
+    """Fans formatted records out to every subscribed queue (GUI, headless console...)."""
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(ReadableFormatter())
+        self.subscribers: list[tuple[int, queue.Queue]] = []
+        self.subscribers_lock = threading.Lock()
+
+    def add_subscriber(self, subscriber_queue: queue.Queue, level: int) -> None:
+        with self.subscribers_lock:
+            self.subscribers = self.subscribers + [(level, subscriber_queue)]
+
+    def remove_subscriber(self, subscriber_queue: queue.Queue) -> None:
+        with self.subscribers_lock:
+            self.subscribers = [(lvl, q) for lvl, q in self.subscribers if q is not subscriber_queue]
+
+    def emit(self, record: logging.LogRecord) -> None:
+        subscribers = self.subscribers  # Copy-on-write list, safe to iterate without the lock.
+        if not subscribers:
+            return
+        message = self.format(record)
+        for level, subscriber_queue in subscribers:
+            if record.levelno >= level:
+                subscriber_queue.put(message)
+
+
+class EventLogger:
+    """A structured, non-blocking logger for server events.
+    The calling thread only drops the record on an in-memory queue; formatting, writing the rotating log file and
+    notifying the subscribers all happen on a background listener thread."""
+
+    def __init__(self, name: str = "cins.server", log_file: str | None = DEFAULT_LOG_FILE, level: int = logging.INFO,
+                 max_bytes: int = DEFAULT_MAX_BYTES, backup_count: int = DEFAULT_BACKUP_COUNT,
+                 echo_to_console: bool = False):
+        self.record_queue = queue.SimpleQueue()
+        self.logger = logging.Logger(name, level)  # Not registered by name, another instance can not take it over
+        self.logger.propagate = False
+        self.logger.addHandler(logging.handlers.QueueHandler(self.record_queue))
+
+        self.subscriber_handler = SubscriberHandler()
+        handlers: list[logging.Handler] = [self.subscriber_handler]
+        if log_file is not None:
+            file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                                backupCount=backup_count, encoding="utf-8",
+                                                                delay=True)
+            file_handler.setFormatter(StructuredFormatter())
+            handlers.append(file_handler)
+        if echo_to_console:  # Headless mode, there is no GUI to subscribe to the events.
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(ReadableFormatter())
+            handlers.append(console_handler)
+        self.listener = logging.handlers.QueueListener(self.record_queue, *handlers, respect_handler_level=True)
+        self.listener_running = False
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def start(self) -> None:
+        if not self.listener_running:
+            self.listener.start()
+            self.listener_running = True
+
+    def stop(self) -> None:
+        """Stops the listener thread after flushing every record that is already queued."""
+        if self.listener_running:
+            self.listener.stop()
+            self.listener_running = False
+
+    def set_level(self, level: int) -> None:
+        self.logger.setLevel(level)
+
+    def is_enabled_for(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def subscribe(self, level: int = logging.INFO) -> queue.Queue:
+        """Returns a queue that will receive every readable log line at or above the given level."""
+        subscriber_queue = queue.Queue()
+        self.subscriber_handler.add_subscriber(subscriber_queue, level)
+        return subscriber_queue
+
+    def unsubscribe(self, subscriber_queue: queue.Queue) -> None:
+        self.subscriber_handler.remove_subscriber(subscriber_queue)
+
+    def log(self, level: int, event: str, msg: str, *args, **fields) -> None:
+        """Logs an event. Use %-style args so that the message is only formatted when the level is enabled.
+        fields: per-event fields such as card_id, apartment_no and client_address"""
+        if self.logger.isEnabledFor(level):
+            fields['event'] = event
+            self.logger.log(level, msg, *args, extra=fields)
+
+    def debug(self, event: str, msg: str, *args, **fields) -> None:
+        self.log(logging.DEBUG, event, msg, *args, **fields)
+
+    def info(self, event: str, msg: str, *args, **fields) -> None:
+        self.log(logging.INFO, event, msg, *args, **fields)
+
+    def warning(self, event: str, msg: str, *args, **fields) -> None:
+        self.log(logging.WARNING, event, msg, *args, **fields)
+
+    def error(self, event: str, msg: str, *args, **fields) -> None:
+        self.log(logging.ERROR, event, msg, *args, **fields)
@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import hmac
+import itertools
+import json
+import socket
+import threading
+import time
+
+import AkinProtocol
+import EventLogger as ev
+from EventLogger import EventLogger
+
+BATCH_WINDOW = 0.01  # seconds a link waits for more messages after the first one, they are sent as one batch
+MAX_BATCH_MESSAGES = 256
+PEER_QUEUE_LIMIT = 4096  # Messages waiting to be sent to a single peer, the newest ones are dropped beyond it
+SEEN_MESSAGES_LIMIT = 65536  # The ids of the last X relayed messages are kept to drop the copies of a mesh
+CONNECT_TIMEOUT = 3.0
+RECONNECT_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+MAX_RECONNECT_BACKOFF = 30.0
+RECEIVE_BUFFER_SIZE = 65536
+HELLO_MAX_AGE = 60.0  # seconds, an older hello is refused so that a recorded one can not be replayed for long
+# Announcements and chat messages are relayed, the weather and currency responses share one fetched feed
+FEED_MESSAGES = {AkinProtocol.WEATHER: AkinProtocol.construct_weather_response,
+                 AkinProtocol.CURRENCY: AkinProtocol.construct_currency_response}
+
+
+def validate_node_id(node_id: str) -> None:
+    """Raises ValueError if the node id can not be sent in the path of a relayed message"""
+    if not node_id or "," in node_id or AkinProtocol.DELIMITER in node_id:
+        raise ValueError("A block name can not be empty or contain a comma or the protocol delimiter")
+
+
+class PeerLink(threading.Thread):
+    """The link to one peer server. Relayed messages are queued and a batch of them is sent in a single stream frame
+    at most every BATCH_WINDOW seconds, so a burst of chat costs one write per peer instead of one per message."""
+
+    def __init__(self, node_id: str, send, close):
+        super().__init__(name=f"PeerLink-{node_id}", daemon=True)
+        self.node_id = node_id
+        self.send = send  # Writes one frame, returns False or raises OSError when the link is down
+        self.close = close
+        self.outbound_messages: collections.deque[str] = collections.deque()
+        self.condition = threading.Condition()
+        self.running_flag = True
+        self.sent_messages = 0
+        self.sent_batches = 0
+        self.dropped_messages = 0
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running_flag and not self.outbound_messages:
+                    self.condition.wait()
+                if not self.running_flag:
+                    break
+            time.sleep(BATCH_WINDOW)  # Lets the messages of the same burst join the batch
+            with self.condition:
+                batch = [self.outbound_messages.popleft()
+                         for _ in range(min(len(self.outbound_messages), MAX_BATCH_MESSAGES))]
+            frame = AkinProtocol.construct_stream_frame(AkinProtocol.FEDERATION_STREAM_ID,
+                                                        AkinProtocol.construct_batch(batch))
+            try:
+                if self.send(frame) is False:
+                    break
+            except OSError:
+                break
+            self.sent_messages += len(batch)
+            self.sent_batches += 1
+        self.close()
+
+    def queue_message(self, message: str) -> bool:
+        with self.condition:
+            if not self.running_flag:
+                return False
+            if len(self.outbound_messages) >= PEER_QUEUE_LIMIT:
+                self.dropped_messages += 1
+                return False
+            self.outbound_messages.append(message)
+            self.condition.notify()
+            return True
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running_flag = False
+            self.condition.notify()
+
+    def get_stats(self) -> dict:
+        return {'sent_messages': self.sent_messages, 'sent_batches': self.sent_batches,
+                'dropped_messages': self.dropped_messages, 'queued_messages': len(self.outbound_messages)}
+
+
+class Federation:
+    """Relays the channel messages, the announcements and the weather and currency feed between the servers of the
+    blocks of the complex.
+
+    Every server is a node with a unique block name. A node connects to the peers it is given over their usual port
+    and greets them with a peer hello instead of a card. Each link is listed on one side only. The nodes do not need
+    to be fully meshed: a message is relayed onwards to the peers that are not in its path, and the copies that
+    arrive over a second route are dropped by their id.
+
+    Every node of the federation is started with the same secret. The hellos of both ends of a link are signed with
+    it, a server that does not know the secret can not link and relay announcements, chat or feed data.
+
+    Only one node fetches the weather and currency data, the one with the smallest block name that is up, and the
+    others receive it from the feed. A node starts fetching again when no smaller node is linked and no feed from a
+    smaller node arrived for feed_stale_after seconds."""
+
+    def __init__(self, node_id: str, peers: list[tuple[str, int]], on_chat, on_announcement, on_feed,
+                 event_logger: EventLogger, secret: str):
+        validate_node_id(node_id)
+        if not secret:
+            raise ValueError("The servers of a federation need a shared secret")
+        self.node_id = node_id
+        self.peers = peers
+        self.secret = secret.encode()
+        self.on_chat = on_chat  # (channel, message) of a chat message of another block
+        self.on_announcement = on_announcement  # (message) of an announcement of another block
+        self.on_feed = on_feed  # (command, data) of the weather or currency data fetched by another block
+        self.event_logger = event_logger
+        self.links: dict[str, PeerLink] = {}
+        self.seen_messages: set[tuple[str, str]] = set()
+        self.seen_order: collections.deque[tuple[str, str]] = collections.deque()
+        self.feed_origins: dict[str, float] = {}  # node_id: when its feed was last received
+        self.last_feed_messages: dict[str, str] = {}  # command: the latest feed message, sent to every new link
+        self.message_ids = itertools.count(1)
+        self.epoch = format(int(time.time()), 'x')  # Ids stay unique when the node restarts
+        self.lock = threading.Lock()
+        self.running_flag = True
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def start(self) -> None:
+        for host, port in self.peers:
+            threading.Thread(target=self.__dial_peer, args=(host, port), name=f"PeerDialer-{host}:{port}",
+                             daemon=True).start()
+
+    def stop(self) -> None:
+        self.running_flag = False
+        with self.lock:
+            links = list(self.links.values())
+        for link in links:
+            link.stop()
+
+    def relay_chat(self, channel: str, message: str) -> None:
+        self.__originate(AkinProtocol.construct_chat_message(message, channel))
+
+    def relay_announcement(self, message: str) -> None:
+        self.__originate(AkinProtocol.construct_announcement(message))
+
+    def relay_feed(self, command: str, data: dict) -> None:
+        self.__originate(FEED_MESSAGES[command](json.dumps(data)))
+
+    def is_feed_source(self, feed_stale_after: float) -> bool:
+        """Returns True if this node should fetch the weather and currency data itself"""
+        now = time.monotonic()
+        with self.lock:
+            if any(node_id < self.node_id for node_id in self.links):
+                return False
+            return not any(node_id < self.node_id and now - received_at < feed_stale_after
+                           for node_id, received_at in self.feed_origins.items())
+
+    def accept_link(self, hello: str, send, close) -> PeerLink:
+        """Starts the link of a peer that connected to this node, send writes a frame back to it
+
+        Exceptions:
+            ValueError: If the hello is not signed with the secret, or the block name of the peer is invalid, is this
+                node's or is already linked
+        """
+        greeting = AkinProtocol.construct_stream_frame(AkinProtocol.FEDERATION_STREAM_ID, self.__construct_hello())
+        link = self.__add_link(self.__verify_hello(hello), send, close, greeting)
+        self.__send_last_feed(link)
+        return link
+
+    def remove_link(self, link: PeerLink) -> None:
+        link.stop()
+        with self.lock:
+            if self.links.get(link.node_id) is not link:
+                return
+            del self.links[link.node_id]
+        self.event_logger.warning(ev.FEDERATION, "The link to block %s is down.", link.node_id)
+
+    def handle_frame(self, link: PeerLink, payload: str) -> None:
+        """Handles a batch of relayed messages received from the peer of the link. An invalid message is logged and
+        skipped, it must not end the thread that reads the link."""
+        for message in AkinProtocol.parse_batch(payload):
+            try:
+                self.__handle_relayed_message(link, AkinProtocol.parse_federated_message(message))
+            except (KeyError, TypeError, ValueError) as e:  # e.g. a feed value that is not a number
+                self.event_logger.warning(ev.FEDERATION, "Block %s sent an invalid message: %s", link.node_id, e)
+
+    def get_links(self) -> dict[str, dict]:
+        with self.lock:
+            return {node_id: link.get_stats() for node_id, link in self.links.items()}
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __originate(self, message: str) -> None:
+        message_id = f"{self.epoch}.{next(self.message_ids)}"
+        with self.lock:
+            self.__mark_seen((self.node_id, message_id))
+        self.__relay(self.node_id, message_id, [self.node_id], message)
+
+    def __relay(self, origin: str, message_id: str, path: list[str], message: str) -> None:
+        """Queues the message on every link whose peer is not in its path"""
+        relayed = AkinProtocol.construct_federated_message(origin, message_id, path, message)
+        command = message.split(AkinProtocol.DELIMITER, 1)[0]
+        with self.lock:
+            if command in FEED_MESSAGES:
+                self.last_feed_messages[command] = relayed
+            links = [link for node_id, link in self.links.items() if node_id not in path]
+        for link in links:
+            link.queue_message(relayed)
+
+    def __handle_relayed_message(self, link: PeerLink, relayed: dict) -> None:
+        origin, message, path = relayed['origin'], relayed['message'], relayed['path']
+        with self.lock:
+            if origin == self.node_id or self.node_id in path or (origin, relayed['message_id']) in self.seen_messages:
+                return  # A copy that came back over another route
+            self.__mark_seen((origin, relayed['message_id']))
+        command = message.split(AkinProtocol.DELIMITER, 1)[0]
+        if command in FEED_MESSAGES:
+            data = json.loads(AkinProtocol.strip_delimiter(message))
+            if not isinstance(data, dict):
+                raise ValueError(f"The {command} data is not an object")
+            self.on_feed(command, data)
+            with self.lock:
+                self.feed_origins[origin] = time.monotonic()  # Only once the data was accepted
+        elif message.startswith(AkinProtocol.ANNOUNCEMENT_MESSAGE):
+            self.on_announcement(AkinProtocol.parse_announcement(message))
+        elif message.startswith(AkinProtocol.CHAT_MESSAGE):
+            chat_message = AkinProtocol.parse_chat_message(message)
+            self.on_chat(chat_message['channel'], chat_message['message'])
+        else:
+            self.event_logger.warning(ev.FEDERATION, "Block %s relayed an unknown message.", link.node_id)
+            return
+        self.__relay(origin, relayed['message_id'], path + [self.node_id], message)
+
+    def __mark_seen(self, key: tuple[str, str]) -> None:
+        """Called with the lock held"""
+        self.seen_messages.add(key)
+        self.seen_order.append(key)
+        if len(self.seen_order) > SEEN_MESSAGES_LIMIT:
+            self.seen_messages.discard(self.seen_order.popleft())
+
+    def __add_link(self, node_id: str, send, close, greeting: str | None = None) -> PeerLink:
+        """Registers the link, the greeting is sent before any relayed message can be queued on it"""
+        validate_node_id(node_id)
+        with self.lock:
+            if not self.running_flag:
+                raise ValueError(f"Block {self.node_id} is stopping")
+            if node_id == self.node_id:
+                raise ValueError(f"Block {node_id} can not link to itself")
+            if node_id in self.links:
+                raise ValueError(f"Block {node_id} is already linked")
+            if greeting is not None:
+                send(greeting)
+            link = PeerLink(node_id, send, close)
+            self.links[node_id] = link
+        link.start()
+        self.event_logger.info(ev.FEDERATION, "Linked to block %s.", node_id)
+        return link
+
+    def __construct_hello(self) -> str:
+        sent_at = format(time.time(), '.3f')
+        return AkinProtocol.construct_peer_hello(self.node_id, sent_at, self.__sign(self.node_id, sent_at))
+
+    def __verify_hello(self, hello: str) -> str:
+        """Returns the block name of the peer
+
+        Exceptions:
+            ValueError: If the hello is malformed, too old, or not signed with the secret of this federation
+        """
+        peer_hello = AkinProtocol.parse_peer_hello(hello)
+        if abs(time.time() - float(peer_hello['sent_at'])) > HELLO_MAX_AGE:
+            raise ValueError("The hello is too old, the clocks of the servers may be out of sync")
+        if not hmac.compare_digest(peer_hello['proof'], self.__sign(peer_hello['node_id'], peer_hello['sent_at'])):
+            raise ValueError("The hello is not signed with the secret of this federation")
+        return peer_hello['node_id']
+
+    def __sign(self, node_id: str, sent_at: str) -> str:
+        return hmac.new(self.secret, f"{node_id}{AkinProtocol.DELIMITER}{sent_at}".encode(), hashlib.sha256).hexdigest()
+
+    def __send_last_feed(self, link: PeerLink) -> None:
+        """A new peer gets the latest weather and currency data without waiting for the next fetch"""
+        with self.lock:
+            feed_messages = list(self.last_feed_messages.values())
+        for relayed in feed_messages:
+            if link.node_id not in AkinProtocol.parse_federated_message(relayed)['path']:
+                link.queue_message(relayed)
+
+    def __dial_peer(self, host: str, port: int) -> None:
+        """Keeps a link to the peer on host:port up, reconnecting with a backoff while it is down"""
+        backoff = RECONNECT_BACKOFF
+        while self.running_flag:
+            try:
+                peer_socket = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+            except OSError:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF)
+                continue
+            linked = self.__serve_dialed_link(peer_socket, f"{host}:{port}")
+            peer_socket.close()
+            if linked:
+                backoff = RECONNECT_BACKOFF
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF)
+
+    def __serve_dialed_link(self, peer_socket: socket.socket, address: str) -> bool:
+        """Greets the peer and reads its frames until the connection is closed. Returns False if the peer did not
+        accept the link."""
+        send_lock = threading.Lock()
+
+        def send(frame: str) -> None:
+            with send_lock:
+                peer_socket.sendall(frame.encode())
+
+        def close() -> None:
+            try:
+                peer_socket.shutdown(socket.SHUT_RDWR)  # Wakes the reading thread up
+            except OSError:
+                pass
+
+        link = None
+        buffer = b""
+        try:
+            send(self.__construct_hello())
+            peer_socket.settimeout(None)
+            while self.running_flag:
+                data = peer_socket.recv(RECEIVE_BUFFER_SIZE)
+                if not data:
+                    break
+                frames, buffer = AkinProtocol.split_stream_frames(
+                    buffer + data, (AkinProtocol.WELCOME_TO_THE_SERVER, AkinProtocol.PING_REQUEST))
+                for stream_id, payload in frames:
+                    if stream_id is None:
+                        if payload == AkinProtocol.PING_REQUEST:
+                            send(AkinProtocol.PONG_RESPONSE)
+                    elif link is not None:
+                        self.handle_frame(link, payload)
+                    elif payload.startswith(AkinProtocol.PEER_HELLO):
+                        link = self.__add_link(self.__verify_hello(payload), send, close)
+                        self.__send_last_feed(link)
+                    else:
+                        self.event_logger.warning(ev.FEDERATION, "The server on %s did not accept the link: %s",
+                                                  address, AkinProtocol.strip_delimiter(payload))
+                        return False
+        except (OSError, ValueError) as e:
+            self.event_logger.warning(ev.FEDERATION, "The link to the server on %s failed: %s", address, e)
+        finally:
+            if link is not None:
+                self.remove_link(link)
+        return link is not None
@@ -0,0 +1,124 @@
+import itertools
+import queue
+import socket
+import threading
+
+import AkinProtocol
+from Client import ResidentRequests, ServerMessageHandler
+
+RECEIVE_BUFFER_SIZE = 4096
+
+
+class GatewayClient:
+    """A lobby kiosk or an intercom gateway: many residents over a single connection to the server.
+    Every resident is a GatewayStream, its requests and responses are wrapped in stream frames."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.send_lock = threading.Lock()  # Frames of different streams must not interleave
+        self.streams: dict[int, GatewayStream] = {}
+        self.stream_ids = itertools.count(1)
+        self.listener_thread = GatewayListenerThread(self)
+
+    def start(self):
+        self.socket.connect((self.host, self.port))
+        self.listener_thread.start()
+
+    def open_stream(self):
+        """Returns a new resident on this connection, the server opens the stream on its first request"""
+        stream = GatewayStream(self, next(self.stream_ids))
+        self.streams[stream.stream_id] = stream
+        return stream
+
+    def close_stream(self, stream):
+        if self.streams.pop(stream.stream_id, None) is not None:
+            self.send_frame(stream.stream_id, AkinProtocol.STREAM_CLOSE_REQUEST)
+
+    def send_frame(self, stream_id, payload):
+        self.send_raw(AkinProtocol.construct_stream_frame(stream_id, payload))
+
+    def send_raw(self, message):
+        with self.send_lock:
+            self.socket.sendall(message.encode())
+
+    def receive_data(self) -> bytes:
+        try:
+            return self.socket.recv(RECEIVE_BUFFER_SIZE)
+        except OSError:
+            return b""
+
+    def close_connection(self):
+        self.listener_thread.stop()
+        self.socket.close()
+
+
+class GatewayStream(ResidentRequests):
+    """One resident of a GatewayClient, it keeps the same state as a Client"""
+
+    def __init__(self, gateway, stream_id):
+        self.gateway = gateway
+        self.stream_id = stream_id
+        self.message_queue = queue.Queue()
+        self.message_handler = ServerMessageHandler(self, self.message_queue)
+        self.weather_data = AkinProtocol.DEFAULT_WEATHER_DICT
+        self.currency_data = AkinProtocol.DEFAULT_CURRENCY_DICT
+        self.conversion_results = []
+        self.alert_ids = []
+        self.search_results = {'total': 0, 'page': 1, 'results': []}
+        self.documents = []
+        self.entry_report = {'report': None, 'rows': []}
+
+        ### Resumable Session ###
+        self.card = None
+        self.channels = set()
+        self.session_token = None
+        self.last_sequence_no = 0
+        self.resuming = False  # A stream is not resumed, it is registered again on a new gateway connection
+
+    def get_message_queue(self) -> queue.Queue:
+        return self.message_queue
+
+    def send_message(self, message):
+        self.gateway.send_frame(self.stream_id, message)
+
+    def close(self):
+        self.gateway.close_stream(self)
+
+
+class GatewayListenerThread(threading.Thread):
+    def __init__(self, gateway):
+        super().__init__(daemon=True)
+        self.gateway = gateway
+        self.buffer = b""
+        self.running_flag = True
+
+    def run(self):
+        while self.running_flag:
+            data = self.gateway.receive_data()
+            if not data:
+                print("Connection to server lost")
+                break
+            try:
+                frames, self.buffer = AkinProtocol.split_stream_frames(
+                    self.buffer + data, (AkinProtocol.WELCOME_TO_THE_SERVER, AkinProtocol.PING_REQUEST))
+            except ValueError as e:
+                print("Invalid data received from server:", e)
+                self.buffer = b""
+                continue
+            for stream_id, payload in frames:
+                self.handle_frame(stream_id, payload)
+
+    def handle_frame(self, stream_id, payload):
+        if stream_id is None:
+            if payload == AkinProtocol.PING_REQUEST:
+                self.gateway.send_raw(AkinProtocol.PONG_RESPONSE)
+            return
+        stream = self.gateway.streams.get(stream_id)
+        if stream is None:
+            return  # The stream was closed while the response was on its way
+        stream.message_handler.handle_server_message(payload)
+
+    def stop(self):
+        self.running_flag = False
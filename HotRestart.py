@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import struct
+
+DEFAULT_HANDOFF_PATH = "cins_server.handoff"  # The Unix socket a new server process takes the old one over from
+HANDOFF_TIMEOUT = 10  # seconds
+MAX_FDS_PER_MESSAGE = 250  # Linux accepts at most 253 file descriptors in a single SCM_RIGHTS message
+HANDOFF_ACK = b"ACK"
+
+_LENGTH = struct.Struct("!Q")
+
+
+def is_supported() -> bool:
+    """File descriptors can only be passed between processes over Unix sockets"""
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket, 'send_fds')
+
+
+def listen_for_successor(path: str) -> socket.socket:
+    """Listens on the handoff socket, a stale socket file of a previous server is replaced"""
+    if os.path.exists(path):
+        os.unlink(path)
+    handoff_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    handoff_socket.bind(path)
+    handoff_socket.listen(1)
+    return handoff_socket
+
+
+def connect_to_predecessor(path: str) -> socket.socket | None:
+    """Returns a connection to the running server that listens on the handoff socket, None if there is no such server"""
+    handoff_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        handoff_socket.connect(path)
+    except OSError:
+        handoff_socket.close()
+        return None
+    handoff_socket.settimeout(HANDOFF_TIMEOUT)
+    return handoff_socket
+
+
+def send_state(handoff_socket: socket.socket, state: dict, fds: list[int]) -> None:
+    """Sends the state as length-prefixed JSON, then the file descriptors it refers to by index"""
+    state = dict(state, fd_count=len(fds))
+    payload = json.dumps(state).encode()
+    handoff_socket.sendall(_LENGTH.pack(len(payload)) + payload)
+    for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+        socket.send_fds(handoff_socket, [b"F"], fds[start:start + MAX_FDS_PER_MESSAGE])
+
+
+def receive_state(handoff_socket: socket.socket) -> tuple[dict, list[int]]:
+    """Receives what send_state sent, the file descriptors are returned in the same order"""
+    length = _LENGTH.unpack(_receive_exactly(handoff_socket, _LENGTH.size))[0]
+    state = json.loads(_receive_exactly(handoff_socket, length))
+    fds = []
+    while len(fds) < state['fd_count']:
+        _, received_fds, _, _ = socket.recv_fds(handoff_socket, 1, MAX_FDS_PER_MESSAGE)
+        if not received_fds:
+            raise ConnectionError("Handoff socket closed before every file descriptor was received")
+        fds.extend(received_fds)
+    return state, fds
+
+
+def _receive_exactly(handoff_socket: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = handoff_socket.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Handoff socket closed before the whole state was received")
+        data += chunk
+    return data
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import collections
+import os
+import struct
+import threading
+import time
+import zlib
+
+DEFAULT_INBOX_DIR = "cins_inboxes"
+DEFAULT_MAX_MESSAGES = 100  # per apartment, the oldest messages are dropped beyond it
+DEFAULT_MAX_BYTES = 256 * 1024  # per apartment
+DEFAULT_TTL = 7 * 24 * 60 * 60  # seconds a message waits for a resident of the apartment to come back
+DEFAULT_SEGMENT_SIZE = 64 * 1024  # A new segment file is started when the last one grows past X bytes
+SWEEP_INTERVAL = 60 * 60  # seconds between two sweeps of the inboxes that nobody touched
+SEGMENT_SUFFIX = ".seg"
+
+# crc32 of the rest of the record, the unix time it was stored at, the length of the message
+_RECORD_HEADER = struct.Struct("!IdI")
+
+
+class InboxRecord:
+    __slots__ = ('stored_at', 'segment_no', 'offset', 'size')
+
+    def __init__(self, stored_at: float, segment_no: int, offset: int, size: int):
+        self.stored_at = stored_at
+        self.segment_no = segment_no
+        self.offset = offset
+        self.size = size  # with the header
+
+
+class Inbox:
+    """The messages waiting for one apartment. They are appended to segment files and only the position of every
+    message is kept in memory, the messages are read back once, when they are delivered."""
+    __slots__ = ('directory', 'segments', 'records', 'live_bytes', 'active_file', 'active_size')
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments: list[int] = []  # The numbers of the segment files, oldest first
+        self.records: collections.deque[InboxRecord] = collections.deque()  # Oldest first
+        self.live_bytes = 0
+        self.active_file = None  # The last segment, open for appending
+        self.active_size = 0
+
+    def segment_path(self, segment_no: int) -> str:
+        return os.path.join(self.directory, f"{segment_no:08d}{SEGMENT_SUFFIX}")
+
+
+class InboxStore:
+    """Persistent inboxes for the apartments whose residents are all offline.
+
+    Every apartment has a directory of append-only segment files. The messages of an inbox are only ever dropped
+    from its oldest end, when they expire or when the inbox is over its bounds, so the dropped records are always a
+    prefix of the segments: compaction deletes the segments that have no live record left and rewrites the oldest
+    remaining segment only when more than half of it is dropped. A record whose checksum does not match, the tail
+    of a write that was cut by a crash, ends its segment.
+
+    An inbox is read from disk the first time it is used, a server that takes over from a previous process sees the
+    messages that process stored."""
+
+    def __init__(self, directory: str = DEFAULT_INBOX_DIR, max_messages: int = DEFAULT_MAX_MESSAGES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.directory = directory
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.segment_size = segment_size
+        self.inboxes: dict[int, Inbox] = {}
+        self.last_sweep = time.monotonic()
+        self.lock = threading.Lock()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def append(self, apartment_no: int, message: str) -> None:
+        """Stores the message until a resident of the apartment comes back
+
+        Exceptions:
+            ValueError: If the message alone is larger than the inbox
+        """
+        payload = message.encode()
+        stored_at = time.time()
+        header = _RECORD_HEADER.pack(zlib.crc32(struct.pack("!d", stored_at) + payload), stored_at, len(payload))
+        if len(header) + len(payload) > self.max_bytes:
+            raise ValueError(f"The message is larger than the inbox of {self.max_bytes} bytes")
+        with self.lock:
+            inbox = self.__get_inbox(apartment_no)
+            if inbox.active_file is None or inbox.active_size >= self.segment_size:
+                self.__start_segment(inbox)
+            inbox.active_file.write(header + payload)
+            inbox.records.append(InboxRecord(stored_at, inbox.segments[-1], inbox.active_size,
+                                             len(header) + len(payload)))
+            inbox.active_size += len(header) + len(payload)
+            inbox.live_bytes += len(header) + len(payload)
+            self.__drop_oldest(inbox, stored_at)
+
+    def take(self, apartment_no: int) -> list[tuple[float, str]]:
+        """Returns the messages stored for the apartment, oldest first, as (stored at, message), and empties the
+        inbox"""
+        with self.lock:
+            inbox = self.__get_inbox(apartment_no, create=False)
+            if inbox is None:
+                return []
+            self.__drop_oldest(inbox, time.time())
+            messages = self.__read_messages(inbox)
+            self.__delete_inbox(apartment_no, inbox)
+        return messages
+
+    def get_sizes(self) -> dict[int, int]:
+        """Returns the number of messages waiting for every apartment whose inbox was used by this process"""
+        with self.lock:
+            return {apartment_no: len(inbox.records) for apartment_no, inbox in self.inboxes.items()}
+
+    def remove_expired(self) -> int:
+        """Drops the expired messages of every inbox on disk, at most once every SWEEP_INTERVAL seconds.
+        The inboxes that are not emptied are closed and read from disk again the next time they are used, so the
+        store keeps a file open only for the inboxes used since the last sweep. Returns the number of inboxes that
+        were emptied.
+
+        Exceptions:
+            OSError: If an inbox could not be read or written
+        """
+        with self.lock:
+            if time.monotonic() - self.last_sweep < SWEEP_INTERVAL:
+                return 0
+            self.last_sweep = time.monotonic()
+            if not os.path.isdir(self.directory):
+                return 0
+            emptied = 0
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if not name.isdigit():
+                    continue
+                inbox = self.__get_inbox(int(name), create=False)
+                if inbox is None:
+                    continue
+                self.__drop_oldest(inbox, now)
+                if not inbox.records:
+                    self.__delete_inbox(int(name), inbox)
+                    emptied += 1
+                else:
+                    self.__release_inbox(int(name), inbox)
+            return emptied
+
+    def close(self) -> None:
+        with self.lock:
+            for inbox in self.inboxes.values():
+                if inbox.active_file is not None:
+                    inbox.active_file.close()
+                    inbox.active_file = None
+            self.inboxes.clear()
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __get_inbox(self, apartment_no: int, create: bool = True) -> Inbox | None:
+        """Called with the lock held, reads the inbox from disk the first time it is used"""
+        inbox = self.inboxes.get(apartment_no)
+        if inbox is not None:
+            return inbox
+        directory = os.path.join(self.directory, str(apartment_no))
+        if not os.path.isdir(directory):
+            if not create:
+                return None
+            os.makedirs(directory)
+        inbox = Inbox(directory)
+        self.__load(inbox)
+        self.inboxes[apartment_no] = inbox
+        return inbox
+
+    def __load(self, inbox: Inbox) -> None:
+        inbox.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(inbox.directory)
+                                if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        for segment_no in inbox.segments:
+            with open(inbox.segment_path(segment_no), "rb") as segment:
+                data = segment.read()
+            offset = 0
+            while offset + _RECORD_HEADER.size <= len(data):
+                crc, stored_at, length = _RECORD_HEADER.unpack_from(data, offset)
+                end = offset + _RECORD_HEADER.size + length
+                if end > len(data) or zlib.crc32(
+                        struct.pack("!d", stored_at) + data[offset + _RECORD_HEADER.size:end]) != crc:
+                    break
+                inbox.records.append(InboxRecord(stored_at, segment_no, offset, end - offset))
+                inbox.live_bytes += end - offset
+                offset = end
+            if offset < len(data):
+                os.truncate(inbox.segment_path(segment_no), offset)  # Drops the torn record
+        if inbox.segments:
+            inbox.active_file = open(inbox.segment_path(inbox.segments[-1]), "ab", buffering=0)
+            inbox.active_size = os.path.getsize(inbox.segment_path(inbox.segments[-1]))
+        self.__drop_oldest(inbox, time.time())
+
+    def __start_segment(self, inbox: Inbox) -> None:
+        if inbox.active_file is not None:
+            inbox.active_file.close()
+        segment_no = inbox.segments[-1] + 1 if inbox.segments else 1
+        inbox.segments.append(segment_no)
+        inbox.active_file = open(inbox.segment_path(segment_no), "ab", buffering=0)
+        inbox.active_size = 0
+
+    def __drop_oldest(self, inbox: Inbox, now: float) -> None:
+        """Drops the expired messages and the oldest ones beyond the bounds of the inbox, then compacts it"""
+        records = inbox.records
+        while records and (now - records[0].stored_at > self.ttl or len(records) > self.max_messages
+                           or inbox.live_bytes > self.max_bytes):
+            inbox.live_bytes -= records.popleft().size
+        self.__compact(inbox)
+
+    def __compact(self, inbox: Inbox) -> None:
+        if inbox.records:
+            first_live_segment = inbox.records[0].segment_no
+        else:
+            first_live_segment = inbox.segments[-1] + 1 if inbox.segments else 1
+        while inbox.segments and inbox.segments[0] < first_live_segment:
+            segment_no = inbox.segments.pop(0)
+            if not inbox.segments and inbox.active_file is not None:
+                inbox.active_file.close()
+                inbox.active_file = None
+                inbox.active_size = 0
+            os.remove(inbox.segment_path(segment_no))
+        if not inbox.records:
+            return
+        head = inbox.records[0]
+        if head.segment_no == inbox.segments[-1]:
+            segment_size = inbox.active_size
+        else:
+            segment_size = os.path.getsize(inbox.segment_path(head.segment_no))
+        if head.offset * 2 <= segment_size:
+            return
+        # More than half of the oldest segment is dropped, its live records are moved to the start of the file
+        path = inbox.segment_path(head.segment_no)
+        with open(path, "rb") as segment:
+            segment.seek(head.offset)
+            live_data = segment.read()
+        with open(path + ".tmp", "wb") as compacted:
+            compacted.write(live_data)
+        os.replace(path + ".tmp", path)
+        shift = head.offset  # head is the first record that is moved, its offset must not be read after that
+        for record in inbox.records:
+            if record.segment_no != head.segment_no:
+                break
+            record.offset -= shift
+        if head.segment_no == inbox.segments[-1]:
+            inbox.active_file.close()
+            inbox.active_file = open(path, "ab", buffering=0)
+            inbox.active_size = len(live_data)
+
+    def __read_messages(self, inbox: Inbox) -> list[tuple[float, str]]:
+        messages = []
+        segment_no, data = None, b""
+        for record in inbox.records:
+            if record.segment_no != segment_no:
+                segment_no = record.segment_no
+                with open(inbox.segment_path(segment_no), "rb") as segment:
+                    data = segment.read()
+            start = record.offset + _RECORD_HEADER.size
+            messages.append((record.stored_at, data[start:record.offset + record.size].decode()))
+        return messages
+
+    def __release_inbox(self, apartment_no: int, inbox: Inbox) -> None:
+        if inbox.active_file is not None:
+            inbox.active_file.close()
+            inbox.active_file = None
+        del self.inboxes[apartment_no]
+
+    def __delete_inbox(self, apartment_no: int, inbox: Inbox) -> None:
+        if inbox.active_file is not None:
+            inbox.active_file.close()
+        for segment_no in inbox.segments:
+            os.remove(inbox.segment_path(segment_no))
+        try:
+            os.rmdir(inbox.directory)
+        except OSError:
+            pass  # Something else was put in the directory
+        del self.inboxes[apartment_no]
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import EventLogger as ev
+from EventLogger import EventLogger
+
+DEFAULT_PROFILE_DIR = "cins_profiles"
+DEFAULT_SAMPLE_INTERVAL = 0.01  # seconds between two samples of every thread's stack
+MIN_SAMPLE_INTERVAL = 0.001
+DEFAULT_MAX_DURATION = 600  # seconds, a forgotten profiling session stops itself
+MAX_STACK_DEPTH = 48
+MEMORY_TRACEBACK_DEPTH = 8
+TOP_MEMORY_STATS = 40
+
+
+def _get_thread_cpu_time(thread_ident: int) -> float | None:
+    """CPU seconds the thread has used, None where the platform has no per-thread CPU clocks"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_ident))
+    except (AttributeError, OSError):
+        return None
+
+
+class HandlerTimings:
+    """Number of calls, total and slowest wall time of every request handler"""
+    __slots__ = ('timings', 'lock')
+
+    def __init__(self):
+        self.timings: dict[str, list] = {}  # name: [calls, total seconds, max seconds]
+        self.lock = threading.Lock()
+
+    def record(self, name: str, elapsed: float) -> None:
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, elapsed, elapsed]
+                return
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+
+    def format_report(self) -> str:
+        lines = [f"{'handler':<12} {'calls':>9} {'total ms':>11} {'mean ms':>9} {'max ms':>9}"]
+        with self.lock:
+            timings = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (calls, total, slowest) in timings:
+            lines.append(f"{name:<12} {calls:>9} {total * 1e3:>11.2f} {total / calls * 1e3:>9.3f}"
+                         f" {slowest * 1e3:>9.3f}")
+        return "\n".join(lines)
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stack of every thread of the process at a fixed interval.
+
+    A stack is only counted while its thread used CPU since the previous sample, so the threads that are blocked in
+    recv or on a queue do not hide the ones that are busy. The stacks are kept in the folded format of flame graphs:
+    "thread;outermost function;...;innermost function count"."""
+
+    def __init__(self, sample_interval: float, max_duration: float, on_expired=None):
+        super().__init__(name="SamplingProfiler", daemon=True)
+        self.sample_interval = sample_interval
+        self.max_duration = max_duration
+        self.on_expired = on_expired  # Called from this thread when max_duration passes before stop is called
+        self.stop_event = threading.Event()
+        self.folded_stacks: collections.Counter[str] = collections.Counter()
+        self.thread_cpu_times: dict[str, float] = collections.defaultdict(float)
+        self.thread_samples: collections.Counter[str] = collections.Counter()
+        self.sample_count = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self.own_cpu_time = 0.0
+
+    def run(self):
+        self.started_at = time.monotonic()
+        own_cpu_started = time.thread_time()
+        last_cpu_times: dict[int, float] = {}
+        own_ident = threading.get_ident()
+        expired = False
+        while not self.stop_event.wait(self.sample_interval):
+            if time.monotonic() - self.started_at >= self.max_duration:
+                expired = True
+                break
+            self.__take_sample(own_ident, last_cpu_times)
+        self.elapsed = time.monotonic() - self.started_at
+        self.own_cpu_time = time.thread_time() - own_cpu_started
+        if expired and self.on_expired is not None:
+            self.on_expired(self)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
+
+    def format_thread_report(self) -> str:
+        lines = [f"{'thread':<40} {'CPU ms':>10} {'CPU %':>7} {'samples':>9}"]
+        threads = sorted(set(self.thread_cpu_times) | set(self.thread_samples),
+                         key=lambda name: (self.thread_cpu_times.get(name, 0.0), self.thread_samples[name]),
+                         reverse=True)
+        for name in threads:
+            cpu_time = self.thread_cpu_times.get(name, 0.0)
+            lines.append(f"{name:<40} {cpu_time * 1e3:>10.1f} {cpu_time / max(self.elapsed, 1e-9) * 100:>7.1f}"
+                         f" {self.thread_samples[name]:>9}")
+        lines.append(f"\n{self.sample_count} samples in {self.elapsed:.1f}s, "
+                     f"the profiler used {self.own_cpu_time * 1e3:.1f} ms of CPU")
+        return "\n".join(lines)
+
+    def format_folded_stacks(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.folded_stacks.most_common())
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __take_sample(self, own_ident: int, last_cpu_times: dict) -> None:
+        self.sample_count += 1
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_ident, frame in sys._current_frames().items():
+            if thread_ident == own_ident:
+                continue
+            thread_name = thread_names.get(thread_ident, f"thread-{thread_ident}")
+            cpu_time = _get_thread_cpu_time(thread_ident)
+            if cpu_time is not None:
+                previous_cpu_time = last_cpu_times.get(thread_ident)
+                last_cpu_times[thread_ident] = cpu_time
+                if previous_cpu_time is None or cpu_time <= previous_cpu_time:
+                    continue  # The thread was idle since the previous sample
+                self.thread_cpu_times[thread_name] += cpu_time - previous_cpu_time
+            self.thread_samples[thread_name] += 1
+            self.folded_stacks[self.__fold_stack(thread_name, frame)] += 1
+
+    @staticmethod
+    def __fold_stack(thread_name: str, frame) -> str:
+        functions = []
+        while frame is not None and len(functions) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        functions.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(functions))
+
+
+class Profiler:
+    """Profiles the running server on demand: CPU samples of every thread, the wall time of every request handler and
+    optionally tracemalloc snapshots. While it is disabled the handlers only check the enabled flag."""
+
+    def __init__(self, profile_dir: str = DEFAULT_PROFILE_DIR, event_logger: EventLogger | None = None):
+        self.profile_dir = profile_dir
+        self.event_logger = event_logger
+        self.enabled = False
+        self.sampler: SamplingProfiler | None = None
+        self.handler_timings = HandlerTimings()
+        self.trace_memory = False
+        self.started_tracemalloc = False
+        self.lock = threading.Lock()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def start(self, sample_interval: float = DEFAULT_SAMPLE_INTERVAL, trace_memory: bool = False,
+              max_duration: float = DEFAULT_MAX_DURATION) -> None:
+        """Starts a profiling session
+
+        Exceptions:
+            ValueError: The profiler is already running or the sample interval is too short
+        """
+        if sample_interval < MIN_SAMPLE_INTERVAL:
+            raise ValueError(f"Sample interval cannot be less than {MIN_SAMPLE_INTERVAL * 1e3:.0f} ms.")
+        with self.lock:
+            if self.enabled:
+                raise ValueError("The profiler is already running.")
+            self.handler_timings = HandlerTimings()
+            self.trace_memory = trace_memory
+            if trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_TRACEBACK_DEPTH)
+                self.started_tracemalloc = True
+            self.sampler = SamplingProfiler(sample_interval, max_duration, self.__on_sampler_expired)
+            self.sampler.start()
+            self.enabled = True
+
+    def stop(self) -> str:
+        """Stops the profiling session and returns the directory its reports were written to
+
+        Exceptions:
+            ValueError: The profiler is not running
+        """
+        with self.lock:
+            if not self.enabled:
+                raise ValueError("The profiler is not running.")
+            self.enabled = False
+            sampler = self.sampler
+        sampler.stop()
+        return self.__finish(sampler)
+
+    def record_handler(self, name: str, elapsed: float) -> None:
+        self.handler_timings.record(name, elapsed)
+
+    def take_memory_snapshot(self) -> str:
+        """Writes the lines that allocated the most memory and returns the path of the report
+
+        Exceptions:
+            ValueError: Memory is not being traced
+        """
+        if not tracemalloc.is_tracing():
+            raise ValueError("Memory is not being traced, start the profiler with memory tracing.")
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"memory-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        self.__write_memory_report(path)
+        return path
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __on_sampler_expired(self, sampler: SamplingProfiler) -> None:
+        with self.lock:
+            if not self.enabled or self.sampler is not sampler:
+                return
+            self.enabled = False
+        report_dir = self.__finish(sampler)
+        if self.event_logger is not None:
+            self.event_logger.info(ev.SERVER, "Profiling stopped after %ss, the reports were written to %s",
+                                   sampler.max_duration, report_dir)
+
+    def __finish(self, sampler: SamplingProfiler) -> str:
+        """Writes the reports of the session and stops tracing memory if the session started it"""
+        report_dir = os.path.join(self.profile_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+        os.makedirs(report_dir, exist_ok=True)
+        with open(os.path.join(report_dir, "threads.txt"), "w", encoding="utf-8") as report:
+            report.write(sampler.format_thread_report() + "\n")
+        with open(os.path.join(report_dir, "cpu_stacks.folded"), "w", encoding="utf-8") as report:
+            report.write(sampler.format_folded_stacks() + "\n")
+        with open(os.path.join(report_dir, "handlers.txt"), "w", encoding="utf-8") as report:
+            report.write(self.handler_timings.format_report() + "\n")
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.__write_memory_report(os.path.join(report_dir, "memory.txt"))
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        return report_dir
+
+    @staticmethod
+    def __write_memory_report(path: str) -> None:
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, __file__),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path, "w", encoding="utf-8") as report:
+            report.write(f"Traced memory: {current / 1024:,.0f} KB, peak {peak / 1024:,.0f} KB\n\n")
+            for stat in snapshot.statistics("lineno")[:TOP_MEMORY_STATS]:
+                report.write(f"{stat}\n")
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import threading
+import time
+
+DEFAULT_CONNECTION_RATE = 2.0  # messages per second
+DEFAULT_CONNECTION_BURST = 5
+DEFAULT_APARTMENT_RATE = 4.0  # messages per second, shared by every device of the apartment
+DEFAULT_APARTMENT_BURST = 10
+
+
+class TokenBucket:
+    """Token bucket state, the rate and the capacity are given on every call so that they can be changed at runtime."""
+    __slots__ = ('tokens', 'last_refill', 'lock')
+
+    def __init__(self, capacity: float):
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_consume(self, rate: float, capacity: float, amount: float = 1.0) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(capacity, self.tokens + (now - self.last_refill) * rate)
+            self.last_refill = now
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def refund(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.tokens += amount
+
+
+class RateLimiter:
+    """Token bucket rate limits for the chat, per connection and per apartment."""
+
+    def __init__(self, connection_rate: float = DEFAULT_CONNECTION_RATE,
+                 connection_burst: int = DEFAULT_CONNECTION_BURST,
+                 apartment_rate: float = DEFAULT_APARTMENT_RATE,
+                 apartment_burst: int = DEFAULT_APARTMENT_BURST):
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.apartment_rate = apartment_rate
+        self.apartment_burst = apartment_burst
+        self.apartment_buckets: dict[int, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def change_limits(self, connection_rate: float, connection_burst: int, apartment_rate: float,
+                      apartment_burst: int) -> None:
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.apartment_rate = apartment_rate
+        self.apartment_burst = apartment_burst
+
+    def get_limits(self) -> dict:
+        return {'connection_rate': self.connection_rate, 'connection_burst': self.connection_burst,
+                'apartment_rate': self.apartment_rate, 'apartment_burst': self.apartment_burst}
+
+    def new_connection_bucket(self) -> TokenBucket:
+        return TokenBucket(self.connection_burst)
+
+    def allow(self, connection_bucket: TokenBucket, apartment_no: int) -> bool:
+        """Returns True if both the connection and its apartment still have a token for one more message."""
+        if not connection_bucket.try_consume(self.connection_rate, self.connection_burst):
+            return False
+        if not self.__get_apartment_bucket(apartment_no).try_consume(self.apartment_rate, self.apartment_burst):
+            connection_bucket.refund()  # The message was not sent, do not charge the connection for it.
+            return False
+        return True
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __get_apartment_bucket(self, apartment_no: int) -> TokenBucket:
+        bucket = self.apartment_buckets.get(apartment_no)
+        if bucket is None:
+            with self.lock:
+                bucket = self.apartment_buckets.setdefault(apartment_no, TokenBucket(self.apartment_burst))
+        return bucket
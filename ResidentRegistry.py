@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from Server import ClientThread
+
+
+class ResidentRegistry:
+    """Server-side index of the registered residents.
+    Connections are indexed by card id and by apartment number, both map to a set of connections because a resident
+    can be connected from several devices and an apartment can have several residents."""
+
+    def __init__(self):
+        self.connections_by_card_id: dict[str, set[ClientThread]] = {}
+        self.connections_by_apartment_no: dict[int, set[ClientThread]] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.connections_by_card_id)
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def register(self, connection: ClientThread) -> None:
+        """Adds a connection with a registered card to the indexes."""
+        card = connection.card
+        with self.lock:
+            self.connections_by_card_id.setdefault(card.id, set()).add(connection)
+            self.connections_by_apartment_no.setdefault(card.apartment_no, set()).add(connection)
+
+    def unregister(self, connection: ClientThread) -> None:
+        """Removes a connection from the indexes, does nothing if the connection was never registered."""
+        card = connection.card
+        if card is None:
+            return
+        with self.lock:
+            self.__discard(self.connections_by_card_id, card.id, connection)
+            self.__discard(self.connections_by_apartment_no, card.apartment_no, connection)
+
+    def get_connections_by_card_id(self, card_id: str) -> list[ClientThread]:
+        with self.lock:
+            return list(self.connections_by_card_id.get(card_id, ()))
+
+    def get_connections_by_apartment_no(self, apartment_no: int) -> list[ClientThread]:
+        with self.lock:
+            return list(self.connections_by_apartment_no.get(apartment_no, ()))
+
+    def get_registered_apartments(self) -> list[int]:
+        with self.lock:
+            return sorted(self.connections_by_apartment_no)
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    @staticmethod
+    def __discard(index: dict, key, connection: ClientThread) -> None:
+        connections = index.get(key)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del index[key]
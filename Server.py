@@ -1,63 +1,242 @@
 from __future__ import annotations
 
-import multiprocessing
+import abc
+import argparse
+import base64
+import collections
+import itertools
+import os
+import queue
+import signal
 import socket
 import sys
 import threading
 import time
 
 import AkinProtocol
+import EntryLog as entries
+import EventLogger as ev
+import HotRestart
+import TrafficCapture
 import Utility
 import custom_exceptions as ce
+from AlertEngine import AlertEngine
+from Announcement import Announcement
+from ChannelManager import ChannelManager
+from ChatSearchIndex import ChatSearchIndex
 from ClientCard import ClientCard
+from CurrencyConverter import CurrencyConverter
 from Currency import CurrencyDataFetcher
-from Weather import WeatherDataFetcher
+from Discovery import DiscoveryResponder
+from Documents import DOCUMENT_CHUNK_SIZE, DocumentDownload, DocumentStore
+from EntryLog import EntryLog
+from EventLogger import EventLogger
+from Inbox import InboxStore
+from Federation import Federation, PeerLink
+from Profiler import DEFAULT_SAMPLE_INTERVAL, Profiler
+from RateLimiter import RateLimiter, TokenBucket
+from ResidentRegistry import ResidentRegistry
+from SessionStore import MessageHistory, Session, SessionStore
+from SourceSelector import DataSource, SourceSelector
+from TimerWheel import TimerWheel
+from TrafficCapture import TrafficRecorder
+from Weather import WeatherDataFetcher, WeatherDataFetcherAPI
+
+### Backpressure Bounds ###
+OUTBOUND_QUEUE_LIMIT = 256  # Messages waiting to be written to a single client
+OUTBOUND_HIGH_WATERMARK = 192  # Stop reading from a client that does not read its own responses
+PENDING_CHAT_LIMIT = 16  # Stop reading from a client whose chat messages are not fanned out yet
+
+RECEIVE_BUFFER_SIZE = 4096
+ACCEPT_TIMEOUT = 0.5  # The accept loop wakes up every X seconds to check the running flag
+WRITER_IDLE_TIMEOUT = 30  # The writer thread of a connection exits after X seconds without messages to write
+MAX_STREAMS_PER_CONNECTION = 256
+MAX_DOWNLOADS_PER_CONNECTION = 4
+FEED_STALE_UPDATES = 3  # A block fetches the weather and currency itself after X update periods without the feed
+FEDERATION_SECRET_VARIABLE = "CINS_FEDERATION_SECRET"  # Keeps the secret out of the command line of the process
+PROFILED_COMMANDS = frozenset(request.split(AkinProtocol.DELIMITER, 1)[0] for request in (
+    AkinProtocol.BATCH_REQUEST, AkinProtocol.PONG_RESPONSE, AkinProtocol.PING_REQUEST, AkinProtocol.REGISTER_USER,
+    AkinProtocol.RESUME_REQUEST, AkinProtocol.WEATHER_GET, AkinProtocol.CURRENCY_GET, AkinProtocol.CONVERT_REQUEST,
+    AkinProtocol.ALERT_REQUEST, AkinProtocol.ALERT_REMOVE_REQUEST, AkinProtocol.SEARCH_REQUEST,
+    AkinProtocol.SUBSCRIBE_REQUEST, AkinProtocol.UNSUBSCRIBE_REQUEST, AkinProtocol.CHAT_MESSAGE,
+    AkinProtocol.DIRECT_MESSAGE, AkinProtocol.DOCUMENT_LIST_REQUEST, AkinProtocol.DOCUMENT_REQUEST,
+    AkinProtocol.ENTRY_REPORT_REQUEST))
+UNKNOWN_COMMAND = "UNKNOWN"  # Every other request is timed under this name, clients can not add names to the report
 
 
 class Server(threading.Thread):
     """A threaded server that handles multiple clients"""
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, event_logger: EventLogger | None = None, handoff_path: str | None = None,
+                 take_over: bool = False, discovery_port: int | None = AkinProtocol.DEFAULT_DISCOVERY_PORT,
+                 block_name: str | None = None, peers: list[tuple[str, int]] | None = None,
+                 federation_secret: str | None = None):
         super().__init__()
         self.host = host
         self.port = port
         self.running_flag = True
 
-        ### Queues For Multi-Process Communication ###
-        self.message_queue = multiprocessing.Queue()
-        self.logging_queue = multiprocessing.Queue()
+        ### Hot Restart ###
+        self.handoff_path = handoff_path if HotRestart.is_supported() else None  # None disables hot restarts
+        self.take_over = take_over  # Take the socket and the connections over from the server on handoff_path
+        self.accept_loop_stopped = threading.Event()
+
+        ### Chat Messages Waiting To Be Fanned Out ###
+        # Every producer and consumer is a thread of this process, a None item stops the group chat updater thread.
+        self.message_queue: queue.SimpleQueue[tuple[str, str, int] | None] = queue.SimpleQueue()
+
+        ### Structured Event Logging ###
+        self.event_logger = event_logger if event_logger is not None else EventLogger()
 
         ### Server Helper Threads ###
         self.open_connection_threads: list[ClientThread] = []
-        self.group_chat_updater_thread = threading.Thread(target=self.__update_group_chat, daemon=False)
-        self.currency_updater_thread = threading.Thread(target=self.__update_currency_for_clients, daemon=True)
-        self.weather_updater_thread = threading.Thread(target=self.__update_weather_for_clients, daemon=True)
-        self.open_connection_checker_thread = threading.Thread(target=self.__remove_stopped_connections, daemon=True)
+        self.open_connections_by_id: dict[int, ClientThread] = {}
+        self.connection_ids = itertools.count(1)
+        self.resident_registry = ResidentRegistry()
+        self.channel_manager = ChannelManager()
+        self.rate_limiter = RateLimiter()
+        self.session_store = SessionStore()
+        self.message_history = MessageHistory()
+        self.search_index = ChatSearchIndex()
+        self.inbox_store = InboxStore()  # Direct messages for the apartments whose residents are all offline
+        self.document_store = DocumentStore()  # Minutes, invoices and notices published by the management
+        self.entry_log = EntryLog()  # Every card scan, resumed session and exit, for the security reports
+        # Messages are indexed on their own thread after they are fanned out, indexing never delays a delivery.
+        self.search_queue: queue.SimpleQueue[tuple[int, str, str] | None] = queue.SimpleQueue()
+        self.group_chat_updater_thread = threading.Thread(target=self.__update_group_chat, name="GroupChatUpdater",
+                                                          daemon=False)
+        self.currency_updater_thread = threading.Thread(target=self.__update_currency_for_clients,
+                                                        name="CurrencyUpdater", daemon=True)
+        self.weather_updater_thread = threading.Thread(target=self.__update_weather_for_clients, name="WeatherUpdater",
+                                                       daemon=True)
+        self.open_connection_checker_thread = threading.Thread(target=self.__remove_stopped_connections,
+                                                               name="ConnectionChecker", daemon=True)
+        self.heartbeat_thread = threading.Thread(target=self.__ping_and_reap_idle_connections, name="Heartbeat",
+                                                 daemon=True)
+        self.search_indexer_thread = threading.Thread(target=self.__index_chat_messages, name="SearchIndexer",
+                                                      daemon=True)
+
+        ### LAN Discovery ###
+        # Answers the discovery broadcasts of the clients with the load of this server, None disables it.
+        self.discovery_responder = (None if discovery_port is None
+                                    else DiscoveryResponder(self.port, self.get_load, discovery_port, self.event_logger))
+
+        ### On-Demand Profiling ###
+        self.profiler = Profiler(event_logger=self.event_logger)
+
+        ### Federation Of The Blocks ###
+        # The servers of the other blocks relay their chat, announcements and weather and currency feed to this one.
+        # A server without a block name does not take part, the servers that do share a secret.
+        self.federation = None if block_name is None else Federation(
+            block_name, peers or [], self.__receive_federated_chat, self.__deliver_announcement,
+            self.__receive_federated_feed, self.event_logger, federation_secret)
+
+        ### State Shared By Every Connection ###
+        self.context = ServerContext(self.message_queue, self.event_logger, self.resident_registry,
+                                     self.channel_manager, self.rate_limiter, self.session_store, self.message_history,
+                                     self.search_index, self.inbox_store, self.document_store, self.entry_log,
+                                     self.profiler, self.federation)
+
+        ### Heartbeats ###
+        self.idle_timer_wheel = TimerWheel()
+        self.PING_INTERVAL = AkinProtocol.DEFAULT_PING_INTERVAL
+        self.IDLE_TIMEOUT = AkinProtocol.DEFAULT_IDLE_TIMEOUT
 
         ### Weather and currency data ###
         self.weather_data_fetcher = WeatherDataFetcher()
+        self.weather_api_fetcher = WeatherDataFetcherAPI()
         self.currency_data_fetcher = CurrencyDataFetcher()
-        self.weather = AkinProtocol.DEFAULT_WEATHER_DICT
-        self.currency = AkinProtocol.DEFAULT_CURRENCY_DICT
+        # The scraper is preferred for its description and day/night temperatures, open-meteo is the hedge.
+        self.weather_sources = SourceSelector([
+            DataSource("weather.com", lambda: self.weather_data_fetcher.fetch_weather_data(city='Manisa')),
+            DataSource("open-meteo", self.__fetch_weather_from_api)])
+        self.currency_sources = SourceSelector([
+            DataSource("doviz.com", self.currency_data_fetcher.fetch_exchange_rates)])
         self.UPDATE_RATE = AkinProtocol.DEFAULT_UPDATE_RATE  # Updates the weather and currency data every X seconds
 
     def run(self):
-        self.__bind_and_listen()
+        self.event_logger.start()
+        if not (self.take_over and self.__take_over_from_running_server()):
+            self.__bind_and_listen()
         self.__start_helper_threads()
         while self.running_flag:
             try:
                 self.__accept_client_to_a_new_thread()
-            except ConnectionAbortedError:
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.running_flag:
+                    raise
                 break  # Server is closed
+        self.accept_loop_stopped.set()
         sys.exit(0)
 
     ### -------------- ###
     ### Public Methods ###
     ### -------------- ###
 
+    @property
+    def weather(self) -> dict:
+        return self.context.weather
+
+    @property
+    def currency(self) -> dict:
+        return self.context.currency
+
     def change_update_rate(self, new_rate: int) -> None:
         self.UPDATE_RATE = new_rate
-        self.logging_queue.put(f"Update rate changed to {new_rate} seconds, it will be applied after the next update.")
+        self.event_logger.info(ev.SERVER, "Update rate changed to %s seconds, it will be applied after the next update.",
+                               new_rate)
+
+    def change_heartbeat(self, ping_interval: int, idle_timeout: int) -> None:
+        self.PING_INTERVAL = ping_interval
+        self.IDLE_TIMEOUT = idle_timeout
+        self.event_logger.info(ev.SERVER, "Idle connections will be pinged after %s seconds and closed after %s seconds.",
+                               ping_interval, idle_timeout)
+
+    def start_profiling(self, sample_interval: float, trace_memory: bool) -> None:
+        self.profiler.start(sample_interval, trace_memory)
+        self.event_logger.info(ev.SERVER, "Profiling started, every thread is sampled every %s ms.",
+                               round(sample_interval * 1e3, 1))
+
+    def stop_profiling(self) -> str:
+        """Stops profiling and returns the directory of the reports"""
+        report_dir = self.profiler.stop()
+        self.event_logger.info(ev.SERVER, "Profiling stopped, the reports were written to %s", report_dir)
+        return report_dir
+
+    def toggle_profiling(self) -> None:
+        if self.profiler.enabled:
+            self.stop_profiling()
+        else:
+            self.start_profiling(DEFAULT_SAMPLE_INTERVAL, trace_memory=False)
+
+    def start_capture(self, path: str = TrafficCapture.DEFAULT_CAPTURE_PATH) -> None:
+        """Records every read of every connection from now on, to replay the traffic against another server later
+
+        Exceptions:
+            ValueError: If the traffic is already being captured
+            OSError: If the capture file can not be created
+        """
+        if self.context.traffic_recorder is not None:
+            raise ValueError("The traffic is already being captured.")
+        self.context.traffic_recorder = TrafficRecorder(path)
+        self.event_logger.info(ev.SERVER, "Capturing the traffic of every connection to %s", path)
+
+    def stop_capture(self) -> dict:
+        """Stops the capture and returns the path of the file and the number of records and bytes it holds
+
+        Exceptions:
+            ValueError: If the traffic is not being captured
+        """
+        recorder = self.context.traffic_recorder
+        if recorder is None:
+            raise ValueError("The traffic is not being captured.")
+        self.context.traffic_recorder = None
+        capture = recorder.stop()
+        self.event_logger.info(ev.SERVER, "Traffic capture stopped, %s records of %ss were written to %s",
+                               capture['records'], capture['duration'], capture['path'])
+        return capture
 
     def get_open_connections(self) -> list[str]:
         """Returns a list of the names of the open connections"""
@@ -68,16 +247,94 @@ class Server(threading.Thread):
                 out_str += f"{client_thread.card.name} - {client_thread.card.apartment_no} -> [{client_thread.client_address}]"
             else:
                 out_str += f"[{client_thread.client_address}]"
+            if client_thread.stream_sessions:
+                out_str += f" (gateway, {len(client_thread.stream_sessions)} residents)"
+            if client_thread.peer_link is not None:
+                out_str += f" (block {client_thread.peer_link.node_id})"
             connection_list.append(out_str)
         return connection_list
 
+    def get_load(self) -> int:
+        """Returns the number of residents the server serves, a gateway counts as many residents as it multiplexes"""
+        return sum(len(connection.stream_sessions) if connection.multiplexed else 1
+                   for connection in list(self.open_connection_threads) if connection.peer_link is None)
+
+    def get_resident_connections(self, apartment_no: int) -> list[ClientThread]:
+        """Returns the open connections of the residents of the given apartment"""
+        return self.resident_registry.get_connections_by_apartment_no(apartment_no)
+
+    def send_direct_message(self, apartment_no: int, message: str) -> int:
+        """Sends a management notice only to the connections of the given apartment, it waits in the inbox of the
+        apartment if none of its residents are online. Returns the number of connections the notice was delivered to.
+
+        Exceptions:
+            ValueError: If the notice is larger than an inbox
+            OSError: If the inbox could not be written
+        """
+        notice = f"[{Utility.get_simple_time()}] [Management]: {message}"
+        targets = self.resident_registry.get_connections_by_apartment_no(apartment_no)
+        if not targets:
+            self.inbox_store.append(apartment_no, notice)
+            self.event_logger.info(ev.DIRECT, "Apartment %s is offline, the notice of the management is in its inbox.",
+                                   apartment_no, apartment_no=apartment_no)
+            return 0
+        notice = AkinProtocol.construct_direct_message(apartment_no, notice)
+        delivered = 0
+        for connection in targets:
+            if connection.send_message(notice):
+                delivered += 1
+        self.event_logger.info(ev.DIRECT, "Management sent a notice to apartment %s, delivered to %s connections.",
+                               apartment_no, delivered, apartment_no=apartment_no)
+        return delivered
+
+    def broadcast_announcement(self, message: str) -> Announcement:
+        """Sends an announcement of the management to every connection, subscribed or not, and to every resident of the
+        gateways. It does not go through the message queue, and every connection writes it before its queued chat
+        messages. The servers of the other blocks deliver it to their residents too, but only the deliveries of this
+        server are counted. Returns the Announcement that counts the deliveries."""
+        announcement = self.__deliver_announcement(f"[{Utility.get_simple_time()}] [Management]: {message}")
+        if self.federation is not None:
+            self.federation.relay_announcement(
+                f"[{Utility.get_simple_time()}] [Management of {self.federation.node_id}]: {message}")
+        return announcement
+
+    def publish_document(self, source_path: str) -> str:
+        """Copies the file into the document store, the residents can download it from now on. Returns the name of the
+        document.
+
+        Exceptions:
+            ValueError: If the file name can not be used for a document
+            OSError: If the file can not be read
+        """
+        name = self.document_store.publish(source_path)
+        self.event_logger.info(ev.DOCUMENT, "Management published the document %s.", name)
+        return name
+
+    def get_federation_links(self) -> dict[str, dict]:
+        """Returns the linked blocks and the number of messages relayed to each of them"""
+        return {} if self.federation is None else self.federation.get_links()
+
     def stop_server(self):
         """Stops the server"""
         self.running_flag = False
         self.server_socket.close()
+        self.message_queue.put(None)
+        if self.discovery_responder is not None:
+            self.discovery_responder.stop()
+        if self.federation is not None:
+            self.federation.stop()
+        self.inbox_store.close()
+        self.entry_log.close()
+        if self.profiler.enabled:
+            self.stop_profiling()
+        if self.context.traffic_recorder is not None:
+            self.stop_capture()
+        self.weather_sources.shutdown()
+        self.currency_sources.shutdown()
         for client in self.open_connection_threads:
             client.close_connection()
-        self.logging_queue.put("Server stopped")
+        self.event_logger.info(ev.SERVER, "Server stopped")
+        self.event_logger.stop()
         sys.exit(0)
 
     ### -------------- ###
@@ -89,34 +346,104 @@ class Server(threading.Thread):
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(10)
+            self.server_socket.settimeout(ACCEPT_TIMEOUT)
             self.running_flag = True
-            self.logging_queue.put(f"Server successfully started on [{self.host}:{self.port}]")
-            self.logging_queue.put("Waiting for a connection...")
+            self.event_logger.info(ev.SERVER, "Server successfully started on [%s:%s]", self.host, self.port)
+            self.event_logger.info(ev.SERVER, "Waiting for a connection...")
         except socket.error as e:
+            self.event_logger.error(ev.SERVER, "Error binding to port %s: %s", self.port, e)
             raise ce.InvalidPortError(f"Error binding to port {self.port}: {e}") from e
 
     def __accept_client_to_a_new_thread(self):
         """Accepts a client connection and starts a new thread to handle it"""
         (client_socket, address) = self.server_socket.accept()
-        self.logging_queue.put(f"Accepted connection from: {address}, started a new thread to handle this client.")
-        client_thread = ClientThread(client_socket, address, self.message_queue, self.weather, self.currency,
-                                     self.logging_queue)
+        self.event_logger.info(ev.CONNECTION, "Accepted connection from: %s, started a new thread to handle this client.",
+                               address, client_address=address)
+        client_thread = ClientThread(next(self.connection_ids), client_socket, address, self.context)
         client_thread.start()
         self.open_connection_threads.append(client_thread)
+        self.open_connections_by_id[client_thread.connection_id] = client_thread
+        self.idle_timer_wheel.schedule(client_thread, client_thread.last_activity + self.PING_INTERVAL)
 
     ### -------------- ###
     ### Helper Methods ###
     ### -------------- ###
 
-    def __update_weather(self) -> None:
-        """Updates the weather data from the weather data fetcher and returns the weather data"""
-        weather = self.weather_data_fetcher.fetch_weather_data(city='Manisa')
-        self.weather = weather
+    def __deliver_announcement(self, message: str) -> Announcement:
+        """Queues the announcement ahead of the chat messages of every local resident"""
+        announcement_message = AkinProtocol.construct_announcement(message)
+        recipients = []
+        for connection in list(self.open_connection_threads):
+            if connection.peer_link is not None:
+                continue
+            if connection.multiplexed:
+                recipients.extend(connection.stream_sessions.values())  # A gateway shows it to each of its residents
+            else:
+                recipients.append(connection)
+        announcement = Announcement(announcement_message, len(recipients))
+        for recipient in recipients:
+            if not recipient.send_priority_message(announcement):
+                announcement.record_failure()
+        self.event_logger.info(ev.ANNOUNCEMENT, "An announcement was queued for %s connections.", len(recipients))
+        return announcement
+
+    def __update_weather(self) -> str | None:
+        """Updates the weather data from the first source that answers, returns its name or None if the last data
+        is kept because no source answered in time"""
+        try:
+            source_name, weather = self.weather_sources.fetch()
+        except ce.DataSourceUnavailableError as e:
+            self.event_logger.warning(ev.UPDATE, "Weather data could not be updated, keeping the last data: %s", e)
+            return None
+        self.context.weather = weather  # Every connection reads the latest data from the shared context
+        self.__notify_triggered_alerts(weather)
+        if self.federation is not None:
+            self.federation.relay_feed(AkinProtocol.WEATHER, weather)
+        return source_name
 
-    def __update_currency(self) -> None:
-        """Updates the currency data from the currency data fetcher and returns the currency data"""
-        currency = self.currency_data_fetcher.fetch_exchange_rates()
-        self.currency = currency
+    def __update_currency(self) -> str | None:
+        """Updates the currency data, returns the name of the source or None if the last data is kept"""
+        try:
+            source_name, currency = self.currency_sources.fetch()
+        except ce.DataSourceUnavailableError as e:
+            self.event_logger.warning(ev.UPDATE, "Currency data could not be updated, keeping the last data: %s", e)
+            return None
+        self.context.update_currency(currency)
+        self.__notify_triggered_alerts({key: value for key, value in currency.items() if value})  # 0: not fetched
+        if self.federation is not None:
+            self.federation.relay_feed(AkinProtocol.CURRENCY, currency)
+        return source_name
+
+    def __is_feed_source(self) -> bool:
+        """Returns False while another block fetches the weather and currency data for this one"""
+        return self.federation is None or self.federation.is_feed_source(FEED_STALE_UPDATES * self.UPDATE_RATE)
+
+    def __receive_federated_feed(self, command: str, data: dict) -> None:
+        if command == AkinProtocol.WEATHER:
+            self.context.weather = data
+            self.__notify_triggered_alerts(data)
+        else:
+            self.context.update_currency(data)
+            self.__notify_triggered_alerts({key: value for key, value in data.items() if value})
+
+    def __receive_federated_chat(self, channel: str, message: str) -> None:
+        """Fans a chat message of another block out to the subscribers of this server. It has no sender here, so it
+        is not relayed again, the federation relays it onwards itself."""
+        self.message_queue.put((channel, message, None))
+
+    def __fetch_weather_from_api(self) -> dict:
+        """open-meteo only has the current temperature, the other fields keep their last values"""
+        api_weather = self.weather_api_fetcher.get_manisa_weather_data()
+        return {**self.context.weather, 'temperature_celcius': api_weather['temperature']}
+
+    def __notify_triggered_alerts(self, values: dict) -> None:
+        """Sends a notification only to the connections whose alerts were crossed by the new values"""
+        triggered = self.context.alert_engine.update(values)
+        for alert, value in triggered:
+            alert.connection.send_message(AkinProtocol.construct_alert_notification(
+                alert.alert_id, alert.metric, alert.direction, alert.threshold, value))
+        if triggered:
+            self.event_logger.info(ev.UPDATE, "%s alerts were triggered by the update.", len(triggered))
 
     ### ------- ###
     ### Threads ###
@@ -127,181 +454,1240 @@ class Server(threading.Thread):
         self.currency_updater_thread.start()
         self.weather_updater_thread.start()
         self.open_connection_checker_thread.start()
+        self.heartbeat_thread.start()
+        self.search_indexer_thread.start()
+        if self.discovery_responder is not None:
+            self.discovery_responder.server_port = self.server_socket.getsockname()[1]  # The port it really listens on
+            self.discovery_responder.start()
+        if self.federation is not None:
+            self.federation.start()
+        if self.handoff_path is not None:
+            threading.Thread(target=self.__wait_for_successor, daemon=True).start()
 
     def __update_group_chat(self):
-        while self.running_flag:
-            if not self.message_queue.empty():
-                msg = self.message_queue.get()
-                for client in self.open_connection_threads:
-                    if client.subscribed_to_message_channel:
-                        client.client_socket.send(msg.encode())
-            time.sleep(0.1)
+        """Fans the chat messages out as soon as they are queued, blocks while there are none"""
+        while True:
+            item = self.message_queue.get()
+            if item is None:
+                self.search_queue.put(None)  # The indexer stops after the messages fanned out before
+                break  # The server is stopping, or handing over after the messages queued before
+            started = time.perf_counter() if self.profiler.enabled else None
+            channel, text, sender_connection_id = item
+            with self.message_history.lock:
+                sequence_no = self.message_history.append(channel, text)
+                subscribers = self.channel_manager.get_subscribers(channel)
+            msg = AkinProtocol.construct_chat_message(text, channel, sequence_no)
+            for client in subscribers:
+                client.send_message(msg)  # Never blocks, a slow client only drops its own messages
+            sender = self.open_connections_by_id.get(sender_connection_id)
+            if sender is not None:
+                sender.chat_message_fanned_out()
+            if (self.federation is not None and sender_connection_id is not None
+                    and not self.channel_manager.is_restricted(channel)):  # Restricted channels stay in the block
+                self.federation.relay_chat(channel, text)
+            if started is not None:
+                self.profiler.record_handler("fan-out", time.perf_counter() - started)
+            self.search_queue.put((sequence_no, channel, text))
+
+    def __index_chat_messages(self):
+        """Adds the fanned out messages to the search index, blocks while there are none"""
+        while True:
+            item = self.search_queue.get()
+            if item is None:
+                break
+            self.search_index.add(*item)
 
     def __remove_stopped_connections(self):
         """Removes stopped connections from the list of open connections"""
         while self.running_flag:
             time.sleep(0.5)
-            for thread in self.open_connection_threads:
+            for thread in list(self.open_connection_threads):  # Removing while iterating would skip every next one
                 if not thread.is_connection_open() or not thread.is_alive():
                     self.open_connection_threads.remove(thread)
+                    self.open_connections_by_id.pop(thread.connection_id, None)
+                    self.idle_timer_wheel.cancel(thread)
+                    thread.close_connection()  # A thread that died on an error did not close its socket
+                    thread.release()
                     if thread.card is not None:
-                        self.logging_queue.put(f"{thread.card.name} - {thread.card.apartment_no} has left the apartment!")
+                        self.event_logger.info(ev.CONNECTION, "%s - %s has left the apartment!",
+                                               thread.card.name, thread.card.apartment_no, card_id=thread.card.id,
+                                               apartment_no=thread.card.apartment_no,
+                                               client_address=thread.client_address)
                     else:
-                        self.logging_queue.put(f"Following client just left the apartment: {thread.client_address}")
+                        self.event_logger.info(ev.CONNECTION, "Following client just left the apartment: %s",
+                                               thread.client_address, client_address=thread.client_address)
+            try:
+                emptied = self.inbox_store.remove_expired()  # Runs at most once every inbox sweep interval
+            except OSError as e:
+                self.event_logger.error(ev.DIRECT, "The inboxes could not be swept: %s", e)
+                continue
+            if emptied:
+                self.event_logger.info(ev.DIRECT, "%s inboxes expired and were removed.", emptied)
+
+    def __ping_and_reap_idle_connections(self):
+        """Pings the connections that have been idle for PING_INTERVAL and closes the ones idle for IDLE_TIMEOUT.
+        Only the connections whose timer expired on this tick are looked at."""
+        while self.running_flag:
+            time.sleep(self.idle_timer_wheel.tick)
+            now = time.monotonic()
+            reaped = 0
+            for thread in self.idle_timer_wheel.advance(now):
+                if not thread.is_connection_open():
+                    continue
+                idle_for = now - thread.last_activity
+                if idle_for >= self.IDLE_TIMEOUT:
+                    thread.close_connection()
+                    reaped += 1
+                elif idle_for >= self.PING_INTERVAL:
+                    thread.send_frame(AkinProtocol.PING_REQUEST)
+                    self.idle_timer_wheel.schedule(thread, thread.last_activity + self.IDLE_TIMEOUT)
+                else:
+                    self.idle_timer_wheel.schedule(thread, thread.last_activity + self.PING_INTERVAL)
+            if reaped:
+                self.event_logger.info(ev.CONNECTION, "Closed %s idle connections that did not answer the ping.", reaped)
 
     def __update_weather_for_clients(self):
-        """Updates the weather for all client threads"""
+        """Updates the weather for all clients"""
         while self.running_flag:
-            self.__update_weather()
-            for thread in self.open_connection_threads:
-                thread.update_weather(self.weather)
+            if self.__is_feed_source():
+                source_name = self.__update_weather()
+                if source_name is not None:
+                    self.event_logger.info(ev.UPDATE, "UPDATED WEATHER | Weather data has been updated from %s",
+                                           source_name)
             time.sleep(self.UPDATE_RATE)
-            self.logging_queue.put("UPDATED WEATHER | Weather data has been updated from weather.com")
 
     def __update_currency_for_clients(self):
-        """Updates the currency for all client threads"""
+        """Updates the currency for all clients"""
         while self.running_flag:
-            self.__update_currency()
-            for thread in self.open_connection_threads:
-                thread.update_currency(self.currency)
+            if self.__is_feed_source():
+                source_name = self.__update_currency()
+                if source_name is not None:
+                    self.event_logger.info(ev.UPDATE, "UPDATED CURRENCY | Currency data has been updated from %s",
+                                           source_name)
             time.sleep(self.UPDATE_RATE)
-            self.logging_queue.put("UPDATED CURRENCY | Currency data has been updated from doviz.com")
 
 
-class ClientThread(threading.Thread):
-    """A thread that handles a single client connection"""
+    ### ----------- ###
+    ### Hot Restart ###
+    ### ----------- ###
 
-    def __init__(self, client_socket: socket.socket, client_address, msg_queue: multiprocessing.Queue, weather: dict,
-                 currency: dict, logging_queue: multiprocessing.Queue):
-        super().__init__()
-        self.client_socket = client_socket
-        self.client_address = client_address
-        self.message_queue = msg_queue
-        self.logging_queue = logging_queue
-        self.weather = weather
+    def __wait_for_successor(self):
+        """Waits for a new server process on the handoff socket and hands the listening socket, the connections and
+        the sessions over to it. This process then exits without closing any of the connections."""
+        handoff_listener = HotRestart.listen_for_successor(self.handoff_path)
+        successor, _ = handoff_listener.accept()
+        successor.settimeout(HotRestart.HANDOFF_TIMEOUT)
+        self.event_logger.info(ev.SERVER, "A new server process is taking over %s connections.",
+                               len(self.open_connection_threads))
+        try:
+            state, fds = self.__freeze_and_export_state()
+            HotRestart.send_state(successor, state, fds)
+            if successor.recv(len(HotRestart.HANDOFF_ACK)) != HotRestart.HANDOFF_ACK:
+                raise ConnectionError("The new server process did not acknowledge the handoff")
+        except OSError as e:
+            # The connections are frozen, they are closed with this process and the residents reconnect.
+            self.event_logger.error(ev.SERVER, "Handoff failed, exiting: %s", e)
+            self.event_logger.stop()
+            os._exit(1)
+        self.event_logger.info(ev.SERVER, "Handed %s connections over to the new server process, exiting.",
+                               len(state['connections']))
+        self.event_logger.stop()
+        os._exit(0)
+
+    def __freeze_and_export_state(self) -> tuple[dict, list[int]]:
+        """Stops accepting and reading, fans out the queued chat messages and waits for the writes in progress.
+        Returns the state of the server and the file descriptors it refers to, the listening socket comes first."""
+        self.running_flag = False  # Stops the accept loop and the helper threads
+        if self.discovery_responder is not None:
+            self.discovery_responder.stop()  # The successor answers the clients from now on
+        if self.federation is not None:
+            self.federation.stop()  # The links are closed with this process, the successor links again
+        self.accept_loop_stopped.wait()
+        connections = list(self.open_connection_threads)
+        for connection in connections:
+            connection.freeze_for_handoff()
+        self.message_queue.put(None)
+        self.group_chat_updater_thread.join()
+        self.search_indexer_thread.join()
+        # The successor reads the inboxes and the entry log from disk once it has the state
+        self.inbox_store.close()
+        self.entry_log.close()
+
+        fds = [self.server_socket.fileno()]
+        connection_states = []
+        for connection in connections:
+            if not connection.is_connection_open() or connection.peer_link is not None:
+                continue
+            connection_state = connection.export_state()
+            connection_state['fd_index'] = len(fds)
+            fds.append(connection.client_socket.fileno())
+            connection_states.append(connection_state)
+        state = {'connections': connection_states,
+                 'next_connection_id': next(self.connection_ids),
+                 'sessions': self.session_store.export_state(),
+                 'message_history': self.message_history.export_state(),
+                 'search_index': self.search_index.export_state(),
+                 'restricted_channels': self.channel_manager.get_restricted_channels(),
+                 'rate_limits': self.rate_limiter.get_limits(),
+                 'update_rate': self.UPDATE_RATE,
+                 'heartbeat': [self.PING_INTERVAL, self.IDLE_TIMEOUT],
+                 'weather': self.context.weather,
+                 'currency': self.context.currency,
+                 'alert_values': self.context.alert_engine.last_values}
+        return state, fds
+
+    def __take_over_from_running_server(self) -> bool:
+        """Takes the listening socket, the connections and the sessions over from the server process listening on
+        the handoff socket. Returns False if there is no such process, the server then binds as usual."""
+        if self.handoff_path is None:
+            return False
+        predecessor = HotRestart.connect_to_predecessor(self.handoff_path)
+        if predecessor is None:
+            self.event_logger.warning(ev.SERVER, "No running server to take over on %s, starting a new one.",
+                                      self.handoff_path)
+            return False
+        state, fds = HotRestart.receive_state(predecessor)
+        self.entry_log.reload()  # The previous process numbered cards after this one read the card dictionary
+        self.server_socket = socket.socket(fileno=fds[0])
+        self.server_socket.settimeout(ACCEPT_TIMEOUT)
+
+        self.UPDATE_RATE = state['update_rate']
+        self.PING_INTERVAL, self.IDLE_TIMEOUT = state['heartbeat']
+        self.rate_limiter.change_limits(**state['rate_limits'])
+        for channel, apartment_nos in state['restricted_channels'].items():
+            self.channel_manager.restrict_channel(channel, apartment_nos)
+        self.session_store.import_state(state['sessions'])
+        self.message_history.import_state(state['message_history'])
+        self.search_index.import_state(state['search_index'])
+        self.context.weather = state['weather']
+        self.context.update_currency(state['currency'])
+        self.context.alert_engine.update(state['alert_values'])
+        for connection_state in state['connections']:
+            self.__adopt_connection(connection_state, fds[connection_state['fd_index']])
+        self.connection_ids = itertools.count(state['next_connection_id'])
+
+        predecessor.sendall(HotRestart.HANDOFF_ACK)
+        predecessor.close()
+        self.event_logger.info(ev.SERVER, "Took %s connections over from the previous server process on [%s:%s]",
+                               len(state['connections']), self.host, self.port)
+        return True
+
+    def __adopt_connection(self, connection_state: dict, fd: int) -> None:
+        client_socket = socket.socket(fileno=fd)
+        client_thread = ClientThread(connection_state['connection_id'], client_socket,
+                                     tuple(connection_state['client_address']), self.context)
+        client_thread.import_state(connection_state)
+        client_thread.start()
+        self.open_connection_threads.append(client_thread)
+        self.open_connections_by_id[client_thread.connection_id] = client_thread
+        self.idle_timer_wheel.schedule(client_thread, client_thread.last_activity + self.PING_INTERVAL)
+
+
+class ServerContext:
+    """The state that every connection of the server shares.
+    A connection keeps a single reference to it instead of one reference per shared object, and the weather and
+    currency updates are written here once instead of being copied into every connection."""
+    __slots__ = ('message_queue', 'event_logger', 'resident_registry', 'channel_manager', 'rate_limiter',
+                 'session_store', 'message_history', 'search_index', 'inbox_store', 'document_store', 'entry_log',
+                 'profiler', 'federation', 'traffic_recorder', 'weather', 'currency', 'currency_converter', 'alert_engine')
+
+    def __init__(self, message_queue: queue.SimpleQueue, event_logger: EventLogger,
+                 resident_registry: ResidentRegistry, channel_manager: ChannelManager, rate_limiter: RateLimiter,
+                 session_store: SessionStore, message_history: MessageHistory, search_index: ChatSearchIndex,
+                 inbox_store: InboxStore, document_store: DocumentStore, entry_log: EntryLog, profiler: Profiler,
+                 federation: Federation | None):
+        self.message_queue = message_queue
+        self.event_logger = event_logger
+        self.resident_registry = resident_registry
+        self.channel_manager = channel_manager
+        self.rate_limiter = rate_limiter
+        self.session_store = session_store
+        self.message_history = message_history
+        self.search_index = search_index
+        self.inbox_store = inbox_store
+        self.document_store = document_store
+        self.entry_log = entry_log
+        self.profiler = profiler
+        self.federation = federation
+        self.traffic_recorder: TrafficRecorder | None = None  # Set while the traffic is being captured
+        self.weather = AkinProtocol.DEFAULT_WEATHER_DICT
+        self.currency = AkinProtocol.DEFAULT_CURRENCY_DICT
+        self.currency_converter = CurrencyConverter(self.currency)
+        self.alert_engine = AlertEngine(metric for metric, value in {**self.weather, **self.currency}.items()
+                                        if isinstance(value, (int, float)))
+
+    def update_currency(self, currency: dict) -> None:
+        self.currency_converter.update(currency)  # The cross rates are ready before the new data is served
         self.currency = currency
-        self.card: ClientCard = None  # type: ignore
-        self.subscribed_to_message_channel = False
-        self.connection_open_flag = False
 
-    def run(self) -> None:
-        """Handle a client connection"""
-        self.connection_open_flag = True
-        self.client_socket.send(AkinProtocol.WELCOME_TO_THE_SERVER.encode())
-        while self.connection_open_flag:
-            try:
-                client_msg = self.client_socket.recv(1024).decode()
-            except ConnectionResetError:
-                self.connection_open_flag = False
-                break
-            self.__handle_client_message(client_msg=client_msg)
-        sys.exit(0)
+
+class ResidentConnection(abc.ABC):
+    """The state and the request handlers of one resident: their card, session, channels and rate limit.
+    A ClientThread serves one resident on its own socket, a StreamSession serves one of the residents that a lobby
+    kiosk or an intercom gateway multiplexes over a single socket."""
+
+    __slots__ = ('connection_id', 'client_address', 'context', 'chat_rate_bucket', 'card', 'session', 'batch_responses')
+
+    def __init__(self, connection_id: int | str, client_address, context: ServerContext):
+        self.connection_id = connection_id
+        self.client_address = client_address
+        self.context = context
+        self.chat_rate_bucket: TokenBucket = context.rate_limiter.new_connection_bucket()
+        self.card: ClientCard = None  # type: ignore
+        self.session: Session | None = None
+        self.batch_responses: list[str] | None = None  # Collects the responses while a batch is being handled
 
     ### -------------- ###
     ### Public Methods ###
     ### -------------- ###
 
+    @property
+    def transport_connection_id(self) -> int:
+        """The id of the socket connection that carries the requests of this resident"""
+        return self.connection_id  # type: ignore
+
+    @property
+    def weather(self) -> dict:
+        return self.context.weather
+
+    @property
+    def currency(self) -> dict:
+        return self.context.currency
+
+    @abc.abstractmethod
     def is_connection_open(self) -> bool:
-        return self.connection_open_flag
+        ...
 
-    def close_connection(self) -> None:
-        self.connection_open_flag = False
-        self.client_socket.close()
+    @abc.abstractmethod
+    def send_message(self, message: str, block: bool = False) -> bool:
+        ...
 
-    ### -------------- ###
-    ### Helper Methods ###
-    ### -------------- ###
+    @abc.abstractmethod
+    def send_priority_message(self, announcement: Announcement) -> bool:
+        """Queues the announcement ahead of the queued messages, it is never dropped for a slow client"""
 
-    def update_weather(self, weather: dict) -> None:
-        """Updates the weather data that the client will receive when requested"""
-        self.weather = weather
+    @abc.abstractmethod
+    def send_document(self, download: DocumentDownload) -> None:
+        """Queues the download, the document is written in chunks between the other messages
 
-    def update_currency(self, currency: dict) -> None:
-        """Updates the currency data that the client will receive when requested"""
-        self.currency = currency
+        Exceptions:
+            ValueError: If the download can not be started on this connection
+        """
 
-    ### -------------- ###
-    ### Socket Methods ###
-    ### -------------- ###
+    @abc.abstractmethod
+    def chat_message_queued(self) -> None:
+        """Called before one of this resident's chat messages is put on the message queue"""
+
+    @abc.abstractmethod
+    def chat_message_fanned_out(self) -> None:
+        """Called by the server after one of this resident's chat messages is delivered to its channel"""
+
+    def release(self) -> None:
+        """Removes the resident from the registry and the channels, their session stays resumable until its TTL"""
+        self.context.resident_registry.unregister(self)
+        self.context.channel_manager.unsubscribe_from_all(self)
+        self.context.alert_engine.remove_connection(self)
+        if self.session is not None:
+            self.context.session_store.detach(self.session, self.connection_id)
+        if self.card is not None:
+            self.__record_entry(entries.EXIT)
+
+    def export_state(self) -> dict:
+        """Returns what a new server process needs to serve this resident, their session holds their card"""
+        return {'connection_id': self.connection_id,
+                'session_token': self.session.token if self.session is not None else None,
+                'channels': self.context.channel_manager.get_channels(self),
+                'alerts': [[alert.alert_id, alert.metric, alert.direction, alert.threshold]
+                           for alert in self.context.alert_engine.get_alerts(self)]}
+
+    def import_state(self, state: dict) -> None:
+        self.session = self.context.session_store.get(state['session_token']) if state['session_token'] else None
+        if self.session is None:
+            return
+        self.card = self.session.card
+        self.context.resident_registry.register(self)
+        for channel in state['channels']:
+            self.context.channel_manager.subscribe(self, channel)
+        for alert_id, metric, direction, threshold in state['alerts']:
+            self.context.alert_engine.add(self, metric, direction, threshold, alert_id)
+
+    def __record_entry(self, kind: int) -> None:
+        """Adds the card of this resident to the entry log, a failed write is logged and does not fail the request"""
+        try:
+            self.context.entry_log.record(kind, self.card.id, self.card.apartment_no)
+        except (OSError, ValueError) as e:
+            self.context.event_logger.error(ev.REGISTER, "The %s of %s [%s] could not be added to the entry log: %s",
+                                            entries.KIND_NAMES[kind], self.card.name, self.card.apartment_no, e,
+                                            **self.__log_fields())
+
+    ### ---------------- ###
+    ### Request Handlers ###
+    ### ---------------- ###
+
+    def __respond(self, message: str) -> None:
+        """Sends a response to this client, or holds it back until the batch that is being handled is complete"""
+        if self.batch_responses is not None:
+            self.batch_responses.append(message)
+        else:
+            self.send_message(message, block=True)
+
+    def handle_client_message(self, client_msg: str) -> None:
+        if not self.context.profiler.enabled:
+            self.__dispatch_client_message(client_msg)
+            return
+        started = time.perf_counter()
+        try:
+            self.__dispatch_client_message(client_msg)
+        finally:
+            command = client_msg.split(AkinProtocol.DELIMITER, 1)[0]
+            if command not in PROFILED_COMMANDS:
+                command = UNKNOWN_COMMAND
+            self.context.profiler.record_handler(command, time.perf_counter() - started)
+
+    def __dispatch_client_message(self, client_msg: str) -> None:
+        if client_msg.startswith(AkinProtocol.BATCH_REQUEST):
+            self.__handle_batch_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.PONG_RESPONSE):
+            pass  # The activity timestamp is already refreshed
 
-    def __handle_client_message(self, client_msg: str) -> None:
-        if client_msg.startswith(AkinProtocol.REGISTER_USER):
+        elif client_msg == AkinProtocol.PING_REQUEST:
+            self.__respond(AkinProtocol.PONG_RESPONSE)
+
+        elif client_msg.startswith(AkinProtocol.REGISTER_USER):
             self.__handle_register_user(client_msg)
 
+        elif client_msg.startswith(AkinProtocol.RESUME_REQUEST):
+            self.__handle_resume_session(client_msg)
+
         elif client_msg == AkinProtocol.WEATHER_GET:
             self.__handle_get_weather(client_msg)
 
         elif client_msg == AkinProtocol.CURRENCY_GET:
             self.__handle_get_currency(client_msg)
 
-        elif client_msg == AkinProtocol.SUBSCRIBE_REQUEST:
+        elif client_msg.startswith(AkinProtocol.CONVERT_REQUEST):
+            self.__handle_convert_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.ALERT_REQUEST):
+            self.__handle_alert_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.ALERT_REMOVE_REQUEST):
+            self.__handle_alert_remove_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.SEARCH_REQUEST):
+            self.__handle_search_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.SUBSCRIBE_REQUEST):
             self.__handle_subscribe_request(client_msg)
 
-        elif client_msg == AkinProtocol.UNSUBSCRIBE_REQUEST:
+        elif client_msg.startswith(AkinProtocol.UNSUBSCRIBE_REQUEST):
             self.__handle_unsubscribe_request(client_msg)
 
         elif client_msg.startswith(AkinProtocol.CHAT_MESSAGE):
             self.__handle_chat_message(client_msg)
 
+        elif client_msg.startswith(AkinProtocol.DIRECT_MESSAGE):
+            self.__handle_direct_message(client_msg)
+
+        elif client_msg == AkinProtocol.DOCUMENT_LIST_REQUEST:
+            self.__handle_document_list_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.DOCUMENT_REQUEST):
+            self.__handle_download_request(client_msg)
+
+        elif client_msg.startswith(AkinProtocol.ENTRY_REPORT_REQUEST):
+            self.__handle_entry_report_request(client_msg)
+
         else:
             error_message = f"Unknown command: {client_msg}"
-            try:
-                self.client_socket.send(error_message.encode())
-            except BrokenPipeError:
-                self.connection_open_flag = False
+            self.__respond(error_message)
+
+    def __handle_batch_request(self, client_msg: str) -> None:
+        """Handles every request of a batch in order and writes all of their responses back with a single send"""
+        requests = AkinProtocol.parse_batch(client_msg)
+        self.batch_responses = []
+        try:
+            for request in requests:
+                if request.startswith(AkinProtocol.BATCH_REQUEST):
+                    self.batch_responses.append(f"{AkinProtocol.ERROR}Batches can not be nested")
+                else:
+                    self.handle_client_message(request)
+        finally:
+            responses, self.batch_responses = self.batch_responses, None
+        self.send_message(AkinProtocol.construct_batch(responses), block=True)
 
     def __handle_register_user(self, client_msg: str) -> None:
         """Handles the register user command"""
         card_details = AkinProtocol.parse_register_response(client_msg)
+        self.context.resident_registry.unregister(self)  # The card on this connection may be replaced by a new one.
         self.card = ClientCard(card_details['name'], int(card_details['apartment_no']))
-        self.client_socket.send(self.card.id.encode())
-        self.logging_queue.put(f"{self.card.name} [{self.card.apartment_no}] just scanned their card and entered the apartment!")
+        self.context.resident_registry.register(self)
+        if self.session is not None:
+            self.context.session_store.remove(self.session)
+        self.session = self.context.session_store.create(self.card, self.connection_id)
+        self.__record_entry(entries.REGISTER)
+        session_response = AkinProtocol.construct_session_response(AkinProtocol.REGISTER_USER, self.card.id,
+                                                                   self.session.token)
+        inbox_messages = self.__take_inbox_messages()  # Taken after registering, newer messages come directly
+        if inbox_messages:
+            self.__respond(AkinProtocol.construct_batch([session_response, *inbox_messages]))
+        else:
+            self.__respond(session_response)
+        self.context.event_logger.info(ev.REGISTER, "%s [%s] just scanned their card and entered the apartment!",
+                                       self.card.name, self.card.apartment_no, **self.__log_fields())
+        if inbox_messages:
+            self.context.event_logger.info(ev.DIRECT, "%s messages waiting in the inbox of apartment %s were delivered.",
+                                           len(inbox_messages), self.card.apartment_no, **self.__log_fields())
+
+    def __handle_resume_session(self, client_msg: str) -> None:
+        """Handles the resume session command: restores the card and the subscriptions of a previous connection and
+        replays the channel messages the client has not received yet, all in one response"""
+        try:
+            request = AkinProtocol.parse_resume_request(client_msg)
+        except (IndexError, ValueError):
+            self.__respond(f"{AkinProtocol.ERROR}Sessions should be resumed with a token and a sequence number")
+            return
+        session = self.context.session_store.resume(request['session_token'], self.connection_id)
+        if session is None:
+            self.__respond(f"{AkinProtocol.ERROR}Session expired, please scan your card again")
+            return
+
+        self.context.resident_registry.unregister(self)
+        self.card = session.card
+        self.context.resident_registry.register(self)
+        self.session = session
+        self.__record_entry(entries.RESUME)
+        with self.context.message_history.lock:
+            for channel in list(session.channels):
+                try:
+                    self.context.channel_manager.subscribe(self, channel)
+                except (ce.InvalidChannelNameError, ce.ChannelAccessDeniedError):
+                    session.channels.discard(channel)  # The channel was restricted while the client was away
+            missed_messages = self.context.message_history.get_messages_after(request['last_sequence_no'],
+                                                                              session.channels)
+            response = [AkinProtocol.construct_session_response(AkinProtocol.RESUME_REQUEST, self.card.id,
+                                                                session.token)]
+            response.extend(AkinProtocol.construct_chat_message(text, channel, sequence_no)
+                            for sequence_no, channel, text in missed_messages)
+            response.extend(self.__take_inbox_messages())
+            self.__respond(AkinProtocol.construct_batch(response))
+        self.context.event_logger.info(ev.REGISTER, "%s [%s] resumed their session, %s missed messages were replayed.",
+                                       self.card.name, self.card.apartment_no, len(missed_messages),
+                                       **self.__log_fields())
 
     def __handle_subscribe_request(self, client_msg: str) -> None:
-        """Handles the subscribe request command, this will add the client to the message channel"""
-        self.subscribed_to_message_channel = True
-        self.client_socket.send(AkinProtocol.OK.encode())
-        self.logging_queue.put(f"{self.card.name} [{self.card.apartment_no}] subscribed to the message channel.")
+        """Handles the subscribe request command, this will add the client to the requested message channel"""
+        if self.card is None:
+            error_message = f"{AkinProtocol.ERROR}You are not registered"
+            self.__respond(error_message)
+            return
+        channel = AkinProtocol.parse_channel_request(client_msg)
+        try:
+            self.context.channel_manager.subscribe(self, channel)
+        except (ce.InvalidChannelNameError, ce.ChannelAccessDeniedError) as e:
+            error_message = f"{AkinProtocol.ERROR}{e}"
+            self.__respond(error_message)
+            return
+        if self.session is not None:
+            self.session.channels.add(channel)
+        self.__respond(AkinProtocol.OK)
+        self.context.event_logger.info(ev.SUBSCRIPTION, "%s [%s] subscribed to the #%s channel.",
+                                       self.card.name, self.card.apartment_no, channel, **self.__log_fields())
 
     def __handle_unsubscribe_request(self, client_msg: str) -> None:
-        """Handles the unsubscribe request command, this will remove the client from the message channel"""
-        self.subscribed_to_message_channel = False
-        self.client_socket.send(AkinProtocol.OK.encode())
-        self.logging_queue.put(f"{self.card.name} [{self.card.apartment_no}] unsubscribed from the message channel.")
+        """Handles the unsubscribe request command, this will remove the client from the requested message channel"""
+        channel = AkinProtocol.parse_channel_request(client_msg)
+        self.context.channel_manager.unsubscribe(self, channel)
+        if self.session is not None:
+            self.session.channels.discard(channel)
+        self.__respond(AkinProtocol.OK)
+        self.context.event_logger.info(ev.SUBSCRIPTION, "%s unsubscribed from the #%s channel.",
+                                       self.card.name if self.card is not None else self.client_address, channel,
+                                       **self.__log_fields())
 
     def __handle_chat_message(self, client_msg: str) -> None:
         if self.card is None:
             error_message = f"{AkinProtocol.ERROR}You are not registered"
-            self.client_socket.send(error_message.encode())
+            self.__respond(error_message)
             return
-        chat_message = AkinProtocol.strip_delimiter(client_msg)
+        request = AkinProtocol.parse_chat_message(client_msg)
+        channel = request['channel']
         card_name = str(self.card.name)
         apartment_no = str(self.card.apartment_no)
 
-        chat_message = f"[{Utility.get_simple_time()}] [No:{apartment_no}] {card_name}: {chat_message}"
-        chat_message = AkinProtocol.construct_chat_message(chat_message)
+        chat_message = f"[{Utility.get_simple_time()}] [No:{apartment_no}] {card_name}: {request['message']}"
 
-        if self.subscribed_to_message_channel:
-            self.message_queue.put(chat_message)
-            self.client_socket.send(AkinProtocol.OK.encode())
-            self.logging_queue.put(f"{self.card.name} [{self.card.apartment_no}] sent a message to the group chat.")
+        if not self.context.channel_manager.is_subscribed(self, channel):
+            error_message = f"{AkinProtocol.ERROR}You are not subscribed to the #{channel} channel"
+            self.__respond(error_message)
+        elif not self.context.rate_limiter.allow(self.chat_rate_bucket, self.card.apartment_no):
+            error_message = f"{AkinProtocol.ERROR}You are sending messages too fast, please slow down"
+            self.__respond(error_message)
+            self.context.event_logger.warning(ev.CHAT, "%s [%s] hit the chat rate limit.",
+                                              self.card.name, self.card.apartment_no, **self.__log_fields())
         else:
-            error_message = f"{AkinProtocol.ERROR}You are not subscribed to the message channel"
-            self.client_socket.send(error_message.encode())
+            self.chat_message_queued()
+            self.context.message_queue.put((channel, chat_message, self.transport_connection_id))
+            self.__respond(AkinProtocol.OK)
+            self.context.event_logger.info(ev.CHAT, "%s [%s] sent a message to the #%s channel.",
+                                           self.card.name, self.card.apartment_no, channel, **self.__log_fields())
+
+    def __handle_direct_message(self, client_msg: str) -> None:
+        """Handles the direct message command, the message is delivered only to the connections of one apartment"""
+        if self.card is None:
+            error_message = f"{AkinProtocol.ERROR}You are not registered"
+            self.__respond(error_message)
+            return
+        try:
+            request = AkinProtocol.parse_direct_message(client_msg)
+            target_apartment_no = int(request['apartment_no'])
+        except ValueError:
+            error_message = f"{AkinProtocol.ERROR}Direct messages should be sent as apartment_no and message"
+            self.__respond(error_message)
+            return
+
+        if not self.context.rate_limiter.allow(self.chat_rate_bucket, self.card.apartment_no):
+            error_message = f"{AkinProtocol.ERROR}You are sending messages too fast, please slow down"
+            self.__respond(error_message)
+            return
+
+        direct_message = f"[{Utility.get_simple_time()}] [No:{self.card.apartment_no}] {self.card.name}: {request['message']}"
+        targets = self.context.resident_registry.get_connections_by_apartment_no(target_apartment_no)
+        if not targets:
+            self.__store_in_inbox(target_apartment_no, direct_message)
+            return
+
+        direct_message = AkinProtocol.construct_direct_message(target_apartment_no, direct_message)
+        for connection in targets:
+            connection.send_message(direct_message)
+        self.__respond(AkinProtocol.OK)
+        self.context.event_logger.info(ev.DIRECT, "%s [%s] sent a direct message to apartment %s.",
+                                       self.card.name, self.card.apartment_no, target_apartment_no,
+                                       **self.__log_fields())
+
+    def __store_in_inbox(self, apartment_no: int, direct_message: str) -> None:
+        """Keeps the direct message for an apartment whose residents are all offline"""
+        try:
+            self.context.inbox_store.append(apartment_no, direct_message)
+        except (OSError, ValueError) as e:
+            self.__respond(f"{AkinProtocol.ERROR}No residents of apartment {apartment_no} are online and the "
+                           f"message could not be kept for them: {e}")
+            return
+        self.__respond(f"{AkinProtocol.OK}No residents of apartment {apartment_no} are online, the message will be "
+                       f"delivered when one of them comes back")
+        self.context.event_logger.info(ev.DIRECT, "%s [%s] sent a direct message to the inbox of apartment %s.",
+                                       self.card.name, self.card.apartment_no, apartment_no, **self.__log_fields())
+
+    def __take_inbox_messages(self) -> list[str]:
+        """Returns the direct messages that waited for the apartment of this resident, the inbox is emptied"""
+        try:
+            stored_messages = self.context.inbox_store.take(self.card.apartment_no)
+        except (OSError, ValueError) as e:
+            self.context.event_logger.error(ev.DIRECT, "The inbox of apartment %s could not be read: %s",
+                                            self.card.apartment_no, e, **self.__log_fields())
+            return []
+        return [AkinProtocol.construct_direct_message(
+                    self.card.apartment_no, f"[{time.strftime('%d.%m.%Y', time.localtime(stored_at))}] {message}")
+                for stored_at, message in stored_messages]
 
     def __handle_get_weather(self, client_msg: str) -> None:
         """Handles the get weather command"""
         weather_message = AkinProtocol.construct_weather_response(self.weather)
-        self.client_socket.send(weather_message.encode())
+        self.__respond(weather_message)
 
     def __handle_get_currency(self, client_msg: str) -> None:
         """Handles the get currency command"""
         currency_message = AkinProtocol.construct_currency_response(self.currency)
-        self.client_socket.send(currency_message.encode())
+        self.__respond(currency_message)
+
+    def __handle_convert_request(self, client_msg: str) -> None:
+        """Handles the convert command, every conversion of the request is answered from the same cross rates"""
+        try:
+            conversions = AkinProtocol.parse_convert_request(client_msg)
+            results = self.context.currency_converter.convert_many(conversions)
+        except ValueError as e:
+            self.__respond(f"{AkinProtocol.ERROR}{e}")
+            return
+        self.__respond(AkinProtocol.construct_convert_response(results))
+
+    def __handle_search_request(self, client_msg: str) -> None:
+        """Handles the search command, only the messages of the channels the resident can join are searched"""
+        if self.card is None:
+            self.__respond(f"{AkinProtocol.ERROR}You are not registered")
+            return
+        apartment_no = self.card.apartment_no
+        channel_manager = self.context.channel_manager
+        try:
+            request = AkinProtocol.parse_search_request(client_msg)
+            total, results = self.context.search_index.search(
+                request['query'], request['page'], channel=request['channel'],
+                is_visible=lambda channel: channel_manager.can_join(apartment_no, channel))
+        except ValueError as e:
+            self.__respond(f"{AkinProtocol.ERROR}{e}")
+            return
+        self.__respond(AkinProtocol.construct_search_response(total, request['page'], results))
+
+    def __handle_document_list_request(self, client_msg: str) -> None:
+        """Handles the document list command, answers with the name and the size of every published document"""
+        if self.card is None:
+            self.__respond(f"{AkinProtocol.ERROR}You are not registered")
+            return
+        try:
+            documents = self.context.document_store.list_documents()
+        except OSError as e:
+            self.__respond(f"{AkinProtocol.ERROR}The documents could not be listed: {e}")
+            return
+        self.__respond(AkinProtocol.construct_document_list_response(documents))
+
+    def __handle_download_request(self, client_msg: str) -> None:
+        """Handles the download command. The document is the response, it is sent in chunks from the requested offset
+        on, and the messages queued for the client are written between two chunks."""
+        if self.card is None:
+            self.__respond(f"{AkinProtocol.ERROR}You are not registered")
+            return
+        try:
+            request = AkinProtocol.parse_download_request(client_msg)
+        except ValueError:
+            self.__respond(f"{AkinProtocol.ERROR}Downloads should be sent as document name and offset")
+            return
+        try:
+            download = self.context.document_store.open_download(request['name'], request['offset'])
+        except (OSError, ValueError) as e:
+            self.__respond(f"{AkinProtocol.ERROR}{e}")
+            return
+        try:
+            self.send_document(download)
+        except ValueError as e:
+            download.close()
+            self.__respond(f"{AkinProtocol.ERROR}{e}")
+            return
+        self.context.event_logger.info(ev.DOCUMENT, "%s [%s] is downloading the document %s from byte %s.",
+                                       self.card.name, self.card.apartment_no, download.name, download.offset,
+                                       **self.__log_fields())
+
+    def __handle_entry_report_request(self, client_msg: str) -> None:
+        """Handles the entry report command, only the apartments allowed by the management can query the entry log"""
+        if self.card is None:
+            self.__respond(f"{AkinProtocol.ERROR}You are not registered")
+            return
+        if not self.context.entry_log.can_query(self.card.apartment_no):
+            self.__respond(f"{AkinProtocol.ERROR}Apartment {self.card.apartment_no} can not query the entry reports")
+            return
+        try:
+            request = AkinProtocol.parse_entry_report_request(client_msg)
+        except ValueError:
+            self.__respond(f"{AkinProtocol.ERROR}Entry reports should be sent as report, start and end time")
+            return
+        entry_log = self.context.entry_log
+        try:
+            if request['report'] == "hours":
+                rows = entry_log.get_entries_per_hour(request['start'], request['end'])
+            elif request['report'] == "apartments":
+                rows = list(entry_log.get_entries_per_apartment(request['start'], request['end']).items())
+            elif request['report'] == "anomalies":
+                rows = entry_log.get_anomalies(request['start'], request['end'])
+            else:
+                self.__respond(f"{AkinProtocol.ERROR}Unknown entry report: {request['report']}")
+                return
+        except OSError as e:
+            self.__respond(f"{AkinProtocol.ERROR}The entry log could not be read: {e}")
+            return
+        self.__respond(AkinProtocol.construct_entry_report_response(request['report'], rows))
+        self.context.event_logger.info(ev.REGISTER, "%s [%s] queried the %s entry report.",
+                                       self.card.name, self.card.apartment_no, request['report'], **self.__log_fields())
+
+    def __handle_alert_request(self, client_msg: str) -> None:
+        """Handles the alert command, the client is notified every time the metric crosses the threshold"""
+        try:
+            request = AkinProtocol.parse_alert_request(client_msg)
+            alert = self.context.alert_engine.add(self, request['metric'], request['direction'], request['threshold'])
+        except ValueError:
+            self.__respond(f"{AkinProtocol.ERROR}Alerts should be sent as metric, direction and threshold")
+            return
+        except ce.InvalidAlertError as e:
+            self.__respond(f"{AkinProtocol.ERROR}{e}")
+            return
+        self.__respond(AkinProtocol.construct_alert_response(alert.alert_id))
+        self.context.event_logger.info(ev.SUBSCRIPTION, "Alert %s registered: %s %s %s.", alert.alert_id,
+                                       alert.metric, alert.direction, alert.threshold, **self.__log_fields())
+
+    def __handle_alert_remove_request(self, client_msg: str) -> None:
+        try:
+            alert_id = AkinProtocol.parse_alert_remove_request(client_msg)
+        except ValueError:
+            alert_id = None
+        if alert_id is None or not self.context.alert_engine.remove(self, alert_id):
+            self.__respond(f"{AkinProtocol.ERROR}No such alert")
+            return
+        self.__respond(AkinProtocol.OK)
+
+    def __log_fields(self) -> dict:
+        """Returns the per-event fields that identify this connection in the structured log"""
+        if self.card is None:
+            return {'client_address': self.client_address}
+        return {'card_id': self.card.id, 'apartment_no': self.card.apartment_no, 'client_address': self.client_address}
+
+
+class ClientThread(threading.Thread, ResidentConnection):
+    """A thread that handles a single client connection"""
+
+    def __init__(self, connection_id: int, client_socket: socket.socket, client_address, context: ServerContext):
+        threading.Thread.__init__(self, name=f"ClientThread-{connection_id}")
+        ResidentConnection.__init__(self, connection_id, client_address, context)
+        self.client_socket = client_socket
+        self.connection_open_flag = False
+        self.welcome_sent = False
+        self.last_activity = time.monotonic()
+
+        ### Backpressure ###
+        # One condition guards the outbound messages and the pending chat count, it wakes the writer thread up and
+        # the reader thread of a backpressured connection.
+        # An announcement is queued as (message, Announcement) ahead of the other messages, the first
+        # priority_messages entries are announcements. A download is queued as its DocumentDownload and goes back to
+        # the end of the queue after every chunk, so the messages queued meanwhile are written between two chunks.
+        self.outbound_messages: collections.deque[str | tuple[str, Announcement] | DocumentDownload] = \
+            collections.deque()
+        self.priority_messages = 0
+        self.document_downloads: list[DocumentDownload] = []
+        self.backpressure_condition = threading.Condition()
+        self.writer_running = False  # The writer thread is started on demand and exits when the connection is idle
+        self.pending_chat_messages = 0
+
+        ### Hot Restart ###
+        self.read_lock = threading.Lock()  # Held while a read is handled, so that a handoff can wait for it
+        self.write_lock = threading.Lock()  # Held while a message is written
+        self.handing_over = False
+        self.dropped_messages = 0
+
+        ### Multiplexed Streams ###
+        self.stream_sessions: dict[int, StreamSession] = {}
+        self.stream_buffer = b""  # The bytes of a frame that is not complete yet
+        self.multiplexed = False  # Set once the client sends a frame of a stream other than the connection's own
+
+        ### Federation ###
+        self.peer_link: PeerLink | None = None  # Set when the server of another block connects to relay messages
+        self.peer_buffer = b""
+
+    def run(self) -> None:
+        """Handle a client connection"""
+        self.connection_open_flag = True
+        self.__record_traffic(TrafficCapture.OPEN)
+        if not self.welcome_sent:  # A connection taken over from a previous server process was already welcomed
+            self.client_socket.send(AkinProtocol.WELCOME_TO_THE_SERVER.encode())
+            self.welcome_sent = True
+        while self.connection_open_flag:
+            self.__wait_while_backpressured()
+            try:
+                # Waits for data with a one byte peek, an idle connection does not hold a receive buffer
+                data_available = self.client_socket.recv(1, socket.MSG_PEEK)
+            except OSError:  # Reset by the client, or closed by the server
+                self.connection_open_flag = False
+                break
+            with self.read_lock:
+                if self.handing_over:
+                    return  # The unread bytes stay in the socket for the new server process
+                if not data_available:  # The client closed the connection
+                    self.connection_open_flag = False
+                    break
+                try:
+                    data = self.client_socket.recv(RECEIVE_BUFFER_SIZE)
+                except OSError:
+                    self.connection_open_flag = False
+                    break
+                self.last_activity = time.monotonic()
+                self.__record_traffic(TrafficCapture.DATA, data)
+                if self.peer_link is not None:
+                    self.__handle_peer_data(data)
+                elif not self.stream_buffer and data.startswith(AkinProtocol.PEER_HELLO.encode()):
+                    self.__accept_peer_link(data.decode())
+                else:
+                    self.__handle_stream_data(data)
+        self.__record_traffic(TrafficCapture.CLOSE)
+        self.close_connection()  # Wakes the idle writer thread up to exit and frees the socket right away
+        sys.exit(0)
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def is_connection_open(self) -> bool:
+        return self.connection_open_flag
+
+    def close_connection(self) -> None:
+        with self.backpressure_condition:
+            self.connection_open_flag = False
+            self.backpressure_condition.notify_all()  # Wakes the writer thread up
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)  # Wakes the reader thread up
+        except OSError:
+            pass
+        self.client_socket.close()
+
+    def send_message(self, message: str, block: bool = False) -> bool:
+        """Queues a message for the resident of this connection in a stream frame, the client splits the messages
+        that arrive in one read by their length"""
+        return self.send_frame(AkinProtocol.construct_connection_frame(message), block)
+
+    def send_frame(self, message: str, block: bool = False) -> bool:
+        """Queues a frame or a connection message (e.g. a ping) for this client, can be called from any thread.
+        Fan-out calls never block: when the outbound queue of a slow client is full the message is dropped for that
+        client only. Responses to the client's own requests block, which stops the client from sending more.
+        Returns False if the message could not be queued."""
+        with self.backpressure_condition:
+            if block:
+                while self.connection_open_flag and len(self.outbound_messages) >= OUTBOUND_QUEUE_LIMIT:
+                    self.backpressure_condition.wait(timeout=0.5)
+            if not self.connection_open_flag:
+                return False
+            if len(self.outbound_messages) >= OUTBOUND_QUEUE_LIMIT:
+                self.dropped_messages += 1
+                return False
+            self.outbound_messages.append(message)
+            self.__wake_writer()
+            return True
+
+    def send_priority_message(self, announcement: Announcement, stream_id: int | None = None) -> bool:
+        """Queues the announcement after the announcements queued before and ahead of every other message.
+        When the outbound queue is full the newest queued message is dropped to make room."""
+        stream_id = AkinProtocol.CONNECTION_STREAM_ID if stream_id is None else stream_id
+        message = AkinProtocol.construct_stream_frame(stream_id, announcement.message)
+        with self.backpressure_condition:
+            if not self.connection_open_flag:
+                return False
+            if self.priority_messages < len(self.outbound_messages) >= OUTBOUND_QUEUE_LIMIT:
+                self.__drop_newest_message()
+            self.outbound_messages.insert(self.priority_messages, (message, announcement))
+            self.priority_messages += 1
+            self.__wake_writer()
+            return True
+
+    def send_document(self, download: DocumentDownload) -> None:
+        with self.backpressure_condition:
+            if not self.connection_open_flag:
+                raise ValueError("The connection is closed")
+            if len(self.document_downloads) >= MAX_DOWNLOADS_PER_CONNECTION:
+                raise ValueError(f"At most {MAX_DOWNLOADS_PER_CONNECTION} documents can be downloaded at the same time")
+            self.document_downloads.append(download)
+            self.outbound_messages.append(download)
+            self.__wake_writer()
+
+    def chat_message_queued(self) -> None:
+        with self.backpressure_condition:
+            self.pending_chat_messages += 1
+
+    def chat_message_fanned_out(self) -> None:
+        with self.backpressure_condition:
+            self.pending_chat_messages -= 1
+            self.backpressure_condition.notify_all()
+
+    def release(self) -> None:
+        """Releases this resident and every resident multiplexed over this connection"""
+        if self.peer_link is not None:
+            self.context.federation.remove_link(self.peer_link)
+        for stream_session in list(self.stream_sessions.values()):
+            stream_session.release()
+        self.stream_sessions.clear()
+        with self.backpressure_condition:
+            self.__close_downloads()
+        ResidentConnection.release(self)
+
+    def freeze_for_handoff(self) -> None:
+        """Stops reading and writing once the request that is being handled is complete"""
+        with self.read_lock, self.backpressure_condition:
+            self.handing_over = True
+            self.backpressure_condition.notify_all()
+
+    def export_state(self) -> dict:
+        """Returns the state of the connection and its streams, waits for the message that is being written"""
+        with self.write_lock, self.backpressure_condition:
+            # The successor delivers the unsent announcements too, but does not count them
+            unsent_messages = [message if isinstance(message, str) else message[0]
+                               for message in self.outbound_messages if not isinstance(message, DocumentDownload)]
+            downloads = [[download.name, download.offset] for download in self.document_downloads]
+        stream_buffer = base64.b64encode(self.stream_buffer).decode()
+        state = ResidentConnection.export_state(self)
+        state.update({'client_address': list(self.client_address),
+                      'idle_for': time.monotonic() - self.last_activity,
+                      'unsent_messages': unsent_messages,
+                      'downloads': downloads,
+                      'stream_buffer': stream_buffer,
+                      'multiplexed': self.multiplexed,
+                      'streams': [dict(stream_session.export_state(), stream_id=stream_id)
+                                  for stream_id, stream_session in self.stream_sessions.items()]})
+        return state
+
+    def import_state(self, state: dict) -> None:
+        """Restores a connection taken over from a previous server process, before the thread is started"""
+        ResidentConnection.import_state(self, state)
+        self.welcome_sent = True
+        self.last_activity = time.monotonic() - state['idle_for']
+        self.stream_buffer = base64.b64decode(state['stream_buffer'])
+        self.multiplexed = state['multiplexed']
+        for stream_state in state['streams']:
+            stream_session = StreamSession(self, stream_state['stream_id'])
+            stream_session.import_state(stream_state)
+            self.stream_sessions[stream_session.stream_id] = stream_session
+        self.connection_open_flag = True
+        for message in state['unsent_messages']:
+            self.send_frame(message)
+        for name, offset in state['downloads']:
+            try:
+                self.send_document(self.context.document_store.open_download(name, offset))
+            except (OSError, ValueError):
+                pass  # The document was removed, the client asks for it again
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __record_traffic(self, kind: int, data: bytes = b"") -> None:
+        recorder = self.context.traffic_recorder
+        if recorder is not None:
+            recorder.record(self.connection_id, kind, data)
+
+    def __is_backpressured(self) -> bool:
+        return (len(self.outbound_messages) >= OUTBOUND_HIGH_WATERMARK
+                or self.pending_chat_messages >= PENDING_CHAT_LIMIT)
+
+    def __wait_while_backpressured(self) -> None:
+        """Stops reading from this client until its outbound and pending chat queues drain below their bounds"""
+        with self.backpressure_condition:
+            while self.connection_open_flag and self.__is_backpressured():
+                self.backpressure_condition.wait(timeout=0.5)
+
+    def __wake_writer(self) -> None:
+        """Called with the backpressure condition held after a message is queued"""
+        if self.writer_running:
+            self.backpressure_condition.notify_all()
+        else:
+            self.writer_running = True
+            threading.Thread(target=self.__write_outbound_messages, name=f"ClientWriter-{self.connection_id}",
+                             daemon=True).start()
+
+    def __write_outbound_messages(self) -> None:
+        """Writes the queued messages to the client socket, runs on the writer thread of this connection"""
+        while True:
+            with self.write_lock:
+                with self.backpressure_condition:
+                    while self.connection_open_flag and not self.handing_over and not self.outbound_messages:
+                        if not self.backpressure_condition.wait(WRITER_IDLE_TIMEOUT) and not self.outbound_messages:
+                            self.writer_running = False  # The next message starts a new writer thread
+                            return
+                    if not self.connection_open_flag or self.handing_over:
+                        self.writer_running = False
+                        unsent_announcements = [] if self.handing_over else self.__take_unsent_announcements()
+                        if not self.handing_over:
+                            self.__close_downloads()
+                        break
+                    message = self.outbound_messages.popleft()
+                    announcement = None
+                    if self.priority_messages:
+                        self.priority_messages -= 1
+                        message, announcement = message
+                    if len(self.outbound_messages) < OUTBOUND_HIGH_WATERMARK:
+                        self.backpressure_condition.notify_all()
+                try:
+                    if isinstance(message, DocumentDownload):
+                        self.__write_document_chunk(message)
+                    else:
+                        self.client_socket.sendall(message.encode())
+                except OSError:
+                    with self.backpressure_condition:
+                        self.connection_open_flag = False
+                        self.writer_running = False
+                        self.backpressure_condition.notify_all()
+                        unsent_announcements = self.__take_unsent_announcements()
+                        self.__close_downloads()
+                    if announcement is not None:
+                        unsent_announcements.append(announcement)
+                    break
+                if announcement is not None:
+                    announcement.record_delivery()
+                if isinstance(message, DocumentDownload):
+                    with self.backpressure_condition:
+                        if message.is_done() or not self.connection_open_flag:
+                            self.document_downloads.remove(message)
+                            message.close()
+                        else:
+                            self.outbound_messages.append(message)  # After the messages queued during the chunk
+        for announcement in unsent_announcements:
+            announcement.record_failure()
+
+    def __write_document_chunk(self, download: DocumentDownload) -> None:
+        """Writes the next chunk of the document straight from the file to the socket, with sendfile where the platform
+        has it and with memoryview slices of a read buffer where it does not. The last chunk of a document can be
+        empty, it tells the client that the document is complete."""
+        length = min(DOCUMENT_CHUNK_SIZE, download.size - download.offset)
+        header = AkinProtocol.construct_document_chunk_header(download.name, download.offset, length, download.size)
+        self.client_socket.sendall(header.encode())
+        if length and self.client_socket.sendfile(download.file, download.offset, length) != length:
+            raise OSError(f"The document {download.name} was truncated while it was being sent")
+        download.offset += length
+
+    def __drop_newest_message(self) -> None:
+        """Called with the backpressure condition held, drops the newest message to make room for an announcement.
+        Downloads are never dropped, there are at most MAX_DOWNLOADS_PER_CONNECTION of them in the queue."""
+        for index in range(len(self.outbound_messages) - 1, self.priority_messages - 1, -1):
+            if not isinstance(self.outbound_messages[index], DocumentDownload):
+                del self.outbound_messages[index]
+                self.dropped_messages += 1
+                return
+
+    def __close_downloads(self) -> None:
+        """Called with the backpressure condition held once the connection is closed"""
+        for download in self.document_downloads:
+            download.close()
+        self.document_downloads.clear()
+        for message in [message for message in self.outbound_messages if isinstance(message, DocumentDownload)]:
+            self.outbound_messages.remove(message)
+
+    def __take_unsent_announcements(self) -> list[Announcement]:
+        """Called with the backpressure condition held once the connection is closed"""
+        unsent_announcements = [self.outbound_messages.popleft()[1] for _ in range(self.priority_messages)]
+        self.priority_messages = 0
+        return unsent_announcements
+
+    def __handle_stream_data(self, data: bytes) -> None:
+        """Splits the received bytes into stream frames, several requests can arrive in one read and one of them in
+        several reads. The requests of a plain connection are on stream 0, a gateway numbers its streams from 1."""
+        self.stream_buffer += data
+        try:
+            frames, self.stream_buffer = AkinProtocol.split_stream_frames(self.stream_buffer,
+                                                                          (AkinProtocol.PONG_RESPONSE,))
+        except ValueError as e:
+            self.stream_buffer = b""
+            self.send_message(f"{AkinProtocol.ERROR}Invalid stream frame: {e}", block=True)
+            return
+        for stream_id, payload in frames:
+            if stream_id is None:
+                continue  # The heartbeat answers are not framed
+            if stream_id == AkinProtocol.CONNECTION_STREAM_ID:
+                self.handle_client_message(payload)
+            else:
+                self.multiplexed = True
+                self.__handle_stream_frame(stream_id, payload)
+
+    def __accept_peer_link(self, hello: str) -> None:
+        """Turns this connection into the link of the server of another block, it sends batches of relayed messages
+        on stream 0 from now on"""
+        federation = self.context.federation
+        try:
+            if federation is None:
+                raise ValueError("This server is not in a federation")
+            self.peer_link = federation.accept_link(hello, lambda frame: self.send_frame(frame, block=True),
+                                                    self.close_connection)
+        except (IndexError, ValueError) as e:
+            error_message = f"{AkinProtocol.ERROR}{e}"
+            self.send_frame(AkinProtocol.construct_stream_frame(AkinProtocol.FEDERATION_STREAM_ID, error_message),
+                            block=True)
+            self.context.event_logger.warning(ev.FEDERATION, "Refused a link from %s: %s", self.client_address, e,
+                                              client_address=self.client_address)
+
+    def __handle_peer_data(self, data: bytes) -> None:
+        """Splits the frames of the peer server out of the received bytes, its heartbeat answers are not framed"""
+        try:
+            frames, self.peer_buffer = AkinProtocol.split_stream_frames(self.peer_buffer + data,
+                                                                        (AkinProtocol.PONG_RESPONSE,))
+        except ValueError as e:
+            self.context.event_logger.warning(ev.FEDERATION, "Closing the link to block %s: %s",
+                                              self.peer_link.node_id, e)
+            self.close_connection()
+            return
+        for stream_id, payload in frames:
+            if stream_id == AkinProtocol.FEDERATION_STREAM_ID:
+                self.context.federation.handle_frame(self.peer_link, payload)
+
+    def __handle_stream_frame(self, stream_id: int, payload: str) -> None:
+        """Hands the request over to the resident of the stream, opening the stream on its first frame"""
+        stream_session = self.stream_sessions.get(stream_id)
+        if payload == AkinProtocol.STREAM_CLOSE_REQUEST:
+            if stream_session is not None:
+                del self.stream_sessions[stream_id]
+                stream_session.release()
+            return
+        if stream_session is None:
+            if len(self.stream_sessions) >= MAX_STREAMS_PER_CONNECTION:
+                error_message = f"{AkinProtocol.ERROR}Too many streams on this connection"
+                self.send_frame(AkinProtocol.construct_stream_frame(stream_id, error_message), block=True)
+                return
+            stream_session = StreamSession(self, stream_id)
+            self.stream_sessions[stream_id] = stream_session
+        stream_session.handle_client_message(payload)
+
+
+class StreamSession(ResidentConnection):
+    """One resident multiplexed over the connection of a lobby kiosk or an intercom gateway.
+    Responses are wrapped in stream frames and written through the outbound queue of the parent connection."""
+    __slots__ = ('parent', 'stream_id')
+
+    def __init__(self, parent: ClientThread, stream_id: int):
+        super().__init__(f"{parent.connection_id}:{stream_id}", parent.client_address, parent.context)
+        self.parent = parent
+        self.stream_id = stream_id
+
+    @property
+    def transport_connection_id(self) -> int:
+        return self.parent.connection_id
+
+    def is_connection_open(self) -> bool:
+        return self.parent.is_connection_open()
+
+    def send_message(self, message: str, block: bool = False) -> bool:
+        return self.parent.send_frame(AkinProtocol.construct_stream_frame(self.stream_id, message), block)
+
+    def send_priority_message(self, announcement: Announcement) -> bool:
+        return self.parent.send_priority_message(announcement, self.stream_id)
+
+    def send_document(self, download: DocumentDownload) -> None:
+        raise ValueError("Documents can not be downloaded through a gateway, please use your own connection")
+
+    def chat_message_queued(self) -> None:
+        self.parent.chat_message_queued()
+
+    def chat_message_fanned_out(self) -> None:
+        self.parent.chat_message_fanned_out()
+
+
+def _parse_peer(peer: str) -> tuple[str, int]:
+    host, _, port = peer.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"Peers are given as host:port, not {peer!r}")
+    return host, int(port)
 
 
 def main():
-    server = Server('0.0.0.0', 9000)
+    parser = argparse.ArgumentParser(description="Cins Apartment Management System server")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--block", help="name of the block of this server, required to link to other blocks")
+    parser.add_argument("--peer", action="append", default=[], type=_parse_peer,
+                        help="host:port of the server of another block to relay messages with, can be repeated")
+    parser.add_argument("--federation-secret", default=os.environ.get(FEDERATION_SECRET_VARIABLE),
+                        help="secret shared by the servers of every block, required with --block, defaults to the "
+                             f"{FEDERATION_SECRET_VARIABLE} environment variable")
+    parser.add_argument("--take-over", action="store_true",
+                        help="take the port and the connections over from the running server, for upgrades")
+    parser.add_argument("--handoff-path", default=HotRestart.DEFAULT_HANDOFF_PATH,
+                        help="Unix socket the running server waits for its successor on")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="record the traffic of every connection to PATH, see benchmarks/traffic_replay.py")
+    parser.add_argument("--entry-report-apartment", action="append", default=[], type=int, metavar="APARTMENT_NO",
+                        help="apartment whose residents can query the entry reports, e.g. the security desk, "
+                             "can be repeated")
+    args = parser.parse_args()
+    if args.peer and args.block is None:
+        parser.error("--peer requires --block")
+    if args.block is not None and not args.federation_secret:
+        parser.error("--block requires --federation-secret")
+    server = Server('0.0.0.0', args.port, event_logger=EventLogger(echo_to_console=True),
+                    handoff_path=args.handoff_path, take_over=args.take_over, block_name=args.block, peers=args.peer,
+                    federation_secret=args.federation_secret)
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> starts profiling the running server, the next one stops it and writes the reports
+        signal.signal(signal.SIGUSR1, lambda signum, frame: server.toggle_profiling())
+    if args.capture is not None:
+        server.start_capture(args.capture)
+    server.entry_log.allow_reports(args.entry_report_apartment)
     server.start()
 
 
@@ -1,5 +1,12 @@
+import logging
+import threading
+import time
+
+import AkinProtocol
 import custom_exceptions as ce
+from Announcement import DEFAULT_REPORT_TIMEOUT
 from Server import Server
+from TrafficCapture import DEFAULT_CAPTURE_PATH
 
 
 class ServerController:
@@ -8,7 +15,7 @@ class ServerController:
         self.port = port
         self.server = Server(self.host, self.port)
         self.server_running = False
-        self.logger = self.server.logging_queue
+        self.logger = self.server.event_logger.subscribe()
 
     def start_server(self) -> bool:
         """Starts the server. Returns True if the server is started successfully, otherwise raises an exception.
@@ -43,6 +50,137 @@ class ServerController:
         """Returns a list of all open connections."""
         return self.server.get_open_connections()
 
+    def send_direct_message(self, apartment_no: str, message: str) -> int:
+        """Sends a management notice to a single apartment. Returns the number of connections it was delivered to, 0 if
+        none of its residents are online and it waits in the inbox of the apartment.
+        Exceptions:
+            ServerNotRunningError: If the server is not running.
+            ApartmentNoShouldBeIntegerError: If the apartment number is not an integer.
+            ValueError: If the notice is larger than an inbox.
+        """
+        if not self.server_running:
+            raise ce.ServerNotRunningError("Server is not running.")
+        try:
+            apartment_no = int(apartment_no)
+        except ValueError as e:
+            raise ce.ApartmentNoShouldBeIntegerError("Apartment number is not an integer.") from e
+        return self.server.send_direct_message(apartment_no, message)
+
+    def get_inbox_sizes(self) -> dict:
+        """Returns the number of messages waiting for the apartments whose residents are offline."""
+        return self.server.inbox_store.get_sizes()
+
+    def send_announcement(self, message: str, on_report, report_timeout: float = DEFAULT_REPORT_TIMEOUT) -> None:
+        """Sends an urgent announcement to every connection ahead of their queued chat messages and returns right away.
+        on_report is called from another thread with the counts of the deliveries and the time to the last delivery in
+        milliseconds, once every connection is written to or after the report timeout.
+        Exceptions:
+            ServerNotRunningError: If the server is not running.
+            ValueError: If the message is empty or contains the protocol delimiter.
+        """
+        if not self.server_running:
+            raise ce.ServerNotRunningError("Server is not running.")
+        if not message.strip():
+            raise ValueError("Announcement can not be empty.")
+        if AkinProtocol.DELIMITER in message:
+            raise ValueError("Announcement can not contain the protocol delimiter.")
+        announcement = self.server.broadcast_announcement(message)
+        threading.Thread(target=self.__report_announcement, args=(announcement, on_report, report_timeout),
+                         name="AnnouncementReport", daemon=True).start()
+
+    @staticmethod
+    def __report_announcement(announcement, on_report, report_timeout: float) -> None:
+        announcement.wait(report_timeout)
+        on_report(announcement.get_report())
+
+    def publish_document(self, path: str) -> str:
+        """Publishes the file for the residents to download, a document with the same name is replaced. Returns the
+        name of the document.
+        Exceptions:
+            ServerNotRunningError: If the server is not running.
+            ValueError: If the file name can not be used for a document.
+            OSError: If the file can not be read.
+        """
+        if not self.server_running:
+            raise ce.ServerNotRunningError("Server is not running.")
+        return self.server.publish_document(path)
+
+    def get_entry_report(self, report: str, days: str = "7") -> list:
+        """Returns a report of the card entries of the last days: the number of entries in every hour of the day
+        ("hours"), the (apartment no, entries) of every apartment ("apartments"), or the (kind, subject, count) of the
+        busy apartments, the entries at night and the bursts of a single card ("anomalies").
+        Exceptions:
+            ValueError: If the report is unknown or the days are not a positive number.
+            OSError: If the entry log can not be read.
+        """
+        try:
+            days = float(days)
+        except ValueError as e:
+            raise ValueError("Days should be a number.") from e
+        if days <= 0:
+            raise ValueError("Days should be positive.")
+        end = time.time()
+        start = end - days * 24 * 60 * 60
+        if report == "hours":
+            return self.server.entry_log.get_entries_per_hour(start, end)
+        if report == "apartments":
+            return list(self.server.entry_log.get_entries_per_apartment(start, end).items())
+        if report == "anomalies":
+            return self.server.entry_log.get_anomalies(start, end)
+        raise ValueError(f"Unknown entry report: {report}")
+
+    def allow_entry_reports(self, apartment_nos: list) -> None:
+        """Allows only the residents of the given apartments, e.g. the security desk, to query the entry reports."""
+        self.server.entry_log.allow_reports(apartment_nos)
+
+    def get_federation_links(self) -> dict:
+        """Returns the blocks this server is linked to and the number of messages relayed to each of them."""
+        return self.server.get_federation_links()
+
+    def restrict_channel(self, channel: str, apartment_nos: list) -> None:
+        """Allows only the given apartments to join a channel, e.g. the board of the building."""
+        self.server.channel_manager.restrict_channel(channel, apartment_nos)
+
+    def get_channel_sizes(self) -> dict:
+        """Returns the number of subscribers of every channel."""
+        return self.server.channel_manager.get_channel_sizes()
+
+    def search_chat_history(self, query: str, page: str = "1") -> tuple[int, list]:
+        """Searches every channel for the messages that contain all words of the query.
+        Returns the number of matches and one page of (sequence no, channel, message), newest first.
+        Exceptions:
+            ValueError: If the query has no words or the page is not a positive integer.
+        """
+        try:
+            page = int(page)
+        except ValueError as e:
+            raise ValueError("Page should be an integer.") from e
+        return self.server.search_index.search(query, page)
+
+    def change_rate_limits(self, connection_rate: str, connection_burst: str, apartment_rate: str,
+                           apartment_burst: str) -> None:
+        """Changes the chat rate limits, rates are in messages per second and bursts are in messages."""
+        try:
+            connection_rate, apartment_rate = float(connection_rate), float(apartment_rate)
+            connection_burst, apartment_burst = int(connection_burst), int(apartment_burst)
+        except ValueError as e:
+            raise ValueError("Rates should be numbers and bursts should be integers.") from e
+        if min(connection_rate, apartment_rate) <= 0 or min(connection_burst, apartment_burst) < 1:
+            raise ValueError("Rates should be positive and bursts should be at least 1 message.")
+        self.server.rate_limiter.change_limits(connection_rate, connection_burst, apartment_rate, apartment_burst)
+
+    def change_heartbeat(self, ping_interval: str, idle_timeout: str) -> None:
+        """Changes after how many seconds idle connections are pinged and after how many seconds they are closed."""
+        try:
+            ping_interval, idle_timeout = int(ping_interval), int(idle_timeout)
+        except ValueError as e:
+            raise ValueError("Ping interval and idle timeout should be integers.") from e
+        if ping_interval < 1:
+            raise ValueError("Ping interval cannot be less than 1 second.")
+        if idle_timeout <= ping_interval:
+            raise ValueError("Idle timeout should be longer than the ping interval.")
+        self.server.change_heartbeat(ping_interval, idle_timeout)
+
     def change_update_rate(self, update_rate: str) -> None:
         """Changes the update rate of the server."""
         # Only allow ints as update rate.
@@ -55,3 +193,60 @@ class ServerController:
         if update_rate < 10:
             raise ValueError("Update rate cannot be less than 10 seconds.")
         self.server.change_update_rate(update_rate)
+
+    def change_log_level(self, level: str) -> None:
+        """Changes the minimum level of the server event log, e.g. 'DEBUG', 'INFO', 'WARNING'."""
+        level_no = logging.getLevelName(str(level).upper())
+        if not isinstance(level_no, int):
+            raise ValueError(f"Unknown log level: {level}")
+        self.server.event_logger.set_level(level_no)
+
+    def start_profiling(self, sample_interval_ms: str, trace_memory: bool = False) -> None:
+        """Starts sampling the CPU of every thread and timing every request handler, and tracing memory if asked.
+        Exceptions:
+            ServerNotRunningError: If the server is not running.
+            ValueError: If the sample interval is not a number or too short, or the profiler is already running.
+        """
+        if not self.server_running:
+            raise ce.ServerNotRunningError("Server is not running.")
+        try:
+            sample_interval = float(sample_interval_ms) / 1000
+        except ValueError as e:
+            raise ValueError("Sample interval should be a number of milliseconds.") from e
+        self.server.start_profiling(sample_interval, trace_memory)
+
+    def stop_profiling(self) -> str:
+        """Stops profiling. Returns the directory the reports were written to.
+        Exceptions:
+            ValueError: If the profiler is not running.
+        """
+        return self.server.stop_profiling()
+
+    def take_memory_snapshot(self) -> str:
+        """Writes the lines that allocated the most memory. Returns the path of the report.
+        Exceptions:
+            ValueError: If the profiler is not tracing memory.
+        """
+        return self.server.profiler.take_memory_snapshot()
+
+    def is_profiling(self) -> bool:
+        return self.server.profiler.enabled
+
+    def start_capture(self, path: str = DEFAULT_CAPTURE_PATH) -> None:
+        """Records the traffic of every connection, it can be replayed against a test server with
+        benchmarks/traffic_replay.py.
+        Exceptions:
+            ServerNotRunningError: If the server is not running.
+            ValueError: If the traffic is already being captured.
+            OSError: If the capture file can not be created.
+        """
+        if not self.server_running:
+            raise ce.ServerNotRunningError("Server is not running.")
+        self.server.start_capture(path)
+
+    def stop_capture(self) -> dict:
+        """Stops the capture. Returns the path of the file and the number of records and bytes it holds.
+        Exceptions:
+            ValueError: If the traffic is not being captured.
+        """
+        return self.server.stop_capture()
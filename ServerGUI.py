@@ -1,4 +1,4 @@
-import multiprocessing
+import queue
 import sys
 import threading
 import time
@@ -50,6 +50,50 @@ class ServerGUI:
                                                 on_blur=self.__on_change_update_rate,
                                                 keyboard_type=ft.KeyboardType.NUMBER)
 
+        ### Announcements ###
+
+        self.announcement_textbox = ft.TextField(label="Announcement to every resident",
+                                                 width=400,
+                                                 on_submit=self.__on_click_announce_button)
+
+        self.announce_button = ft.ElevatedButton(text="Announce",
+                                                 on_click=self.__on_click_announce_button)
+
+        ### Documents ###
+
+        self.document_path_textbox = ft.TextField(label="Path of the document to publish",
+                                                  width=400,
+                                                  on_submit=self.__on_click_publish_button)
+
+        self.publish_button = ft.ElevatedButton(text="Publish Document",
+                                                on_click=self.__on_click_publish_button)
+
+        ### Entry Reports ###
+
+        self.entry_days_textbox = ft.TextField(label="Entry Report Period (in days)",
+                                               value="7",
+                                               width=200,
+                                               keyboard_type=ft.KeyboardType.NUMBER)
+
+        self.entry_report_button = ft.ElevatedButton(text="Entry Report",
+                                                     on_click=self.__on_click_entry_report_button)
+
+        ### Profiling Controls ###
+
+        self.profile_interval_textbox = ft.TextField(label="Profiler Sample Interval (in ms)",
+                                                     value="10",
+                                                     width=200,
+                                                     keyboard_type=ft.KeyboardType.NUMBER)
+
+        self.trace_memory_checkbox = ft.Checkbox(label="Trace Memory", value=False)
+
+        self.profile_button = ft.ElevatedButton(text="Start Profiling",
+                                                on_click=self.__on_click_profile_button)
+
+        self.memory_snapshot_button = ft.ElevatedButton(text="Memory Snapshot",
+                                                        on_click=self.__on_click_memory_snapshot_button,
+                                                        disabled=True)
+
         self.msg_list = ft.ListView(expand=1, spacing=10, padding=20, auto_scroll=True)
 
         self.host_textbox = ft.TextField(label="Host", value=str(self.host), width=200)
@@ -114,6 +158,73 @@ class ServerGUI:
         except Exception as e:
             Utility.create_snackbar(self.page, str(e))
 
+    def __on_click_announce_button(self, _) -> None:
+        """Sends the announcement ahead of the chat messages, how many connections it reached is shown later."""
+        logger.debug("On Click: Announce Button")
+        try:
+            self.controller.send_announcement(self.announcement_textbox.value, self.__show_announcement_report)
+        except (ce.ServerNotRunningError, ValueError) as e:
+            Utility.create_snackbar(self.page, str(e))
+            return
+        self.announcement_textbox.value = ""
+        self.page.update()
+
+    def __show_announcement_report(self, report: dict) -> None:
+        self.update_msg_list(f"Announcement delivered to {report['delivered']}/{report['total']} connections "
+                             f"in {report['time_to_last_delivery_ms']} ms ({report['failed']} failed, "
+                             f"{report['pending']} pending).")
+
+    def __on_click_publish_button(self, _) -> None:
+        """Copies the document into the store of the server, the residents can download it from then on."""
+        logger.debug("On Click: Publish Button")
+        try:
+            name = self.controller.publish_document(self.document_path_textbox.value)
+        except (ce.ServerNotRunningError, ValueError, OSError) as e:
+            Utility.create_snackbar(self.page, str(e))
+            return
+        self.document_path_textbox.value = ""
+        self.update_msg_list(f"Document {name} is published.")
+
+    def __on_click_entry_report_button(self, _) -> None:
+        """Shows the busiest hours and apartments and the anomalies of the card entries of the last days."""
+        logger.debug("On Click: Entry Report Button")
+        days = self.entry_days_textbox.value
+        try:
+            hours = self.controller.get_entry_report("hours", days)
+            apartments = self.controller.get_entry_report("apartments", days)
+            anomalies = self.controller.get_entry_report("anomalies", days)
+        except (ValueError, OSError) as e:
+            Utility.create_snackbar(self.page, str(e))
+            return
+        busiest_hours = sorted(range(24), key=lambda hour: hours[hour], reverse=True)[:3]
+        self.update_msg_list(f"{sum(hours)} entries in the last {days} days, busiest hours: "
+                             + ", ".join(f"{hour:02}:00 ({hours[hour]})" for hour in busiest_hours if hours[hour]))
+        self.update_msg_list("Busiest apartments: "
+                             + ", ".join(f"{apartment_no} ({count})" for apartment_no, count in apartments[:5]))
+        for kind, subject, count in anomalies:
+            self.update_msg_list(f"Entry anomaly ({kind}): {subject}, {count} entries")
+
+    def __on_click_profile_button(self, _) -> None:
+        """Starts profiling the server, or stops it and shows where the reports were written."""
+        logger.debug("On Click: Profile Button")
+        try:
+            if self.controller.is_profiling():
+                report_dir = self.controller.stop_profiling()
+                self.update_msg_list(f"Profiling reports were written to {report_dir}")
+            else:
+                self.controller.start_profiling(self.profile_interval_textbox.value, self.trace_memory_checkbox.value)
+                self.update_msg_list("Profiling started.")
+        except (ce.ServerNotRunningError, ValueError) as e:
+            Utility.create_snackbar(self.page, str(e))
+        self.__change_profiling_controls(profiling=self.controller.is_profiling())
+
+    def __on_click_memory_snapshot_button(self, _) -> None:
+        logger.debug("On Click: Memory Snapshot Button")
+        try:
+            self.update_msg_list(f"Memory snapshot was written to {self.controller.take_memory_snapshot()}")
+        except ValueError as e:
+            Utility.create_snackbar(self.page, str(e))
+
     # --------------- #
     # --- Threads --- #
     # --------------- #
@@ -135,12 +246,13 @@ class ServerGUI:
 
     def __listen_for_messages_from_server_and_update_message_box(self) -> None:
         """Listens for messages from the server and updates the GUI message box."""
-        server_logs: multiprocessing.Queue = self.controller.logger
+        server_logs: queue.Queue = self.controller.logger
         while self.running_flag:
-            if self.controller.server_running and not server_logs.empty():
-                msg = server_logs.get()
-                self.update_msg_list(msg)
-            time.sleep(0.1)
+            try:
+                msg = server_logs.get(timeout=1)  # Wakes up to check the running flag
+            except queue.Empty:
+                continue
+            self.update_msg_list(msg)
 
     # ---------------------- #
     # --- Helper Methods --- #
@@ -194,6 +306,13 @@ class ServerGUI:
             self.server_status_online_text.color = ft.colors.RED
         self.page.update()
 
+    def __change_profiling_controls(self, profiling: bool) -> None:
+        self.profile_button.text = "Stop Profiling" if profiling else "Start Profiling"
+        self.profile_interval_textbox.disabled = profiling
+        self.trace_memory_checkbox.disabled = profiling
+        self.memory_snapshot_button.disabled = not (profiling and self.trace_memory_checkbox.value)
+        self.page.update()
+
     def __change_fetch_frequency(self, _) -> None:
         self.controller.fetch_frequency = int(self.update_rate_textbox.value)
         # todo
@@ -231,6 +350,15 @@ class ServerGUI:
             self.server_status_text,
             self.server_status_online_text,
         ], wrap=False))
+        self.page.add(Row(controls=[self.announcement_textbox, self.announce_button], wrap=False))
+        self.page.add(Row(controls=[self.document_path_textbox, self.publish_button], wrap=False))
+        self.page.add(Row(controls=[self.entry_days_textbox, self.entry_report_button], wrap=False))
+        self.page.add(Row(controls=[
+            self.profile_interval_textbox,
+            self.trace_memory_checkbox,
+            self.profile_button,
+            self.memory_snapshot_button,
+        ], wrap=False))
 
     def __draw_open_connections(self) -> None:
         connections_col1 = Column(controls=[self.open_connections_length_text,
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import collections
+import itertools
+import secrets
+import threading
+import time
+
+from ClientCard import ClientCard
+
+DEFAULT_SESSION_TTL = 60 * 60  # A detached session can be resumed for X seconds
+DEFAULT_HISTORY_LENGTH = 1000  # Channel messages kept for replay
+
+
+class Session:
+    """What a client needs to get back after reconnecting: its card and its channel subscriptions."""
+    __slots__ = ('token', 'card', 'channels', 'connection_id', 'detached_at')
+
+    def __init__(self, token: str, card: ClientCard, connection_id: int):
+        self.token = token
+        self.card = card  # The same card object as the connection's, a resumed connection takes it over
+        self.channels: set[str] = set()
+        self.connection_id = connection_id  # The connection the session is attached to
+        self.detached_at: float | None = None
+
+
+class SessionStore:
+    """Resumable sessions indexed by their token. Detached sessions expire after the TTL."""
+
+    def __init__(self, ttl: float = DEFAULT_SESSION_TTL):
+        self.ttl = ttl
+        self.sessions: dict[str, Session] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def create(self, card: ClientCard, connection_id: int) -> Session:
+        session = Session(secrets.token_urlsafe(16), card, connection_id)
+        with self.lock:
+            self.sessions[session.token] = session
+        self.remove_expired()
+        return session
+
+    def resume(self, token: str, connection_id: int) -> Session | None:
+        """Attaches the session of the token to the connection, returns None if there is no such live session."""
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None or self.__is_expired(session, time.monotonic()):
+                self.sessions.pop(token, None)
+                return None
+            session.connection_id = connection_id
+            session.detached_at = None
+            return session
+
+    def detach(self, session: Session, connection_id: int) -> None:
+        """Called when a connection is closed, starts the TTL unless the session was already resumed elsewhere."""
+        with self.lock:
+            if session.connection_id == connection_id:
+                session.detached_at = time.monotonic()
+
+    def remove(self, session: Session) -> None:
+        with self.lock:
+            self.sessions.pop(session.token, None)
+
+    def remove_expired(self) -> int:
+        now = time.monotonic()
+        with self.lock:
+            expired = [token for token, session in self.sessions.items() if self.__is_expired(session, now)]
+            for token in expired:
+                del self.sessions[token]
+        return len(expired)
+
+    def export_state(self) -> list[dict]:
+        """Returns the sessions as plain data, so that a new server process can take them over"""
+        now = time.monotonic()
+        with self.lock:
+            return [{'token': session.token, 'name': session.card.name, 'apartment_no': session.card.apartment_no,
+                     'channels': sorted(session.channels), 'connection_id': session.connection_id,
+                     'detached_for': None if session.detached_at is None else now - session.detached_at}
+                    for session in self.sessions.values()]
+
+    def import_state(self, state: list[dict]) -> None:
+        now = time.monotonic()
+        with self.lock:
+            for entry in state:
+                session = Session(entry['token'], ClientCard(entry['name'], entry['apartment_no']),
+                                  entry['connection_id'])
+                session.channels.update(entry['channels'])
+                if entry['detached_for'] is not None:
+                    session.detached_at = now - entry['detached_for']
+                self.sessions[session.token] = session
+
+    def get(self, token: str) -> Session | None:
+        return self.sessions.get(token)
+
+    def __is_expired(self, session: Session, now: float) -> bool:
+        return session.detached_at is not None and now - session.detached_at > self.ttl
+
+
+class MessageHistory:
+    """Assigns increasing sequence numbers to channel messages and keeps the last ones for replay.
+    Only the group chat updater thread appends, so the sequence numbers follow the delivery order.
+    The lock is reentrant: holding it while appending and picking the subscribers, and while subscribing and
+    replaying, makes sure a resumed client gets every message exactly once."""
+
+    def __init__(self, max_length: int = DEFAULT_HISTORY_LENGTH):
+        self.messages: collections.deque[tuple[int, str, str]] = collections.deque(maxlen=max_length)
+        self.last_sequence_no = 0
+        self.lock = threading.RLock()
+
+    def append(self, channel: str, message: str) -> int:
+        with self.lock:
+            self.last_sequence_no += 1
+            self.messages.append((self.last_sequence_no, channel, message))
+            return self.last_sequence_no
+
+    def get_messages_after(self, sequence_no: int, channels: set[str]) -> list[tuple[int, str, str]]:
+        """Returns the kept messages of the given channels whose sequence number is greater than sequence_no"""
+        with self.lock:
+            if not self.messages or self.messages[-1][0] <= sequence_no:
+                return []
+            # Sequence numbers are contiguous, so the first message to replay can be found without scanning.
+            start = max(0, sequence_no - self.messages[0][0] + 1)
+            return [entry for entry in itertools.islice(self.messages, start, None) if entry[1] in channels]
+
+    def export_state(self) -> dict:
+        with self.lock:
+            return {'last_sequence_no': self.last_sequence_no, 'messages': list(self.messages)}
+
+    def import_state(self, state: dict) -> None:
+        """Continues the sequence numbers of the previous server process, resumed clients rely on them"""
+        with self.lock:
+            self.last_sequence_no = state['last_sequence_no']
+            self.messages.clear()
+            self.messages.extend(tuple(entry) for entry in state['messages'])
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import concurrent.futures
+import threading
+import time
+
+import custom_exceptions as ce
+
+DEFAULT_DEADLINE = 10.0  # seconds, a refresh gives up on every source after X seconds
+REQUEST_TIMEOUT = 10  # seconds, a stalled upstream must not keep the worker thread of a source forever
+DEFAULT_HEDGE_DELAY = 2.0  # seconds, the next source is asked too if the previous one did not answer in X seconds
+DEFAULT_FAILURE_THRESHOLD = 3  # consecutive failures or timeouts that open the circuit of a source
+DEFAULT_RESET_TIMEOUT = 300.0  # seconds an open circuit waits before a single trial request is let through
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Stops asking a source that keeps failing: after failure_threshold consecutive failures the circuit opens, and
+    after reset_timeout seconds a single trial request decides whether it closes again."""
+    __slots__ = ('failure_threshold', 'reset_timeout', 'state', 'failures', 'opened_at', 'lock')
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # Only this request is let through until its result is recorded, or until reset_timeout passes again
+                # if the result never comes.
+                self.state = HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class DataSource:
+    """A named fetch function with its own circuit breaker, the function returns the data in the server's format"""
+    __slots__ = ('name', 'fetch', 'breaker')
+
+    def __init__(self, name: str, fetch, breaker: CircuitBreaker | None = None):
+        self.name = name
+        self.fetch = fetch
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+
+class SourceSelector:
+    """Fetches the same data from several sources in the order of preference and uses the first answer.
+
+    The first source whose circuit is closed is asked first, the next one is asked as well when the previous one fails
+    or does not answer within hedge_delay, and the whole refresh gives up after deadline seconds. A source that did
+    not answer before the deadline counts as a failure even if it answers later, so a source that is always slow
+    trips its breaker like a source that is always down."""
+
+    def __init__(self, sources: list[DataSource], deadline: float = DEFAULT_DEADLINE,
+                 hedge_delay: float = DEFAULT_HEDGE_DELAY):
+        self.sources = sources
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        # A request that outlives the deadline keeps its worker until it returns, so there is a worker per source
+        # for the request of the next refresh.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * len(sources),
+                                                              thread_name_prefix="source-selector")
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def fetch(self) -> tuple[str, object]:
+        """Returns the name of the source that answered first and its data
+
+        Exceptions:
+            DataSourceUnavailableError: No source answered before the deadline or every circuit is open
+        """
+        candidates = [source for source in self.sources if source.breaker.allow_request()]
+        if not candidates:
+            raise ce.DataSourceUnavailableError("The circuit of every source is open")
+
+        deadline = time.monotonic() + self.deadline
+        pending: dict[concurrent.futures.Future, DataSource] = {}
+        errors = []
+        next_candidate = 0
+        while True:
+            if next_candidate < len(candidates):
+                source = candidates[next_candidate]
+                pending[self.executor.submit(source.fetch)] = source
+                next_candidate += 1
+                next_hedge_at = time.monotonic() + self.hedge_delay
+            else:
+                next_hedge_at = deadline
+            if not pending:
+                break
+
+            timeout = max(0.0, min(next_hedge_at, deadline) - time.monotonic())
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                try:
+                    data = future.result()
+                except Exception as e:
+                    source.breaker.record_failure()
+                    errors.append(f"{source.name}: {e!r}")
+                    continue
+                source.breaker.record_success()
+                for late_future, late_source in pending.items():
+                    late_future.add_done_callback(self.__late_answer_recorder(late_source, deadline))
+                return source.name, data
+            if time.monotonic() >= deadline:
+                break
+
+        for future, source in pending.items():
+            future.cancel()  # A request that is already running cannot be interrupted, its answer is ignored
+            source.breaker.record_failure()
+            errors.append(f"{source.name}: no answer in {self.deadline}s")
+        raise ce.DataSourceUnavailableError("; ".join(errors))
+
+    def get_states(self) -> dict[str, str]:
+        return {source.name: source.breaker.state for source in self.sources}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    @staticmethod
+    def __late_answer_recorder(source: DataSource, deadline: float):
+        """A hedged request that lost the race still counts for its own breaker once it answers"""
+        def record(future: concurrent.futures.Future) -> None:
+            if future.cancelled():
+                return
+            if future.exception() is None and time.monotonic() <= deadline:
+                source.breaker.record_success()
+            else:
+                source.breaker.record_failure()
+        return record
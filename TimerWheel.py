@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import Hashable
+
+DEFAULT_TICK = 1.0  # seconds
+DEFAULT_SLOTS = 512
+
+
+class TimerWheel:
+    """A hashed timer wheel: scheduling, rescheduling and cancelling an item are O(1), and advancing the wheel only
+    looks at the slots whose tick has passed, so expiring thousands of items costs one set swap per tick.
+    Deadlines further away than the wheel can hold are parked in the farthest slot; the owner is expected to check
+    the real deadline of an expired item and schedule it again if it is not due yet."""
+
+    def __init__(self, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS):
+        self.tick = tick
+        self.slots: list[set] = [set() for _ in range(slots)]
+        self.slot_of_item: dict[Hashable, int] = {}
+        self.current_tick = self.__to_tick(time.monotonic())
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.slot_of_item)
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def schedule(self, item: Hashable, deadline: float) -> None:
+        """Schedules (or reschedules) the item to expire at the given time.monotonic() deadline."""
+        deadline_tick = math.ceil(deadline / self.tick)
+        with self.lock:
+            deadline_tick = max(deadline_tick, self.current_tick + 1)
+            deadline_tick = min(deadline_tick, self.current_tick + len(self.slots) - 1)
+            slot_index = deadline_tick % len(self.slots)
+            old_slot_index = self.slot_of_item.get(item)
+            if old_slot_index is not None:
+                self.slots[old_slot_index].discard(item)
+            self.slots[slot_index].add(item)
+            self.slot_of_item[item] = slot_index
+
+    def cancel(self, item: Hashable) -> None:
+        with self.lock:
+            slot_index = self.slot_of_item.pop(item, None)
+            if slot_index is not None:
+                self.slots[slot_index].discard(item)
+
+    def advance(self, now: float | None = None) -> list:
+        """Moves the wheel up to the given time and returns every item whose slot has expired."""
+        target_tick = self.__to_tick(time.monotonic() if now is None else now)
+        expired = []
+        with self.lock:
+            ticks_to_process = min(target_tick - self.current_tick, len(self.slots))
+            for _ in range(ticks_to_process):
+                self.current_tick += 1
+                slot_index = self.current_tick % len(self.slots)
+                slot = self.slots[slot_index]
+                if slot:
+                    self.slots[slot_index] = set()
+                    for item in slot:
+                        del self.slot_of_item[item]
+                    expired.extend(slot)
+            self.current_tick = max(self.current_tick, target_tick)
+        return expired
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __to_tick(self, timestamp: float) -> int:
+        return int(timestamp // self.tick)
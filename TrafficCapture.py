@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import gzip
+import queue
+import struct
+import threading
+import time
+
+DEFAULT_CAPTURE_PATH = "cins_traffic.cap"
+CAPTURE_MAGIC = b"CINSCAP1"
+COMPRESS_LEVEL = 6
+
+### Record Kinds ###
+OPEN = 0  # A client connected, the payload is empty
+DATA = 1  # The bytes of one read of the connection
+CLOSE = 2  # The connection was closed, the payload is empty
+
+# Microseconds since the capture started, connection id, kind, payload length
+_RECORD_HEADER = struct.Struct("!QIBI")
+
+
+class TrafficRecorder:
+    """Records every read of every connection, with its time and its connection id, into a gzip compressed file.
+
+    The reading thread of a connection only puts the bytes on an in-memory queue, the records are packed, compressed
+    and written on a background thread. The capture holds the chat messages and the cards of the residents as they
+    were sent, it should be handled like the event log."""
+
+    def __init__(self, path: str = DEFAULT_CAPTURE_PATH):
+        self.path = path
+        self.file = gzip.open(path, "wb", compresslevel=COMPRESS_LEVEL)
+        self.file.write(CAPTURE_MAGIC)
+        self.started_at = time.perf_counter()
+        self.record_queue: queue.SimpleQueue[tuple[int, int, int, bytes] | None] = queue.SimpleQueue()
+        self.records = 0
+        self.payload_bytes = 0
+        self.recording = True
+        self.writer_thread = threading.Thread(target=self.__write_records, name="TrafficRecorder", daemon=True)
+        self.writer_thread.start()
+
+    ### -------------- ###
+    ### Public Methods ###
+    ### -------------- ###
+
+    def record(self, connection_id: int, kind: int, payload: bytes = b"") -> None:
+        """Can be called from any thread, the records of a stopped capture are dropped"""
+        if self.recording:
+            self.record_queue.put((int((time.perf_counter() - self.started_at) * 1e6), connection_id, kind, payload))
+
+    def stop(self) -> dict:
+        """Writes the queued records, closes the file and returns the number of records and bytes it holds"""
+        self.recording = False
+        self.record_queue.put(None)
+        self.writer_thread.join()
+        return {'path': self.path, 'records': self.records, 'payload_bytes': self.payload_bytes,
+                'duration': round(time.perf_counter() - self.started_at, 3)}
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __write_records(self) -> None:
+        while (record := self.record_queue.get()) is not None:
+            timestamp, connection_id, kind, payload = record
+            self.file.write(_RECORD_HEADER.pack(timestamp, connection_id, kind, len(payload)) + payload)
+            self.records += 1
+            self.payload_bytes += len(payload)
+        self.file.close()
+
+
+def read_capture(path: str):
+    """Yields the (seconds since the capture started, connection id, kind, payload) of every record, in the order
+    they were recorded. A capture cut short by a crash ends at its last complete record.
+
+    Exceptions:
+        ValueError: If the file is not a traffic capture
+    """
+    with gzip.open(path, "rb") as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a traffic capture")
+        while True:
+            try:
+                header = capture.read(_RECORD_HEADER.size)
+            except EOFError:
+                return  # The compressed stream was not closed
+            if len(header) < _RECORD_HEADER.size:
+                return
+            timestamp, connection_id, kind, length = _RECORD_HEADER.unpack(header)
+            try:
+                payload = capture.read(length)
+            except EOFError:
+                return
+            if len(payload) < length:
+                return
+            yield timestamp / 1e6, connection_id, kind, payload
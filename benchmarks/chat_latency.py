@@ -0,0 +1,106 @@
+"""Measures how long a chat message waits between two threads of the server, and optionally end to end.
+
+The handoff benchmark compares the old group chat updater, a multiprocessing.Queue polled with empty() and
+sleep(0.1), with the blocking queue.SimpleQueue it uses now. Every message is put by one thread and taken by another,
+the latency is the time between the two.
+
+With --port, it also registers two residents on a running server and measures the time from sending a chat message
+to receiving it on the other resident:
+
+    python benchmarks/chat_latency.py --messages 200 --port 8080
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+from ClientCard import ClientCard  # noqa: E402
+
+
+def polled_consumer(message_queue, count: int, latencies: list) -> None:
+    """The group chat updater before: checks the queue ten times per second"""
+    while len(latencies) < count:
+        if not message_queue.empty():
+            sent_at = message_queue.get()
+            latencies.append(time.perf_counter() - sent_at)
+        time.sleep(0.1)
+
+
+def blocking_consumer(message_queue, count: int, latencies: list) -> None:
+    """The group chat updater now: blocks until a message is queued"""
+    while len(latencies) < count:
+        sent_at = message_queue.get()
+        latencies.append(time.perf_counter() - sent_at)
+
+
+def measure_handoff(message_queue, consumer, count: int, interval: float) -> list:
+    latencies = []
+    consumer_thread = threading.Thread(target=consumer, args=(message_queue, count, latencies), daemon=True)
+    consumer_thread.start()
+    for _ in range(count):
+        message_queue.put(time.perf_counter())
+        time.sleep(interval)
+    consumer_thread.join()
+    return latencies
+
+
+def measure_end_to_end(host: str, port: int, count: int, interval: float) -> list:
+    sender = socket.create_connection((host, port))
+    receiver = socket.create_connection((host, port))
+    for i, resident in enumerate((sender, receiver)):
+        resident.recv(1024)  # Welcome message
+        card = ClientCard(f"Bench {i}", 1000 + i)
+        resident.sendall(AkinProtocol.construct_connection_frame(AkinProtocol.register_client_to_server(card)).encode())
+        resident.recv(1024)
+        subscribe_request = AkinProtocol.construct_subscribe_request(AkinProtocol.DEFAULT_CHANNEL)
+        resident.sendall(AkinProtocol.construct_connection_frame(subscribe_request).encode())
+        resident.recv(1024)
+
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        probe = AkinProtocol.construct_chat_message(f"latency probe {i}", AkinProtocol.DEFAULT_CHANNEL)
+        sender.sendall(AkinProtocol.construct_connection_frame(probe).encode())
+        while f"latency probe {i}".encode() not in receiver.recv(4096):
+            pass
+        latencies.append(time.perf_counter() - started)
+        sender.recv(4096)  # OK and the sender's own copy of the message
+        time.sleep(interval)  # Stays under the chat rate limit
+    sender.close()
+    receiver.close()
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<40} median {statistics.median(latencies) * 1e3:8.3f} ms   p99 {p99 * 1e3:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between two messages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="port of a running server for the end to end benchmark")
+    args = parser.parse_args()
+
+    report("multiprocessing.Queue, empty() + sleep", measure_handoff(multiprocessing.Queue(), polled_consumer,
+                                                                     args.messages, args.interval))
+    report("queue.SimpleQueue, blocking get", measure_handoff(queue.SimpleQueue(), blocking_consumer,
+                                                              args.messages, args.interval))
+    if args.port is not None:
+        report(f"end to end on {args.host}:{args.port}", measure_end_to_end(args.host, args.port, args.messages,
+                                                                            max(args.interval, 0.5)))
+
+
+if __name__ == '__main__':
+    main()
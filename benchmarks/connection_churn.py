@@ -0,0 +1,197 @@
+"""Soak test: churns connections against a local server and fails if its threads, file descriptors, memory or
+registries keep growing.
+
+Every worker connects, does one of the things a real client does before it leaves (registers and chats, leaves
+right after the welcome, resets the connection while the server writes to it, leaves in the middle of a request) and
+starts over. The resources of the process are sampled every --sample-interval seconds.
+
+A leak is a resource that does not come back: after the churn stops and the server has had --settle seconds to
+reap the connections, the threads, file descriptors and every registry must be back at their level from before the
+churn. The resident set can not shrink back, it fails if it keeps growing over the second half of the run. The chat
+messages of the churn fill the search index up to its bound, which is lowered so that it fills in the first seconds.
+
+    python benchmarks/connection_churn.py --duration 3600 --workers 32
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import random
+import resource
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+from ClientCard import ClientCard  # noqa: E402
+from EventLogger import EventLogger  # noqa: E402
+from Server import Server  # noqa: E402
+
+METRICS = ("threads", "fds", "rss_mb", "connections", "registry", "subscribers", "timers", "sessions", "indexed")
+BASELINE_METRICS = ("threads", "fds", "connections", "registry", "subscribers", "timers", "sessions")
+THREAD_TOLERANCE = 2  # Helper threads the server starts on demand, e.g. a profiler or an idle writer
+FD_TOLERANCE = 4
+
+
+def get_rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def sample(server: Server) -> dict:
+    return {'threads': threading.active_count(),
+            'fds': len(os.listdir("/proc/self/fd")),
+            'rss_mb': round(get_rss_bytes() / 2 ** 20, 1),
+            'connections': len(server.open_connection_threads),
+            'registry': len(server.resident_registry),
+            'subscribers': sum(server.channel_manager.get_channel_sizes().values()),
+            'timers': len(server.idle_timer_wheel),
+            'sessions': len(server.session_store),
+            'indexed': len(server.search_index.messages)}
+
+
+class Churner(threading.Thread):
+    """Opens and closes connections in a loop until it is stopped"""
+
+    def __init__(self, worker_no: int, port: int, stop_event: threading.Event):
+        super().__init__(name=f"Churner-{worker_no}", daemon=True)
+        self.worker_no = worker_no
+        self.port = port
+        self.stop_event = stop_event
+        self.random = random.Random(worker_no)
+        self.connections = 0
+        self.errors = 0
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.__churn_once()
+            except OSError:
+                self.errors += 1
+            self.connections += 1
+
+    def __churn_once(self) -> None:
+        client = socket.create_connection(("127.0.0.1", self.port))
+        try:
+            client.settimeout(5)
+            client.recv(1024)  # Welcome message
+            behaviour = self.random.random()
+            if behaviour < 0.5:  # A resident who registers, chats and leaves
+                card = ClientCard(f"Churn {self.worker_no}", 1 + self.connections % 50)
+                for request in (AkinProtocol.register_client_to_server(card),
+                                AkinProtocol.construct_subscribe_request(AkinProtocol.DEFAULT_CHANNEL),
+                                AkinProtocol.construct_chat_message("churn")):
+                    client.sendall(AkinProtocol.construct_connection_frame(request).encode())
+                    client.recv(4096)
+            elif behaviour < 0.7:  # Leaves right after the welcome message
+                pass
+            elif behaviour < 0.9:  # Resets the connection while the server answers a request
+                client.sendall(AkinProtocol.construct_connection_frame(AkinProtocol.WEATHER_GET).encode())
+                client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            else:  # Leaves in the middle of a request
+                client.sendall(AkinProtocol.construct_connection_frame(AkinProtocol.REGISTER_USER).encode()[:8])
+        finally:
+            client.close()
+
+
+def register_once(port: int) -> None:
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.settimeout(5)
+        client.recv(1024)  # Welcome message
+        card = ClientCard("Warm up", 1)
+        client.sendall(AkinProtocol.construct_connection_frame(AkinProtocol.register_client_to_server(card)).encode())
+        client.recv(4096)
+
+
+def raise_open_file_limit(needed: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+
+def find_leaks(baseline: dict, samples: list[dict], settled: dict, rss_tolerance: float) -> list[str]:
+    leaks = []
+    for metric in BASELINE_METRICS:
+        tolerance = THREAD_TOLERANCE if metric == "threads" else FD_TOLERANCE if metric == "fds" else 0
+        if settled[metric] > baseline[metric] + tolerance:
+            leaks.append(f"{metric} did not come back: {baseline[metric]} before the churn, {settled[metric]} after")
+    second_half = [sample['rss_mb'] for sample in samples[len(samples) // 2:]]
+    if len(second_half) >= 4:
+        quarter = len(second_half) // 4
+        early = statistics.median(second_half[:quarter])
+        late = statistics.median(second_half[-quarter:])
+        if late > early * (1 + rss_tolerance):
+            leaks.append(f"rss_mb kept growing: {early} MB to {late} MB over the second half of the run")
+    return leaks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=60, help="seconds to churn connections for")
+    parser.add_argument("--workers", type=int, default=16, help="connections opened and closed at the same time")
+    parser.add_argument("--sample-interval", type=float, default=5)
+    parser.add_argument("--settle", type=float, default=5,
+                        help="seconds the server gets to reap the connections after the churn stops")
+    parser.add_argument("--session-ttl", type=float, default=2,
+                        help="seconds a detached session lives, so that the session store reaches a steady size")
+    parser.add_argument("--index-size", type=int, default=1000,
+                        help="chat messages the search index keeps, it grows up to this bound by design")
+    parser.add_argument("--rss-tolerance", type=float, default=0.1,
+                        help="growth of the resident set over the second half of the run that is not a leak")
+    args = parser.parse_args()
+    raise_open_file_limit(4 * args.workers + 256)
+
+    server = Server("127.0.0.1", 0, event_logger=EventLogger(log_file=None, level=logging.WARNING),
+                    discovery_port=None, handoff_path=None)
+    server.session_store.ttl = args.session_ttl
+    server.search_index.max_messages = args.index_size
+    server.start()
+    while not hasattr(server, 'server_socket'):
+        time.sleep(0.01)
+    time.sleep(1)  # The helper threads are started
+    port = server.server_socket.getsockname()[1]
+    register_once(port)  # The entry log opens its files for good on the first card, before the baseline
+    time.sleep(args.session_ttl + 1)
+    server.session_store.remove_expired()
+    baseline = sample(server)
+
+    stop_event = threading.Event()
+    churners = [Churner(worker_no, port, stop_event) for worker_no in range(args.workers)]
+    for churner in churners:
+        churner.start()
+    started = time.perf_counter()
+    samples = []
+    print(f"{'seconds':>8} {'churned':>9} " + " ".join(f"{metric:>11}" for metric in METRICS))
+    while (elapsed := time.perf_counter() - started) < args.duration:
+        time.sleep(min(args.sample_interval, args.duration - elapsed))
+        samples.append(sample(server))
+        churned = sum(churner.connections for churner in churners)
+        print(f"{time.perf_counter() - started:>8.1f} {churned:>9} "
+              + " ".join(f"{samples[-1][metric]:>11}" for metric in METRICS), flush=True)
+    stop_event.set()
+    for churner in churners:
+        churner.join()
+    time.sleep(args.settle + args.session_ttl)
+    server.session_store.remove_expired()
+    settled = sample(server)
+
+    churned = sum(churner.connections for churner in churners)
+    print(f"{churned} connections in {args.duration:.0f}s ({churned / args.duration:.0f}/s), "
+          f"{sum(churner.errors for churner in churners)} failed")
+    print("before  " + " ".join(f"{metric}={baseline[metric]}" for metric in METRICS))
+    print("settled " + " ".join(f"{metric}={settled[metric]}" for metric in METRICS))
+    leaks = find_leaks(baseline, samples, settled, args.rss_tolerance)
+    for leak in leaks:
+        print(f"LEAK: {leak}")
+    print("FAIL" if leaks else "PASS")
+    os._exit(1 if leaks else 0)  # The helper threads of the server are not daemons
+
+
+if __name__ == '__main__':
+    main()
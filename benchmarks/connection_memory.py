@@ -0,0 +1,94 @@
+"""Measures the memory that an idle, registered resident costs the server.
+
+Every resident gets a real ClientThread on one end of a socket pair, registers a card and subscribes to the general
+channel, then stays idle. The Python heap is measured with tracemalloc, the resident set size from /proc.
+
+    python benchmarks/connection_memory.py --connections 10000
+"""
+import argparse
+import logging
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+from ClientCard import ClientCard  # noqa: E402
+from EventLogger import EventLogger  # noqa: E402
+from Server import WRITER_IDLE_TIMEOUT, ClientThread, Server  # noqa: E402
+
+
+def get_rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def raise_open_file_limit(needed: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+
+def open_idle_residents(server: Server, count: int) -> list:
+    peers = []
+    for i in range(count):
+        server_end, client_end = socket.socketpair()
+        client_thread = ClientThread(next(server.connection_ids), server_end, f"bench-{i}", server.context)
+        client_thread.daemon = True
+        client_thread.start()
+        server.open_connection_threads.append(client_thread)
+        client_end.recv(1024)  # Welcome message
+        card = ClientCard(f"Resident {i}", i % 400)
+        register_request = AkinProtocol.register_client_to_server(card)
+        client_end.sendall(AkinProtocol.construct_connection_frame(register_request).encode())
+        client_end.recv(1024)
+        subscribe_request = AkinProtocol.construct_subscribe_request(AkinProtocol.DEFAULT_CHANNEL)
+        client_end.sendall(AkinProtocol.construct_connection_frame(subscribe_request).encode())
+        client_end.recv(1024)
+        peers.append(client_end)
+    return peers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--settle", type=float, default=WRITER_IDLE_TIMEOUT + 2,
+                        help="seconds to wait before measuring, the idle writer threads exit in the meantime")
+    args = parser.parse_args()
+    raise_open_file_limit(2 * args.connections + 64)
+
+    event_logger = EventLogger(log_file=None, level=logging.WARNING)
+    event_logger.start()
+    server = Server("127.0.0.1", 0, event_logger=event_logger)  # Not started, only its shared state is used
+
+    tracemalloc.start()
+    heap_before, _ = tracemalloc.get_traced_memory()
+    rss_before = get_rss_bytes()
+    started = time.perf_counter()
+    peers = open_idle_residents(server, args.connections)
+    elapsed = time.perf_counter() - started
+    time.sleep(args.settle)
+    heap_after, _ = tracemalloc.get_traced_memory()
+    rss_after = get_rss_bytes()
+
+    heap_per_connection = (heap_after - heap_before) / args.connections
+    rss_per_connection = (rss_after - rss_before) / args.connections
+    print(f"{args.connections} idle residents opened in {elapsed:.2f}s")
+    print(f"Threads: {threading.active_count()}")
+    print(f"Python heap: {heap_per_connection:,.0f} bytes per resident")
+    print(f"Resident set: {rss_per_connection:,.0f} bytes per resident "
+          f"({rss_per_connection * 10_000 / 2 ** 20:,.0f} MB for 10k residents)")
+
+    for peer in peers:
+        peer.close()
+    event_logger.stop()
+    os._exit(0)  # The connection threads are blocked in recv
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Measures the refresh time and the parsing CPU of every fetcher against the local upstream stand-in.
+
+Every source is refreshed --refreshes times. The refresh time is the wall time of a fetch call. The parse CPU is the
+CPU time the calling thread spends in the fetch call minus the CPU time of a bare HTTP request for the same page, so
+what remains is BeautifulSoup or the JSON decoding plus the conversions of the fetcher.
+
+The hedged weather refresh goes through the SourceSelector of the server, with weather.com slowed down by
+--scraper-latency so that open-meteo answers first:
+
+    python benchmarks/fetcher_refresh.py --refreshes 50 --padding-kb 300 --latency 0.05 --hedge-delay 0.5
+    python benchmarks/fetcher_refresh.py --layout-change weather.com --error-rate 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Currency import CurrencyDataFetcher  # noqa: E402
+from SourceSelector import DEFAULT_HEDGE_DELAY, DataSource, SourceSelector  # noqa: E402
+from Weather import WeatherDataFetcher, WeatherDataFetcherAPI  # noqa: E402
+from upstream_standin import UpstreamStandIn  # noqa: E402
+
+
+def measure(fetch, refreshes: int) -> tuple[list, list, int]:
+    """Returns the wall times and the CPU times of the successful refreshes, and the number of failed ones"""
+    wall_times, cpu_times, failures = [], [], 0
+    for _ in range(refreshes):
+        wall_started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            fetch()
+        except Exception:
+            failures += 1
+            continue
+        cpu_times.append(time.thread_time() - cpu_started)
+        wall_times.append(time.perf_counter() - wall_started)
+    return wall_times, cpu_times, failures
+
+
+def report(name: str, wall_times: list, cpu_times: list, failures: int, http_cpu: float | None = None) -> None:
+    if not wall_times:
+        print(f"{name:<28} every refresh failed ({failures})")
+        return
+    wall_times = sorted(wall_times)
+    p95 = wall_times[min(len(wall_times) - 1, int(len(wall_times) * 0.95))]
+    line = (f"{name:<28} refresh median {statistics.median(wall_times) * 1e3:8.2f} ms   p95 {p95 * 1e3:8.2f} ms"
+            f"   CPU {statistics.median(cpu_times) * 1e3:7.2f} ms")
+    if http_cpu is not None:
+        line += f"   parse CPU {max(0.0, statistics.median(cpu_times) - http_cpu) * 1e3:7.2f} ms"
+    print(line + f"   failed {failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refreshes", type=int, default=20)
+    parser.add_argument("--padding-kb", type=int, default=200, help="filler markup added to the HTML pages")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--layout-change", action="append", default=[],
+                        help="serve the page of this source with a layout its fetcher does not match")
+    parser.add_argument("--scraper-latency", type=float, default=3.0,
+                        help="latency of weather.com for the hedged weather refresh")
+    parser.add_argument("--hedge-delay", type=float, default=DEFAULT_HEDGE_DELAY,
+                        help="seconds before open-meteo is asked as well")
+    args = parser.parse_args()
+
+    stand_in = UpstreamStandIn(padding_kb=args.padding_kb)
+    stand_in.configure(latency=args.latency, error_rate=args.error_rate)
+    for name in args.layout_change:
+        stand_in.configure(name, layout_changed=True)
+    stand_in.start()
+
+    currency_data_fetcher = CurrencyDataFetcher()
+    weather_data_fetcher = WeatherDataFetcher()
+    weather_api_fetcher = WeatherDataFetcherAPI()
+    stand_in.point_fetchers_at(currency_data_fetcher, weather_data_fetcher, weather_api_fetcher)
+
+    fetchers = {
+        "doviz.com": (currency_data_fetcher.fetch_exchange_rates, currency_data_fetcher.url),
+        "weather.com": (lambda: weather_data_fetcher.fetch_weather_data(city='Manisa'), weather_data_fetcher.url),
+        "open-meteo": (weather_api_fetcher.get_manisa_weather_data, weather_api_fetcher.base_url),
+    }
+    for name, (fetch, url) in fetchers.items():
+        print(f"{name}: {len(stand_in.bodies[name][0]) / 1024:,.0f} KB page")
+        _, http_cpu_times, _ = measure(lambda: requests.get(url, timeout=10).content, args.refreshes)
+        http_cpu = statistics.median(http_cpu_times) if http_cpu_times else None
+        report(name, *measure(fetch, args.refreshes), http_cpu=http_cpu)
+
+    stand_in.configure("weather.com", latency=args.scraper_latency)
+    weather_sources = SourceSelector([
+        DataSource("weather.com", fetchers["weather.com"][0]),
+        DataSource("open-meteo", fetchers["open-meteo"][0])], hedge_delay=args.hedge_delay)
+    report("hedged weather refresh", *measure(weather_sources.fetch, args.refreshes))
+    print(f"Circuit breakers: {weather_sources.get_states()}")
+
+    weather_sources.shutdown()
+    stand_in.stop()
+    os._exit(0)  # The hedged requests to the slow scraper may still be waiting
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Replays a traffic capture of the server against another server and reports its latency and throughput.
+
+Capture the traffic of a production server, then replay it against a local server that runs the change to compare:
+
+    python Server.py --port 8080 --capture production.cap
+    python Server.py --port 9100 --handoff-path test.handoff
+    python benchmarks/traffic_replay.py production.cap --port 9100 --speed 10
+
+Every connection of the capture gets a connection of its own that sends the same reads, at their recorded times
+divided by --speed. A connection sends its next read only after the previous one was answered, so that every
+response is matched to the read it answers: at 1x the recorded gaps are longer than the answers anyway, accelerated
+replays become closed-loop per connection while the connections still overlap as they did in production. The max
+lag tells how far behind its schedule the replay fell.
+
+The latency of a request is the time from sending it to the first read of its connection that completes a response.
+Pushed messages (chat, direct messages, announcements, alerts, pings, document chunks) are not responses, every frame
+of the streams of a gateway is. Sessions can not be resumed on another server, and the links of the servers of other
+blocks are not replayed.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+import TrafficCapture  # noqa: E402
+
+RESPONSE_TIMEOUT = 5.0  # seconds a request waits for its response before it is counted as unanswered
+START_DELAY = 0.2  # seconds for every connection thread to start before the first record is due
+# A read can hold pushed messages and a response in any order, the frames are split out of it and a response is a
+# frame that starts with one of these
+RESPONSE_MARKERS = (
+    AkinProtocol.OK, AkinProtocol.ERROR, AkinProtocol.REGISTER_USER, AkinProtocol.RESUME_REQUEST,
+    AkinProtocol.WEATHER_GET, AkinProtocol.CURRENCY_GET, AkinProtocol.BATCH_REQUEST, AkinProtocol.CONVERT_REQUEST,
+    AkinProtocol.ALERT_REQUEST, AkinProtocol.SEARCH_REQUEST, AkinProtocol.DOCUMENT_LIST_REQUEST,
+    AkinProtocol.ENTRY_REPORT_REQUEST, AkinProtocol.PONG_RESPONSE, "Unknown command: ")
+CONNECTION_MESSAGES = (AkinProtocol.WELCOME_TO_THE_SERVER, AkinProtocol.PING_REQUEST)
+
+
+class ReplayedConnection(threading.Thread):
+    """Sends the recorded reads of one connection on schedule, its reader thread matches the responses"""
+
+    def __init__(self, connection_id: int, records: list, host: str, port: int, speed: float, started_at: float):
+        super().__init__(name=f"Replay-{connection_id}", daemon=True)
+        self.connection_id = connection_id
+        self.records = records  # (seconds since the first record, kind, payload)
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.started_at = started_at
+        self.socket: socket.socket | None = None
+        self.pending_since: float | None = None  # When the request that waits for its response was sent
+        self.condition = threading.Condition()
+        self.latencies: list[float] = []
+        self.requests = 0
+        self.unanswered = 0
+        self.received_bytes = 0
+        self.max_lag = 0.0
+        self.error: str | None = None
+
+    def run(self) -> None:
+        try:
+            for timestamp, kind, payload in self.records:
+                due = self.started_at + (timestamp / self.speed if self.speed > 0 else 0)
+                if (delay := due - time.perf_counter()) > 0:
+                    time.sleep(delay)
+                if kind == TrafficCapture.CLOSE:
+                    break
+                if self.socket is None:
+                    self.__connect()
+                if kind == TrafficCapture.DATA:
+                    self.__wait_for_response()
+                    self.max_lag = max(self.max_lag, time.perf_counter() - due)
+                    self.__send(payload)
+            if self.socket is not None:
+                self.__wait_for_response()
+        except OSError as e:
+            self.error = str(e)
+        finally:
+            if self.socket is not None:
+                self.socket.close()
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __connect(self) -> None:
+        self.socket = socket.create_connection((self.host, self.port))
+        threading.Thread(target=self.__read_responses, name=f"ReplayReader-{self.connection_id}", daemon=True).start()
+
+    def __send(self, payload: bytes) -> None:
+        if payload != AkinProtocol.PONG_RESPONSE.encode():  # Heartbeat answers are not answered
+            with self.condition:
+                self.requests += 1
+                self.pending_since = time.perf_counter()
+        self.socket.sendall(payload)
+
+    def __wait_for_response(self) -> None:
+        with self.condition:
+            if self.pending_since is not None and not self.condition.wait_for(lambda: self.pending_since is None,
+                                                                              RESPONSE_TIMEOUT):
+                self.unanswered += 1
+                self.pending_since = None
+
+    def __read_responses(self) -> None:
+        buffer = b""
+        while True:
+            try:
+                data = self.socket.recv(64 * 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            received_at = time.perf_counter()
+            self.received_bytes += len(data)
+            try:
+                buffer, answered = split_responses(buffer + data)
+            except ValueError as e:
+                self.error = f"invalid data from the server: {e}"
+                return
+            if not answered:
+                continue
+            with self.condition:
+                if self.pending_since is not None:
+                    self.latencies.append(received_at - self.pending_since)
+                    self.pending_since = None
+                    self.condition.notify_all()
+
+
+def split_responses(buffer: bytes) -> tuple[bytes, bool]:
+    """Splits the complete frames and document chunks out of the received bytes. Returns the bytes of the incomplete
+    one at the end, and True if one of them is a response."""
+    chunk_prefix = AkinProtocol.DOCUMENT_CHUNK_PREFIX
+    answered = False
+    while buffer:
+        if buffer.startswith(chunk_prefix):
+            chunk, buffer = AkinProtocol.split_document_chunk(buffer)
+            if chunk is None:
+                break
+            continue
+        frames, buffer = AkinProtocol.split_stream_frames(buffer, CONNECTION_MESSAGES, (chunk_prefix,))
+        answered = answered or any(
+            stream_id is not None and (stream_id != AkinProtocol.CONNECTION_STREAM_ID
+                                       or payload.startswith(RESPONSE_MARKERS))
+            for stream_id, payload in frames)
+        if not buffer.startswith(chunk_prefix):
+            break
+    return buffer, answered
+
+
+def load_capture(path: str) -> tuple[dict[int, list], int, float]:
+    """Returns the records of every connection with their times relative to the first record, the number of
+    connections that were links of other blocks, and the duration of the capture"""
+    connections: dict[int, list] = collections.defaultdict(list)
+    peer_links = set()
+    sending = set()  # The connections whose first read is already seen
+    first_timestamp = None
+    timestamp = 0.0
+    for timestamp, connection_id, kind, payload in TrafficCapture.read_capture(path):
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if kind == TrafficCapture.DATA and connection_id not in sending:
+            sending.add(connection_id)
+            if payload.startswith(AkinProtocol.PEER_HELLO.encode()):
+                peer_links.add(connection_id)
+        connections[connection_id].append((timestamp - first_timestamp, kind, payload))
+    for connection_id in peer_links:
+        del connections[connection_id]
+    duration = 0.0 if first_timestamp is None else timestamp - first_timestamp
+    return dict(connections), len(peer_links), duration
+
+
+def report(replayed: list[ReplayedConnection], peer_links: int, capture_duration: float, speed: float,
+           replay_duration: float) -> None:
+    latencies = sorted(latency for connection in replayed for latency in connection.latencies)
+    requests = sum(connection.requests for connection in replayed)
+    errors = [connection for connection in replayed if connection.error is not None]
+    print(f"capture      {len(replayed)} connections ({peer_links} block links skipped), {requests} requests "
+          f"over {capture_duration:.3f} s")
+    print(f"replay       {replay_duration:.3f} s at {f'{speed}x' if speed > 0 else 'full speed'}, "
+          f"{requests / replay_duration if replay_duration else 0:.1f} requests/s, "
+          f"{sum(connection.received_bytes for connection in replayed)} bytes received, "
+          f"max lag {max((connection.max_lag for connection in replayed), default=0) * 1e3:.1f} ms")
+    print(f"responses    {len(latencies)} answered, {sum(connection.unanswered for connection in replayed)} "
+          f"unanswered, {len(errors)} connections failed")
+    if latencies:
+        def percentile(fraction: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1e3
+        print(f"latency      median {statistics.median(latencies) * 1e3:.3f} ms   p95 {percentile(0.95):.3f} ms   "
+              f"p99 {percentile(0.99):.3f} ms   max {latencies[-1] * 1e3:.3f} ms")
+    for connection in errors[:5]:
+        print(f"connection {connection.connection_id} failed: {connection.error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="file written by a server started with --capture")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True, help="port of the server to replay the traffic against")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay X times faster than recorded, 0 replays every connection as fast as it can")
+    args = parser.parse_args()
+
+    connections, peer_links, capture_duration = load_capture(args.capture)
+    started_at = time.perf_counter() + START_DELAY
+    replayed = [ReplayedConnection(connection_id, records, args.host, args.port, args.speed, started_at)
+                for connection_id, records in connections.items()]
+    for connection in replayed:
+        connection.start()
+    for connection in replayed:
+        connection.join()
+    report(replayed, peer_links, capture_duration, args.speed, time.perf_counter() - started_at)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""A local stand-in for doviz.com, weather.com and the open-meteo API.
+
+It serves the recorded pages in benchmarks/fixtures, so the fetchers can be tested and benchmarked without the live
+sites. Every source can be made slow, made to fail with 503 responses, or served with a changed page layout that the
+fetcher's selectors no longer match:
+
+    python benchmarks/upstream_standin.py --port 8800 --latency 0.3 --error-rate 0.1 --layout-change weather.com
+
+Point a fetcher at it with point_fetchers_at, or by hand:
+
+    currency_data_fetcher.url = "http://127.0.0.1:8800/doviz/"
+    weather_data_fetcher.url = "http://127.0.0.1:8800/weather/"
+    weather_api_fetcher.base_url = "http://127.0.0.1:8800/open-meteo/v1/forecast?"
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PADDING_MARKER = "<!-- PADDING -->"
+# The live pages are hundreds of kilobytes, the fixtures keep only the markup around the values. Padding brings the
+# parsing cost back to the size of a real page.
+PADDING_ROW = '<div class="news-item"><a href="/haber"><span class="title">Piyasalarda gün sonu</span></a></div>\n'
+
+
+class Source:
+    """A page of the stand-in and the ways it can misbehave"""
+    __slots__ = ('name', 'path', 'fixture', 'content_type', 'layout_changes', 'latency', 'jitter', 'error_rate',
+                 'layout_changed', 'requests_served')
+
+    def __init__(self, name: str, path: str, fixture: str, content_type: str, layout_changes: dict):
+        self.name = name
+        self.path = path
+        self.fixture = fixture
+        self.content_type = content_type
+        self.layout_changes = layout_changes  # old markup: new markup, as a site redesign would change it
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.error_rate = 0.0
+        self.layout_changed = False
+        self.requests_served = 0
+
+
+def get_sources() -> dict[str, Source]:
+    return {source.name: source for source in (
+        Source("doviz.com", "/doviz/", "doviz.html", "text/html; charset=utf-8",
+               {'class="market-data"': 'class="market-data-v2"'}),
+        Source("weather.com", "/weather/", "weather_com.html", "text/html; charset=utf-8",
+               {"CurrentConditions--primary--2DOqs": "CurrentConditions--primary--1kRyW"}),
+        Source("open-meteo", "/open-meteo/", "open_meteo.json", "application/json",
+               {'"current_weather":': '"current":'}),
+    )}
+
+
+class UpstreamStandIn:
+    """Serves the fixtures on a background thread, the behaviour of a source can be changed while it is running"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, padding_kb: int = 0):
+        self.sources = get_sources()
+        self.bodies: dict[str, tuple[bytes, bytes]] = {}  # name: (page, page with the changed layout)
+        for source in self.sources.values():
+            with open(os.path.join(FIXTURES_DIR, source.fixture), encoding="utf-8") as fixture:
+                page = fixture.read()
+            page = page.replace(PADDING_MARKER, PADDING_ROW * (padding_kb * 1024 // len(PADDING_ROW)))
+            changed_page = page
+            for old, new in source.layout_changes.items():
+                changed_page = changed_page.replace(old, new)
+            self.bodies[source.name] = (page.encode(), changed_page.encode())
+        self.http_server = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.http_server.daemon_threads = True
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def configure(self, name: str | None = None, latency: float | None = None, jitter: float | None = None,
+                  error_rate: float | None = None, layout_changed: bool | None = None) -> None:
+        """Changes one source, or every source if no name is given. None keeps the current value"""
+        for source in (self.sources.values() if name is None else [self.sources[name]]):
+            if latency is not None:
+                source.latency = latency
+            if jitter is not None:
+                source.jitter = jitter
+            if error_rate is not None:
+                source.error_rate = error_rate
+            if layout_changed is not None:
+                source.layout_changed = layout_changed
+
+    def point_fetchers_at(self, currency_fetcher=None, weather_fetcher=None, weather_api_fetcher=None) -> None:
+        if currency_fetcher is not None:
+            currency_fetcher.url = self.base_url + self.sources["doviz.com"].path
+        if weather_fetcher is not None:
+            weather_fetcher.url = self.base_url + self.sources["weather.com"].path
+        if weather_api_fetcher is not None:
+            weather_api_fetcher.base_url = self.base_url + self.sources["open-meteo"].path + "v1/forecast?"
+
+    ### -------------- ###
+    ### Helper Methods ###
+    ### -------------- ###
+
+    def __make_handler(self):
+        stand_in = self
+
+        class StandInRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                source = next((source for source in stand_in.sources.values() if self.path.startswith(source.path)),
+                              None)
+                if source is None:
+                    self.send_error(404)
+                    return
+                source.requests_served += 1
+                delay = source.latency + random.uniform(0, source.jitter)
+                if delay:
+                    time.sleep(delay)
+                if random.random() < source.error_rate:
+                    self.send_error(503, "Service Unavailable")
+                    return
+                body = stand_in.bodies[source.name][source.layout_changed]
+                self.send_response(200)
+                self.send_header("Content-Type", source.content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # One line per request would drown the benchmark output
+
+        return StandInRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to X more seconds of random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--padding-kb", type=int, default=0, help="filler markup added to the HTML pages")
+    parser.add_argument("--layout-change", action="append", default=[], choices=sorted(get_sources()),
+                        help="serve the page of this source with a layout its fetcher does not match")
+    args = parser.parse_args()
+
+    stand_in = UpstreamStandIn(args.host, args.port, args.padding_kb)
+    stand_in.configure(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    for name in args.layout_change:
+        stand_in.configure(name, layout_changed=True)
+    stand_in.start()
+    print(f"Serving the upstream stand-in on {stand_in.base_url}")
+    for source in stand_in.sources.values():
+        print(f"  {source.name:<12} {stand_in.base_url}{source.path}")
+    try:
+        stand_in.thread.join()
+    except KeyboardInterrupt:
+        stand_in.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import requests
 from bs4 import BeautifulSoup
 
+from SourceSelector import REQUEST_TIMEOUT
+
 
 class CurrencyDataFetcher:
     EMPTY_CURRENCY_DATA = {'USD': 0, 'EUR': 0, 'GOLD_GR': 0, 'GBP': 0, 'BTC': 0}
@@ -22,7 +24,7 @@ class CurrencyDataFetcher:
         return f"body > header > div.header-secondary > div > div.market-data > div:nth-child({n}) > a > span.value"
 
     def fetch_exchange_rates(self) -> dict:
-        html = requests.get(self.url).content
+        html = requests.get(self.url, timeout=REQUEST_TIMEOUT).content
         soup = BeautifulSoup(html, "html.parser")
 
         usd = soup.select_one(self.usd_selector).text
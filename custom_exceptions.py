@@ -56,3 +56,23 @@ class NameShouldBeStringError(Exception):
 
 class NoServersFoundOnThisHostAndPortError(Exception):
     pass
+
+
+class InvalidChannelNameError(Exception):
+    pass
+
+
+class ChannelAccessDeniedError(Exception):
+    pass
+
+
+class InvalidAlertError(Exception):
+    pass
+
+
+class DataSourceUnavailableError(Exception):
+    pass
+
+
+class NoServersDiscoveredError(Exception):
+    pass
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ChatSearchIndex import ChatSearchIndex  # noqa: E402
+
+
+class ChatSearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = ChatSearchIndex()
+        self.index.add(1, "general", "[09:15:00] [No:12] Ayşe: Su kesintisi ne zaman bitecek?")
+        self.index.add(2, "general", "[09:16:30] [No:4] Mehmet: Yarın sabah, no: 12 yazıyor")
+        self.index.add(3, "lobby", "[10:00:00] [No:12] Ayşe: Çay hazır")
+
+    def test_sender_header_is_not_indexed(self):
+        self.assertEqual(self.index.search("ayse"), (0, []))
+        self.assertEqual(self.index.search("mehmet"), (0, []))
+        self.assertEqual(self.index.search("09"), (0, []))
+        total, results = self.index.search("12")
+        self.assertEqual(total, 1)
+        self.assertEqual(results[0][0], 2)
+
+    def test_words_and_prefixes_of_the_text_match(self):
+        total, results = self.index.search("kesinti")
+        self.assertEqual((total, [sequence_no for sequence_no, _, _ in results]), (1, [1]))
+        total, results = self.index.search("cay")
+        self.assertEqual((total, results), (1, [(3, "lobby", "[10:00:00] [No:12] Ayşe: Çay hazır")]))
+
+    def test_evicted_messages_leave_the_vocabulary(self):
+        self.index.max_messages = 2
+        self.index.add(4, "general", "[11:00:00] [No:7] Zeynep: Teşekkürler")
+        self.assertEqual(self.index.search("kesinti"), (0, []))
+        self.assertNotIn("kesintisi", self.index.vocabulary)
+        self.assertEqual(self.index.vocabulary, sorted(self.index.vocabulary))
+
+
+if __name__ == '__main__':
+    unittest.main()
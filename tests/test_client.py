@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+from Client import Client, ClientListenerThread, ResidentRequests  # noqa: E402
+from ClientCard import ClientCard  # noqa: E402
+
+RECEIVE_TIMEOUT = 2.0
+
+
+def frame(message: str) -> bytes:
+    return AkinProtocol.construct_connection_frame(message).encode()
+
+
+def chat(text: str, sequence_no: int) -> bytes:
+    return frame(AkinProtocol.construct_chat_message(text, AkinProtocol.DEFAULT_CHANNEL, sequence_no))
+
+
+class ClientTestCase(unittest.TestCase):
+    """A client whose socket is one end of a socket pair, the test writes what the server would to the other end"""
+
+    def setUp(self):
+        self.client = Client("127.0.0.1", 0)
+        self.client.socket.close()
+        self.client.socket, self.server_end = socket.socketpair()
+        self.listener = ClientListenerThread(self.client, self.client.message_queue)
+        self.listener.daemon = True
+        self.listener.start()
+        # Run last to first: the server end is closed, which ends the listener thread
+        self.addCleanup(self.client.close_connection)
+        self.addCleanup(self.listener.join, RECEIVE_TIMEOUT)
+        self.addCleanup(self.server_end.close)
+
+    def receive(self, count: int) -> list[str]:
+        return [self.client.message_queue.get(timeout=RECEIVE_TIMEOUT) for _ in range(count)]
+
+    def assert_nothing_received(self):
+        with self.assertRaises(queue.Empty):
+            self.client.message_queue.get(timeout=0.2)
+
+
+class MessageFramingTest(ClientTestCase):
+    def test_messages_in_one_read_are_all_handled(self):
+        self.server_end.sendall(b"".join(chat(f"message {n}", n) for n in range(1, 9)))
+        self.assertEqual(self.receive(8), [f"message {n}" for n in range(1, 9)])
+        self.assertEqual(self.client.last_sequence_no, 8)
+
+    def test_message_split_over_several_reads(self):
+        data = chat("split message", 1) + chat("next message", 2)
+        for start in range(0, len(data), 7):
+            self.server_end.sendall(data[start:start + 7])
+        self.assertEqual(self.receive(2), ["split message", "next message"])
+
+    def test_weather_and_currency_in_one_read(self):
+        weather = dict(AkinProtocol.DEFAULT_WEATHER_DICT, temperature_celcius=21.5)
+        currency = dict(AkinProtocol.DEFAULT_CURRENCY_DICT, USD=18.7)
+        self.server_end.sendall(frame(f"{AkinProtocol.WEATHER_GET}{weather}")
+                                + frame(f"{AkinProtocol.CURRENCY_GET}{currency}") + chat("after", 1))
+        self.assertEqual(self.receive(1), ["after"])
+        self.assertEqual(self.client.weather_data, weather)
+        self.assertEqual(self.client.currency_data, currency)
+
+    def test_ping_and_messages_in_one_read(self):
+        self.server_end.sendall(chat("before", 1) + AkinProtocol.PING_REQUEST.encode() + chat("after", 2))
+        self.assertEqual(self.receive(2), ["before", "after"])
+        self.server_end.settimeout(RECEIVE_TIMEOUT)
+        self.assertEqual(self.server_end.recv(1024), frame(AkinProtocol.PONG_RESPONSE))
+
+    def test_document_chunks_between_messages(self):
+        download_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, download_directory)
+        self.client.download_directory = download_directory
+        self.server_end.settimeout(RECEIVE_TIMEOUT)
+        self.client.download_document("minutes.txt")
+        self.server_end.recv(1024)  # The download request
+        document = b"STR" + AkinProtocol.DELIMITER.encode() + b"raw bytes that look like a frame"
+        half = len(document) // 2
+        data = (AkinProtocol.construct_document_chunk_header("minutes.txt", 0, half, len(document)).encode()
+                + document[:half] + chat("between the chunks", 1)
+                + AkinProtocol.construct_document_chunk_header("minutes.txt", half, len(document) - half,
+                                                               len(document)).encode()
+                + document[half:] + chat("after the document", 2))
+        for start in range(0, len(data), 5):
+            self.server_end.sendall(data[start:start + 5])
+        messages = self.receive(3)
+        self.assertEqual(messages[0], "between the chunks")
+        self.assertTrue(messages[1].startswith("[Document] minutes.txt"))
+        self.assertEqual(messages[2], "after the document")
+        with open(os.path.join(download_directory, "minutes.txt"), "rb") as downloaded:
+            self.assertEqual(downloaded.read(), document)
+
+
+class SequenceNumberTest(ClientTestCase):
+    def test_messages_received_before_a_resume_are_dropped(self):
+        self.server_end.sendall(chat("first", 1) + chat("second", 2))
+        self.assertEqual(self.receive(2), ["first", "second"])
+        self.server_end.sendall(chat("second", 2) + chat("third", 3))
+        self.assertEqual(self.receive(1), ["third"])
+        self.assert_nothing_received()
+
+    def test_new_session_starts_a_new_sequence(self):
+        self.client.last_sequence_no = 40
+        self.server_end.sendall(frame(AkinProtocol.construct_session_response(AkinProtocol.REGISTER_USER, "card",
+                                                                              "new-token"))
+                                + chat("first of the new session", 1))
+        self.assertEqual(self.receive(1), ["first of the new session"])
+        self.assertEqual(self.client.session_token, "new-token")
+
+    def test_expired_session_is_registered_again(self):
+        card = ClientCard("Resident", 3)
+        self.client.register_client(card)
+        self.client.subscribe_to_message_channel("lobby")
+        self.server_end.settimeout(RECEIVE_TIMEOUT)
+        self.server_end.recv(1024)  # The register and subscribe requests
+        self.client.session_token, self.client.last_sequence_no, self.client.resuming = "old-token", 40, True
+        self.server_end.sendall(frame(f"{AkinProtocol.ERROR}Session expired, please scan your card again"))
+        self.assertEqual(self.server_end.recv(1024), frame(AkinProtocol.construct_batch([
+            AkinProtocol.register_client_to_server(card), AkinProtocol.construct_subscribe_request("lobby")])))
+        self.assertIsNone(self.client.session_token)
+        self.assertEqual(self.client.last_sequence_no, 0)
+        self.server_end.sendall(chat("first of the new session", 1))
+        self.assertEqual(self.receive(1), ["first of the new session"])
+
+
+class ResidentRequestsTest(unittest.TestCase):
+    def test_resident_without_send_message_can_not_be_created(self):
+        class Resident(ResidentRequests):
+            pass
+
+        with self.assertRaises(TypeError):
+            Resident()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import EntryLog  # noqa: E402
+
+# Noon of a day in the middle of a month, so that a few hours before and after it stay in the same partition
+DAY = time.mktime((2026, 9, 15, 12, 0, 0, 0, 0, -1))
+
+
+class EntryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_log(self) -> EntryLog.EntryLog:
+        entry_log = EntryLog.EntryLog(os.path.join(self.directory, "entries"))
+        self.addCleanup(entry_log.close)
+        return entry_log
+
+    def test_reports_count_the_entries_only(self):
+        entry_log = self.open_log()
+        entry_log.record(EntryLog.REGISTER, "card-1", 1, DAY)
+        entry_log.record(EntryLog.RESUME, "card-1", 1, DAY + 60)
+        entry_log.record(EntryLog.EXIT, "card-1", 1, DAY + 120)
+        entry_log.record(EntryLog.REGISTER, "card-2", 2, DAY + 3600)
+        hours = entry_log.get_entries_per_hour(DAY, DAY + 7200)
+        self.assertEqual(sum(hours), 3)
+        self.assertEqual(hours[12], 2)
+        self.assertEqual(hours[13], 1)
+        self.assertEqual(entry_log.get_entries_per_hour(DAY, DAY + 7200, apartment_no=2)[13], 1)
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 7200), {1: 2, 2: 1})
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY + 60, DAY + 3600), {1: 1})
+
+    def test_events_are_read_back_by_a_new_process(self):
+        entry_log = self.open_log()
+        for event_no in range(50):
+            entry_log.record(EntryLog.REGISTER, f"card-{event_no % 5}", event_no % 5, DAY + event_no)
+        entry_log.close()
+        entry_log = self.open_log()
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 50), {n: 10 for n in range(5)})
+        entry_log.record(EntryLog.REGISTER, "card-new", 9, DAY + 60)
+        self.assertEqual(entry_log.card_ids[-1], "card-new")
+
+    def test_reload_sees_the_cards_and_events_of_another_process(self):
+        successor = self.open_log()  # Opened before the previous process hands over, like a hot restart
+        predecessor = self.open_log()
+        predecessor.record(EntryLog.REGISTER, "card-1", 1, DAY)
+        predecessor.record(EntryLog.REGISTER, "card-2", 2, DAY + 1)
+        predecessor.close()
+        successor.reload()
+        successor.record(EntryLog.REGISTER, "card-3", 3, DAY + 2)
+        self.assertEqual(successor.card_ids, ["card-1", "card-2", "card-3"])
+        successor.close()
+        entry_log = self.open_log()
+        self.assertEqual(entry_log.card_ids, ["card-1", "card-2", "card-3"])
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 10), {1: 1, 2: 1, 3: 1})
+        self.assertEqual(list(entry_log.partitions["2026-09"].columns['cards']), [0, 1, 2])
+
+    def test_torn_event_and_card_are_cut_on_load(self):
+        entry_log = self.open_log()
+        entry_log.record(EntryLog.REGISTER, "card-1", 1, DAY)
+        entry_log.close()
+        month = os.path.join(self.directory, "entries", "2026-09")
+        with open(os.path.join(month, "timestamps.q"), "ab") as column_file:
+            column_file.write(b"\0" * 8)
+        with open(os.path.join(self.directory, "entries", EntryLog.CARD_DICTIONARY_FILE), "a") as card_file:
+            card_file.write('"card-')
+        entry_log = self.open_log()
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 10), {1: 1})
+        self.assertEqual(os.path.getsize(os.path.join(month, "timestamps.q")), 8)
+        entry_log.record(EntryLog.REGISTER, "card-2", 2, DAY + 5)
+        entry_log.close()
+        entry_log = self.open_log()
+        self.assertEqual(entry_log.card_ids, ["card-1", "card-2"])
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 10), {1: 1, 2: 1})
+
+    def test_apartment_number_out_of_range_leaves_the_columns_aligned(self):
+        entry_log = self.open_log()
+        entry_log.record(EntryLog.REGISTER, "card-1", 1, DAY)
+        with self.assertRaises(ValueError):
+            entry_log.record(EntryLog.REGISTER, "card-2", 2 ** 40, DAY + 1)
+        entry_log.record(EntryLog.REGISTER, "card-3", 3, DAY + 2)
+        month = os.path.join(self.directory, "entries", "2026-09")
+        for name, typecode in EntryLog.COLUMNS:
+            self.assertEqual(len(entry_log.partitions["2026-09"].columns[name]), 2, name)
+            self.assertEqual(os.path.getsize(os.path.join(month, f"{name}.{typecode}")),
+                             2 * entry_log.partitions["2026-09"].columns[name].itemsize, name)
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 10), {1: 1, 3: 1})
+
+    def test_clock_going_back_keeps_the_timestamps_sorted(self):
+        entry_log = self.open_log()
+        entry_log.record(EntryLog.REGISTER, "card-1", 1, DAY + 100)
+        entry_log.record(EntryLog.REGISTER, "card-2", 2, DAY)
+        timestamps = entry_log.partitions["2026-09"].columns['timestamps']
+        self.assertEqual(list(timestamps), sorted(timestamps))
+
+    def test_anomalies(self):
+        entry_log = self.open_log()
+        night = time.mktime((2026, 9, 15, 2, 30, 0, 0, 0, -1))
+        entry_log.record(EntryLog.REGISTER, "card-night", 4, night)
+        for event_no in range(EntryLog.BURST_LIMIT + 1):
+            entry_log.record(EntryLog.REGISTER, "card-burst", 5, DAY + event_no)
+        anomalies = entry_log.get_anomalies(night, DAY + 3600)
+        self.assertIn(("night", "4", 1), anomalies)
+        self.assertIn(("burst", f"card-burst {time.strftime('%d.%m.%Y %H:00', time.localtime(DAY))}",
+                       EntryLog.BURST_LIMIT + 1), anomalies)
+
+    def test_empty_log(self):
+        entry_log = self.open_log()
+        self.assertEqual(entry_log.get_entries_per_hour(DAY, DAY + 3600), [0] * 24)
+        self.assertEqual(entry_log.get_entries_per_apartment(DAY, DAY + 3600), {})
+        self.assertEqual(entry_log.get_anomalies(DAY, DAY + 3600), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import EventLogger as ev  # noqa: E402
+from EventLogger import EventLogger  # noqa: E402
+
+RECEIVE_TIMEOUT = 2.0
+
+
+class EventLoggerTest(unittest.TestCase):
+    def create_logger(self, level: int = logging.INFO) -> tuple[EventLogger, queue.Queue]:
+        event_logger = EventLogger(log_file=None, level=level)
+        subscriber_queue = event_logger.subscribe(logging.DEBUG)
+        event_logger.start()
+        self.addCleanup(event_logger.stop)
+        return event_logger, subscriber_queue
+
+    def test_instances_with_the_same_name_keep_their_own_events(self):
+        first, first_queue = self.create_logger()
+        second, second_queue = self.create_logger(logging.WARNING)
+        first.info(ev.SERVER, "first %s", 1)
+        second.warning(ev.SERVER, "second %s", 2)
+        second.info(ev.SERVER, "below the level of the second")
+        first.stop()
+        second.stop()
+        self.assertIn("first 1", first_queue.get(timeout=RECEIVE_TIMEOUT))
+        self.assertIn("second 2", second_queue.get(timeout=RECEIVE_TIMEOUT))
+        self.assertTrue(first_queue.empty())
+        self.assertTrue(second_queue.empty())
+
+    def test_handlers_of_the_named_logger_are_left_alone(self):
+        handler = logging.NullHandler()
+        named_logger = logging.getLogger("cins.server")
+        named_logger.addHandler(handler)
+        self.addCleanup(named_logger.removeHandler, handler)
+        self.create_logger()
+        self.assertIn(handler, named_logger.handlers)
+
+
+if __name__ == '__main__':
+    unittest.main()
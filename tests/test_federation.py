@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+from EventLogger import EventLogger  # noqa: E402
+from Federation import HELLO_MAX_AGE, Federation, PeerLink  # noqa: E402
+
+SECRET = "shared by every block"
+
+
+def sign_hello(node_id: str, sent_at: float, secret: str = SECRET) -> str:
+    sent_at = format(sent_at, '.3f')
+    proof = hmac.new(secret.encode(), f"{node_id}{AkinProtocol.DELIMITER}{sent_at}".encode(), hashlib.sha256)
+    return AkinProtocol.construct_peer_hello(node_id, sent_at, proof.hexdigest())
+
+
+class FederationFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.chat_messages = []
+        self.feeds = []
+        event_logger = EventLogger(log_file=None, level=logging.CRITICAL)
+        self.federation = Federation("block-b", [], lambda channel, message: self.chat_messages.append(message),
+                                     lambda message: None, self.receive_feed, event_logger, SECRET)
+        self.addCleanup(self.federation.stop)
+        self.link = PeerLink("block-a", lambda frame: True, lambda: None)
+        self.message_ids = iter(range(1, 100))
+
+    def receive_feed(self, command: str, data: dict) -> None:
+        float(data.get('USD', 0))  # The server converts the currencies like this
+        self.feeds.append((command, data))
+
+    def relayed(self, message: str) -> str:
+        return AkinProtocol.construct_federated_message("block-a", str(next(self.message_ids)), ["block-a"], message)
+
+    def test_invalid_messages_are_skipped(self):
+        self.federation.handle_frame(self.link, AkinProtocol.construct_batch([
+            "not a relayed message",
+            self.relayed(AkinProtocol.construct_weather_response("{not json")),
+            self.relayed(AkinProtocol.construct_currency_response("[1, 2]")),
+            self.relayed(AkinProtocol.construct_currency_response('{"USD": [1, 2]}')),
+            self.relayed(AkinProtocol.construct_chat_message("still delivered")),
+        ]))
+        self.assertEqual(self.chat_messages, ["still delivered"])
+        self.assertEqual(self.feeds, [])
+        self.assertFalse(self.federation.feed_origins)
+
+    def test_feed_is_handed_over(self):
+        weather = dict(AkinProtocol.DEFAULT_WEATHER_DICT, temperature_celcius=21.5)
+        self.federation.handle_frame(self.link, AkinProtocol.construct_batch([
+            self.relayed(AkinProtocol.construct_weather_response(json.dumps(weather)))]))
+        self.assertEqual(self.feeds, [(AkinProtocol.WEATHER, weather)])
+
+
+class FederationLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.federation = Federation("block-b", [], lambda channel, message: None, lambda message: None,
+                                     lambda command, data: None, EventLogger(log_file=None, level=logging.CRITICAL),
+                                     SECRET)
+        self.addCleanup(self.federation.stop)
+        self.sent_frames = []
+
+    def accept(self, hello: str) -> PeerLink:
+        return self.federation.accept_link(hello, self.sent_frames.append, lambda: None)
+
+    def test_signed_hello_is_linked_and_answered_with_a_signed_hello(self):
+        link = self.accept(sign_hello("block-a", time.time()))
+        self.assertEqual(link.node_id, "block-a")
+        frames, _ = AkinProtocol.split_stream_frames(self.sent_frames[0].encode())
+        greeting = AkinProtocol.parse_peer_hello(frames[0][1])
+        self.assertEqual(AkinProtocol.construct_peer_hello(greeting['node_id'], greeting['sent_at'], greeting['proof']),
+                         sign_hello("block-b", float(greeting['sent_at'])))
+
+    def test_hello_without_the_secret_is_refused(self):
+        for hello in (AkinProtocol.PEER_HELLO + "block-a", sign_hello("block-a", time.time(), "guessed"),
+                      sign_hello("block-a", time.time() - HELLO_MAX_AGE - 1)):
+            with self.assertRaises(ValueError):
+                self.accept(hello)
+        self.assertEqual(self.federation.get_links(), {})
+        self.assertEqual(self.sent_frames, [])
+
+    def test_federation_without_a_secret_can_not_be_created(self):
+        with self.assertRaises(ValueError):
+            Federation("block-c", [], None, None, None, EventLogger(log_file=None), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Inbox import SWEEP_INTERVAL, InboxStore  # noqa: E402
+
+
+class InboxStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_store(self, **bounds) -> InboxStore:
+        store = InboxStore(os.path.join(self.directory, "inboxes"), **bounds)
+        self.addCleanup(store.close)
+        return store
+
+    def test_take_returns_the_messages_oldest_first_and_empties_the_inbox(self):
+        store = self.open_store()
+        store.append(7, "first")
+        store.append(7, "second")
+        self.assertEqual([message for _, message in store.take(7)], ["first", "second"])
+        self.assertEqual(store.take(7), [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "inboxes", "7")))
+
+    def test_compaction_keeps_the_newest_messages_readable(self):
+        store = self.open_store(max_messages=5)
+        for message_no in range(12):
+            store.append(7, f"message {message_no}")
+        self.assertEqual([message for _, message in store.take(7)], [f"message {n}" for n in range(7, 12)])
+
+    def test_compaction_over_several_segments(self):
+        store = self.open_store(max_messages=5, segment_size=100)
+        for message_no in range(40):
+            store.append(7, f"message {message_no}")
+        self.assertEqual([message for _, message in store.take(7)], [f"message {n}" for n in range(35, 40)])
+
+    def test_compacted_inbox_is_read_back_by_a_new_process(self):
+        store = self.open_store(max_messages=5)
+        for message_no in range(12):
+            store.append(7, f"message {message_no}")
+        store.close()
+        self.assertEqual([message for _, message in self.open_store(max_messages=5).take(7)],
+                         [f"message {n}" for n in range(7, 12)])
+
+    def test_torn_record_is_dropped_on_load(self):
+        store = self.open_store()
+        store.append(7, "kept")
+        store.append(7, "torn")
+        store.close()
+        segment_path = os.path.join(self.directory, "inboxes", "7", "00000001.seg")
+        os.truncate(segment_path, os.path.getsize(segment_path) - 2)
+        store = self.open_store()
+        self.assertEqual(store.get_sizes(), {})
+        store.append(7, "after the crash")
+        self.assertEqual([message for _, message in store.take(7)], ["kept", "after the crash"])
+
+    def test_message_larger_than_the_inbox_is_rejected(self):
+        store = self.open_store(max_bytes=64)
+        with self.assertRaises(ValueError):
+            store.append(7, "x" * 64)
+
+    def test_sweep_removes_the_inboxes_nobody_came_back_for(self):
+        store = self.open_store(ttl=60)
+        with mock.patch("Inbox.time.time", return_value=time.time() - 120):
+            store.append(7, "stale")
+        store.append(8, "fresh")
+        store.last_sweep -= SWEEP_INTERVAL
+        self.assertEqual(store.remove_expired(), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "inboxes", "7")))
+        self.assertEqual(store.get_sizes(), {})  # The inbox that is left is closed until it is used again
+        self.assertEqual([message for _, message in store.take(8)], ["fresh"])
+
+    def test_sweep_runs_once_every_interval(self):
+        store = self.open_store(ttl=0)
+        store.append(7, "stale")
+        self.assertEqual(store.remove_expired(), 0)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "inboxes", "7")))
+
+
+if __name__ == '__main__':
+    unittest.main()
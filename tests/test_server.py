@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AkinProtocol  # noqa: E402
+from ClientCard import ClientCard  # noqa: E402
+from EventLogger import EventLogger  # noqa: E402
+from Server import ClientThread, Server  # noqa: E402
+
+RECEIVE_TIMEOUT = 2.0
+
+
+def frame(message: str) -> bytes:
+    return AkinProtocol.construct_connection_frame(message).encode()
+
+
+class ClientThreadTest(unittest.TestCase):
+    """A connection of a server that is not started, the test is the client on the other end of a socket pair"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)  # The stores of the server are created in the working directory
+        self.server = Server("127.0.0.1", 0, event_logger=EventLogger(log_file=None, level=logging.CRITICAL),
+                             discovery_port=None)
+        self.addCleanup(self.server.entry_log.close)
+        self.addCleanup(self.server.inbox_store.close)
+        server_end, self.client_end = socket.socketpair()
+        self.client_end.settimeout(RECEIVE_TIMEOUT)
+        self.connection = ClientThread(next(self.server.connection_ids), server_end, "test", self.server.context)
+        self.connection.daemon = True
+        self.connection.start()
+        self.addCleanup(self.connection.join, RECEIVE_TIMEOUT)
+        self.addCleanup(self.client_end.close)
+        self.buffer = self.client_end.recv(len(AkinProtocol.WELCOME_TO_THE_SERVER))
+
+    def receive(self, count: int) -> list[str]:
+        messages = []
+        self.buffer = b""
+        while len(messages) < count:
+            self.buffer += self.client_end.recv(4096)
+            frames, self.buffer = AkinProtocol.split_stream_frames(self.buffer, (AkinProtocol.PING_REQUEST,))
+            messages.extend(payload for stream_id, payload in frames if stream_id is not None)
+        return messages
+
+    def test_requests_in_one_read_are_all_answered(self):
+        self.client_end.sendall(frame(AkinProtocol.register_client_to_server(ClientCard("Resident", 3)))
+                                + frame(AkinProtocol.construct_subscribe_request())
+                                + frame(AkinProtocol.WEATHER_GET))
+        responses = self.receive(3)
+        self.assertTrue(responses[0].startswith(AkinProtocol.REGISTER_USER))
+        self.assertTrue(responses[1].startswith(AkinProtocol.OK))
+        self.assertTrue(responses[2].startswith(AkinProtocol.WEATHER_GET))
+        self.assertFalse(self.connection.multiplexed)
+
+    def test_request_after_a_heartbeat_answer_in_one_read(self):
+        self.client_end.sendall(AkinProtocol.PONG_RESPONSE.encode() + frame(AkinProtocol.CURRENCY_GET))
+        self.assertTrue(self.receive(1)[0].startswith(AkinProtocol.CURRENCY_GET))
+
+    def test_request_split_over_several_reads(self):
+        data = frame(AkinProtocol.WEATHER_GET) + frame(AkinProtocol.CURRENCY_GET)
+        for start in range(0, len(data), 4):
+            self.client_end.sendall(data[start:start + 4])
+        responses = self.receive(2)
+        self.assertTrue(responses[0].startswith(AkinProtocol.WEATHER_GET))
+        self.assertTrue(responses[1].startswith(AkinProtocol.CURRENCY_GET))
+
+    def test_unknown_commands_are_profiled_under_one_name(self):
+        self.server.context.profiler.enabled = True  # Times the handlers without starting the sampler
+        self.client_end.sendall(frame("XYZ" + AkinProtocol.DELIMITER) + frame("no delimiter at all")
+                                + frame(AkinProtocol.WEATHER_GET) + frame(AkinProtocol.CURRENCY_GET))
+        self.receive(4)  # A request is timed before the next one is handled
+        timings = self.server.context.profiler.handler_timings.timings
+        self.assertEqual(timings["UNKNOWN"][0], 2)
+        self.assertEqual(timings[AkinProtocol.WEATHER][0], 1)
+        self.assertNotIn("XYZ", timings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import requests
 from bs4 import BeautifulSoup
 
+from SourceSelector import REQUEST_TIMEOUT
+
 
 class WeatherDataFetcherAPI:
     def __init__(self) -> None:
@@ -17,7 +19,7 @@ class WeatherDataFetcherAPI:
             "current_weather": str(current_weather).lower(),
         }
         construct_url = self.base_url + "&".join([f"{key}={value}" for key, value in params.items()])
-        response = requests.get(construct_url)
+        response = requests.get(construct_url, timeout=REQUEST_TIMEOUT)
         return self.__parse_weather_api_response(response.json())
 
     @staticmethod
@@ -43,7 +45,7 @@ class WeatherDataFetcher:
         self.night_temp_selector = "#WxuCurrentConditions-main-eb4b02cb-917b-45ec-97ec-d4eb947f6b6a > div > section > div > div.CurrentConditions--body--l_4-Z > div.CurrentConditions--columns--30npQ > div.CurrentConditions--primary--2DOqs > div.CurrentConditions--tempHiLoValue--3T1DG > span:nth-child(2)"
 
     def parse_weather(self):
-        html = requests.get(self.url).content
+        html = requests.get(self.url, timeout=REQUEST_TIMEOUT).content
         soup = BeautifulSoup(html, "html.parser")
 
         weather_description = soup.select_one(self.weather_description_selector).text